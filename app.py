@@ -1,266 +1,80 @@
 import streamlit as st
-import pandas as pd
-import io
 import os
+import uuid
 import tempfile
 from datetime import datetime
-import time
-import base64
-from pathlib import Path
-import sys
-import re
-import zipfile
-import subprocess
-import tempfile
-temp_dir = tempfile.gettempdir()
-
-# --- FUNÇÕES AUXILIARES (Mantidas exatamente como no original) ---
-
-def extrair_conteudo_odt(arquivo_bytes):
-    """Extrai o conteúdo de um arquivo ODT"""
-    with tempfile.NamedTemporaryFile(suffix='.odt', delete=False) as temp_file:
-        temp_file.write(arquivo_bytes)
-        temp_path = temp_file.name
-
-    try:
-        with zipfile.ZipFile(temp_path, 'r') as zip_ref:
-            content_xml = zip_ref.read('content.xml').decode('utf-8')
-        os.unlink(temp_path)
-        return content_xml
-    except Exception as e:
-        st.error(f"Erro ao extrair conteúdo do arquivo ODT: {str(e)}")
-        if os.path.exists(temp_path):
-             os.unlink(temp_path)
-        return None
-    finally:
-        # Garante que o arquivo temporário seja removido mesmo se ocorrer um erro inesperado antes do unlink
-        if 'temp_path' in locals() and os.path.exists(temp_path):
-            try:
-                os.unlink(temp_path)
-            except OSError:
-                pass # Ignora erros se o arquivo já foi removido
-
-def substituir_no_xml(content_xml, substituicoes):
-    """Substitui texto no conteúdo XML do arquivo ODT"""
-    texto_modificado = content_xml
-    substituicoes_feitas = 0
-
-    # Mapeamento dos nomes das colunas para os placeholders
-    mapeamento_colunas = {
-        "Cliente": "<Cliente>", "Cidade": "<Cidade>", "Estado": "<Estado>",
-        "Número": "<Número>", "Nome": "<Nome>", "Telefone": "<Telefone>",
-        "Email": "<Email>", "Modelo": "<Modelo>", "TIPO DE MÁQUINA": "<TIPO DE MÁQUINA>",
-        "MODELO DE MÁQUINA": "<MODELO DE MÁQUINA>", "Valor Rompedor": "<Valor Rompedor>",
-        "Valor Kit": "<Valor Kit>", "Condição de pagamento": "<Condição de pagamento>",
-        "FRETE": "<FRETE>", "Data": "<Data>"
-    }
-
-    # Primeiro, substituir os placeholders no formato de database-display
-    for coluna, placeholder in mapeamento_colunas.items():
-        if placeholder in substituicoes:
-            padrao = f'<text:database-display[^>]*text:column-name="{re.escape(coluna)}"[^>]*>([^<]*)</text:database-display>'
-            # Usamos uma função lambda para preservar a estrutura original da tag, apenas mudando o conteúdo
-            texto_modificado, num_subs = re.subn(
-                padrao,
-                lambda m: f'<text:database-display text:column-name="{coluna}" text:table-name="Planilha1" text:table-type="table" text:database-name="Formulário propostas Rompedor1">{substituicoes[placeholder]}</text:database-display>',
-                texto_modificado
-            )
-            substituicoes_feitas += num_subs
-
-    # Depois, substituir os placeholders como texto simples (se existirem)
-    for placeholder, valor in substituicoes.items():
-        padrao_simples = re.escape(placeholder)
-        texto_modificado, num_subs_simples = re.subn(padrao_simples, str(valor), texto_modificado)
-        substituicoes_feitas += num_subs_simples
-
-    return texto_modificado, substituicoes_feitas
-
-
-def criar_odt_modificado(arquivo_original_bytes, content_xml_modificado):
-    """Cria um novo arquivo ODT com o conteúdo modificado"""
-    temp_original_path = None
-    temp_modificado_path = None
-    try:
-        with tempfile.NamedTemporaryFile(suffix='.odt', delete=False) as temp_original:
-            temp_original.write(arquivo_original_bytes)
-            temp_original_path = temp_original.name
-
-        with tempfile.NamedTemporaryFile(suffix='.odt', delete=False) as temp_modificado:
-            temp_modificado_path = temp_modificado.name
-
-        with zipfile.ZipFile(temp_original_path, 'r') as zip_original:
-            with zipfile.ZipFile(temp_modificado_path, 'w', zipfile.ZIP_DEFLATED) as zip_modificado: # Usar compressão
-                for item in zip_original.infolist():
-                    if item.filename == 'content.xml':
-                        zip_modificado.writestr('content.xml', content_xml_modificado.encode('utf-8')) # Garantir encoding utf-8
-                    else:
-                        zip_modificado.writestr(item, zip_original.read(item.filename))
-
-        with open(temp_modificado_path, 'rb') as f:
-            conteudo_modificado = f.read()
-
-        return conteudo_modificado
-
-    except Exception as e:
-        st.error(f"Erro ao criar arquivo ODT modificado: {str(e)}")
-        return None
-    finally:
-        # Limpeza robusta dos arquivos temporários
-        if temp_original_path and os.path.exists(temp_original_path):
-            os.unlink(temp_original_path)
-        if temp_modificado_path and os.path.exists(temp_modificado_path):
-            os.unlink(temp_modificado_path)
-
-def converter_para_pdf(odt_bytes, nome_arquivo_base):
-    """Converte ODT para PDF usando LibreOffice"""
-    libreoffice_path = None
-    paths_to_try = [
-        r"C:\Program Files\LibreOffice\program\soffice.exe",
-        r"C:\Program Files (x86)\LibreOffice\program\soffice.exe",
-        "/usr/bin/libreoffice",
-        "/Applications/LibreOffice.app/Contents/MacOS/soffice",
-        "/usr/bin/soffice"
-    ]
-
-    for path in paths_to_try:
-        if os.path.exists(path):
-            libreoffice_path = path
-            break
-
-    if not libreoffice_path:
-        st.error("⚠️ **LibreOffice não encontrado.** Verifique a instalação ou o caminho no código.")
-        return None
-
-    temp_odt_path = None
-    temp_pdf_dir = None
-    pdf_path = None # Inicializa pdf_path
-
-    try:
-        with tempfile.NamedTemporaryFile(suffix='.odt', delete=False) as temp_odt:
-            temp_odt.write(odt_bytes)
-            temp_odt_path = temp_odt.name
-
-        temp_pdf_dir = tempfile.mkdtemp()
-
-        comando = [
-            libreoffice_path,
-            '--headless',
-            '--convert-to', 'pdf',
-            '--outdir', temp_pdf_dir,
-            temp_odt_path
-        ]
-
-        # Usar Popen para melhor controle, especialmente no Windows
-        process = subprocess.Popen(comando, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=(os.name == 'nt'))
-        stdout, stderr = process.communicate(timeout=120) # Timeout aumentado
-
-        if process.returncode != 0:
-            error_message = stderr.decode('utf-8', errors='ignore')
-            # Tentar extrair mensagem mais útil do erro do LibreOffice
-            if "Error: source file could not be loaded" in error_message:
-                 raise Exception("Erro do LibreOffice: O arquivo ODT de origem não pôde ser carregado (pode estar corrompido ou ter permissões incorretas).")
-            elif "error while loading shared libraries" in error_message:
-                 raise Exception(f"Erro do LibreOffice: Falta de bibliotecas compartilhadas. Detalhes: {error_message}")
-            else:
-                 raise Exception(f"Erro na conversão (código {process.returncode}): {error_message}")
-
-
-        # O nome do arquivo PDF gerado pelo LibreOffice será o mesmo do ODT, mas com extensão .pdf
-        pdf_filename = os.path.basename(temp_odt_path).replace('.odt', '.pdf')
-        pdf_path = os.path.join(temp_pdf_dir, pdf_filename)
-
-
-        if not os.path.exists(pdf_path):
-             # Adicionar verificação do stdout para pistas
-             output_message = stdout.decode('utf-8', errors='ignore')
-             raise Exception(f"Arquivo PDF não foi gerado em '{temp_pdf_dir}'. Output: {output_message}")
-
-
-        with open(pdf_path, 'rb') as f:
-            pdf_bytes = f.read()
-
-        return pdf_bytes
-
-    except subprocess.TimeoutExpired:
-        st.error("⏳ A conversão para PDF demorou muito (timeout). Tente novamente ou verifique o arquivo ODT.")
-        return None
-    except Exception as e:
-        st.error(f"Falha na conversão para PDF: {str(e)}")
-        # Adicionar log extra para depuração
-        st.error(f"Comando executado: {' '.join(comando)}")
-        if 'stderr' in locals() and stderr: st.error(f"Saída de erro do processo: {stderr.decode('utf-8', errors='ignore')}")
-        return None
-    finally:
-        # Limpeza final
-        if temp_odt_path and os.path.exists(temp_odt_path):
-            os.unlink(temp_odt_path)
-        if pdf_path and os.path.exists(pdf_path):
-             os.unlink(pdf_path)
-        if temp_pdf_dir and os.path.exists(temp_pdf_dir):
-             try:
-                  os.rmdir(temp_pdf_dir)
-             except OSError:
-                  # Pode falhar se o LibreOffice ainda tiver algum lock, mas tentamos
-                  st.warning(f"Não foi possível remover o diretório temporário {temp_pdf_dir}. Pode ser necessário remover manualmente.")
-                  pass
-
-
-def formatar_valor_monetario(valor):
-    """Formata um valor como moeda brasileira (R$)"""
-    try:
-        # Tenta converter para float, tratando vírgula como separador decimal se necessário
-        if isinstance(valor, str):
-            valor = valor.replace('.', '').replace(',', '.')
-        valor_float = float(valor)
-        # Formatação padrão brasileira
-        return f"R$ {valor_float:,.2f}".replace(',', 'v').replace('.', ',').replace('v', '.')
-    except (ValueError, TypeError):
-        return "R$ 0,00" # Retorna R$ 0,00 se a conversão falhar
-
-
-def criar_substituicoes(dados):
-    """Prepara dicionário de substituições a partir de uma linha (dict) do DataFrame"""
-    substituicoes = {}
-    data_hoje = datetime.today().strftime("%d/%m/%Y")
-
-    # Mapeamento dos placeholders para as colunas (considerando nomes exatos)
-    mapeamento_placeholders = {
-        "<Cliente>": "Cliente", "<Cidade>": "Cidade", "<Estado>": "Estado",
-        "<Número>": "Número", "<Nome>": "Nome", "<Telefone>": "Telefone",
-        "<Email>": "Email", "<Modelo>": "Modelo", "<TIPO DE MÁQUINA>": "TIPO DE MÁQUINA",
-        "<MODELO DE MÁQUINA>": "MODELO DE MÁQUINA", "<Valor Rompedor>": "Valor Rompedor",
-        "<Valor Kit>": "Valor Kit", "<Condição de pagamento>": "Condição de pagamento",
-        "<FRETE>": "FRETE", "<Data>": "Data"
-    }
-
-    for placeholder, coluna in mapeamento_placeholders.items():
-        valor = dados.get(coluna, "") # Pega o valor da coluna correspondente
-
-        # Tratamento especial para valores monetários
-        if coluna in ["Valor Rompedor", "Valor Kit"]:
-            valor_formatado = formatar_valor_monetario(valor)
-            substituicoes[placeholder] = valor_formatado
-        # Tratamento especial para Data
-        elif coluna == "Data":
-             if pd.isna(valor) or valor == "":
-                  substituicoes[placeholder] = data_hoje
-             elif isinstance(valor, datetime):
-                  substituicoes[placeholder] = valor.strftime("%d/%m/%Y")
-             else:
-                  # Tenta converter string para data, se falhar usa o valor como está ou data de hoje
-                  try:
-                       data_obj = pd.to_datetime(valor, errors='coerce')
-                       if pd.isna(data_obj):
-                            substituicoes[placeholder] = str(valor) if valor else data_hoje
-                       else:
-                            substituicoes[placeholder] = data_obj.strftime("%d/%m/%Y")
-                  except Exception:
-                       substituicoes[placeholder] = str(valor) if valor else data_hoje
-        # Para outros campos, apenas converte para string
-        else:
-            substituicoes[placeholder] = str(valor)
+import armazem_sessoes
+import cache_pdf
+import cache_planilhas
+import conversao_fundo
+import metricas
+import modelo_compilado
+import previa_html
+import registro_modelos
+from nucleo import (
+    BACKEND_DIRETO, BACKEND_ESQUELETO, BACKEND_LIBREOFFICE, BACKEND_MALA_DIRETA, BACKEND_PDF_PADRAO,
+    criar_substituicoes, definir_nome_arquivo, gerar_lote_zip, selecionar_linhas_lote,
+)
+# pandas, indice_busca, renderizador_direto e esqueleto_pdf (~0,6 s de importação juntos)
+# são importados só nos trechos que os usam: a primeira página abre sem carregá-los
+
+# --- FUNÇÕES AUXILIARES (núcleo da geração em nucleo.py, sem dependência do Streamlit) ---
+
+def mensagem_erro_conversao(erro):
+    """Mensagem para o usuário da falha de uma geração em segundo plano"""
+    if isinstance(erro, FileNotFoundError):
+        return "⚠️ **LibreOffice não encontrado.** Verifique a instalação ou o caminho no código."
+    if isinstance(erro, TimeoutError):
+        return "⏳ A conversão para PDF demorou muito (timeout). Tente novamente ou verifique o arquivo ODT."
+    return f"❌ Erro ao gerar proposta: {erro}"
+
+
+def planilha_da_sessao():
+    """DataFrame da planilha da sessão, compartilhado pelo armazem_sessoes (não modificar no lugar)"""
+    return armazem_sessoes.obter_armazem().obter(st.session_state['id_sessao'], "planilha")
+
+
+def modelo_da_sessao(nome_modelo):
+    """Bytes do modelo da sessão, vinculados no armazem_sessoes; KeyError se não estiver no registro"""
+    hash_modelo = st.session_state['modelos_info'][nome_modelo]
+    return armazem_sessoes.obter_armazem().vincular(
+        st.session_state['id_sessao'], f"modelo:{nome_modelo}", hash_modelo,
+        lambda: registro_modelos.obter_registro().ler(hash_modelo))
+
+
+LIMITE_DOWNLOAD_MB = float(os.environ.get("PROPOSTAS_LIMITE_DOWNLOAD_MB", "200"))
+
+
+def botao_download_arquivo(caminho, label, file_name, mime, key):
+    """Download de um arquivo em disco, lido só no clique (nada vai para a memória a cada rerun)"""
+    tamanho = os.path.getsize(caminho)
+    if tamanho > LIMITE_DOWNLOAD_MB * 1024 * 1024:
+        # O Streamlit entrega o arquivo inteiro da memória: acima do limite, só pelos caminhos em blocos
+        st.warning(f"⚠️ '{file_name}' tem {tamanho / (1024 * 1024):.0f} MB, acima do limite de download pela interface "
+                   f"({LIMITE_DOWNLOAD_MB:.0f} MB). Gere lotes grandes pela linha de comando (gerar_propostas.py) "
+                   "ou pelo servidor HTTP (GET /trabalhos/<id>/zip), que enviam o arquivo em blocos.")
+        return
+
+    def _ler():
+        if not os.path.exists(caminho):
+            return b"" # Substituído por um lote novo depois que a página foi montada
+        with open(caminho, 'rb') as f:
+            return f.read()
+
+    st.download_button(label=label, data=_ler, file_name=file_name, mime=mime, key=key, use_container_width=True)
+
+
+@st.fragment(run_every=1)
+def acompanhar_conversao():
+    """Andamento da geração em segundo plano; só este trecho é reexecutado a cada segundo"""
+    tarefa = conversao_fundo.obter(st.session_state['id_sessao'])
+    if tarefa is None or not tarefa.ativa:
+        st.rerun() # Terminou: a página inteira mostra o resultado e a consulta para
+    st.info(f"⚙️ {tarefa.etapa} ({tarefa.decorrido:.0f} s)")
+    if st.button("✖️ Cancelar geração", key="cancelar_geracao", use_container_width=True):
+        conversao_fundo.cancelar(st.session_state['id_sessao'])
+        st.rerun()
 
-    return substituicoes
 
 # --- Configuração da Página Streamlit ---
 st.set_page_config(
@@ -271,186 +85,14 @@ st.set_page_config(
 )
 
 # --- Estilos CSS Customizados (Mantidos) ---
+@st.cache_resource(show_spinner=False)
+def carregar_css():
+    """CSS do app (estilo.css), lido do disco uma vez por processo"""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "estilo.css"), encoding="utf-8") as f:
+        return f"<style>\n{f.read()}</style>"
+
 def load_css():
-    st.markdown("""
-    <style>
-        /* Esconder a marca do Streamlit */
-        #MainMenu {visibility: hidden;}
-        header {visibility: hidden;}
-        footer {visibility: hidden;}
-
-        /* Fundo principal estilo "Dark Slate" Moderno */
-        [data-testid="stAppViewContainer"] {
-            background-color: #0f172a;
-            background-image: radial-gradient(circle at 15% 50%, rgba(59, 130, 246, 0.08), transparent 25%),
-                              radial-gradient(circle at 85% 30%, rgba(16, 185, 129, 0.08), transparent 25%);
-            color: #f8fafc;
-        }
-
-        .main .block-container {
-             padding-top: 1rem;
-             padding-bottom: 2rem;
-             max-width: 1000px;
-        }
-
-        /* Títulos e Textos */
-        h1, h2, h3, h4, h5, h6, p, label, .stMarkdown {
-            color: #f8fafc !important;
-            font-family: 'Inter', sans-serif !important;
-        }
-
-        /* Cabeçalho com logo */
-        .header-container {
-            display: flex;
-            flex-direction: column;
-            align-items: center;
-            justify-content: center;
-            margin-bottom: 2.5rem;
-            margin-top: 1rem;
-        }
-        .logo-img {
-             height: 90px;
-             margin-bottom: 1rem;
-             filter: drop-shadow(0px 10px 15px rgba(0,0,0,0.3));
-        }
-        .header-title {
-            text-align: center;
-            background: linear-gradient(135deg, #60a5fa 0%, #3b82f6 100%);
-            -webkit-background-clip: text;
-            -webkit-text-fill-color: transparent;
-            font-size: 2.4rem !important;
-            font-weight: 800 !important;
-            letter-spacing: -0.5px;
-            margin: 0 !important;
-        }
-
-        /* Glassmorphism nos Containers (Caixas) */
-        [data-testid="stVerticalBlock"] > [style*="border: 1px solid rgba(49, 51, 63, 0.2)"],
-        [data-testid="stVerticalBlock"] > [style*="border: 1px solid rgba(250, 250, 250, 0.2)"] {
-            background: rgba(30, 41, 59, 0.5) !important;
-            backdrop-filter: blur(20px) !important;
-            -webkit-backdrop-filter: blur(20px) !important;
-            border: 1px solid rgba(255, 255, 255, 0.08) !important;
-            border-radius: 16px !important;
-            box-shadow: 0 10px 40px rgba(0, 0, 0, 0.2) !important;
-            padding: 2rem !important;
-            margin-bottom: 1.5rem !important;
-        }
-
-        /* Estilos das Abas (Tabs) Modernas */
-        .stTabs [data-baseweb="tab-list"] {
-            gap: 15px;
-            background-color: transparent !important;
-            border: none;
-            justify-content: center;
-            padding-bottom: 20px;
-        }
-        .stTabs [data-baseweb="tab"] {
-            background-color: rgba(30, 41, 59, 0.6) !important;
-            border: 1px solid rgba(255,255,255,0.05) !important;
-            border-radius: 30px !important;
-            padding: 10px 25px !important;
-            color: #94a3b8 !important;
-            font-weight: 600 !important;
-            transition: all 0.3s cubic-bezier(0.4, 0, 0.2, 1) !important;
-        }
-        .stTabs [aria-selected="true"] {
-             background: linear-gradient(135deg, #3b82f6 0%, #2563eb 100%) !important;
-             color: white !important;
-             box-shadow: 0 10px 20px -10px rgba(59, 130, 246, 0.6) !important;
-             transform: translateY(-2px);
-             border: none !important;
-        }
-        .stTabs [data-baseweb="tab"]:hover {
-             background-color: rgba(59, 130, 246, 0.1) !important;
-             color: #f1f5f9 !important;
-        }
-
-        /* Botões Primários (Gradiente Esmeralda) */
-        .stButton>button[kind="primary"] {
-            background: linear-gradient(135deg, #10b981 0%, #059669 100%) !important;
-            color: white !important;
-            border: none !important;
-            border-radius: 12px !important;
-            font-weight: 600 !important;
-            padding: 0.75rem 1.5rem !important;
-            transition: all 0.3s ease !important;
-            box-shadow: 0 10px 15px -3px rgba(16, 185, 129, 0.3) !important;
-            width: 100%;
-        }
-        .stButton>button[kind="primary"]:hover {
-             transform: translateY(-3px);
-             box-shadow: 0 20px 25px -5px rgba(16, 185, 129, 0.4) !important;
-        }
-
-        /* Botões Secundários */
-        .stButton>button[kind="secondary"] {
-            background: rgba(51, 65, 85, 0.6) !important;
-            color: #f8fafc !important;
-            border: 1px solid rgba(255, 255, 255, 0.1) !important;
-            border-radius: 12px !important;
-            transition: all 0.3s ease !important;
-            width: 100%;
-        }
-        .stButton>button[kind="secondary"]:hover {
-            background: rgba(71, 85, 105, 0.9) !important;
-            transform: translateY(-2px);
-        }
-
-        /* Botão de Download (Azul Cyan) */
-        .stDownloadButton>button {
-            background: linear-gradient(135deg, #06b6d4 0%, #0891b2 100%) !important;
-            color: white !important;
-            border: none !important;
-            border-radius: 12px !important;
-            font-weight: 600 !important;
-            width: 100% !important;
-            box-shadow: 0 10px 15px -3px rgba(6, 182, 212, 0.3) !important;
-            transition: transform 0.2s ease !important;
-        }
-        .stDownloadButton>button:hover {
-             transform: translateY(-3px) !important;
-             box-shadow: 0 20px 25px -5px rgba(6, 182, 212, 0.4) !important;
-        }
-
-        /* Inputs e Caixa de Arquivo */
-        input[type="text"], input[type="number"], .stNumberInput > div > div > input {
-            background-color: rgba(15, 23, 42, 0.6) !important;
-            border: 1px solid rgba(255,255,255,0.1) !important;
-            color: white !important;
-            border-radius: 8px !important;
-        }
-        
-        .stSelectbox > div > div > div {
-            background-color: rgba(15, 23, 42, 0.6) !important;
-            border: 1px solid rgba(255,255,255,0.1) !important;
-            color: white !important;
-            border-radius: 8px !important;
-        }
-
-        /* Caixa de Upload do Streamlit */
-        [data-testid="stFileUploadDropzone"] {
-            background: rgba(15, 23, 42, 0.3) !important;
-            border: 2px dashed rgba(255,255,255,0.15) !important;
-            border-radius: 16px !important;
-            transition: all 0.3s ease !important;
-        }
-        [data-testid="stFileUploadDropzone"]:hover {
-            border-color: #3b82f6 !important;
-            background: rgba(59, 130, 246, 0.05) !important;
-        }
-
-        /* Ajuste no rodapé do seu código */
-        .footer {
-            margin-top: 3rem;
-            padding: 1.5rem 0;
-            border-top: 1px solid rgba(255,255,255,0.05);
-            text-align: center;
-            color: #64748b;
-            font-size: 0.85rem;
-        }
-    </style>
-    """, unsafe_allow_html=True)
+    st.markdown(carregar_css(), unsafe_allow_html=True)
 
 load_css()
 
@@ -468,16 +110,27 @@ render_header()
 # --- Inicialização do Estado da Sessão ---
 if 'current_tab' not in st.session_state:
     st.session_state['current_tab'] = "Upload"
-if 'planilha_data' not in st.session_state:
-    st.session_state['planilha_data'] = None 
 if 'planilha_nome' not in st.session_state:
     st.session_state['planilha_nome'] = None
 if 'modelos_info' not in st.session_state:
-    st.session_state['modelos_info'] = {} 
+    st.session_state['modelos_info'] = {} # nome do modelo -> hash no registro_modelos
+if 'backends_modelos' not in st.session_state:
+    st.session_state['backends_modelos'] = {} # nome do modelo -> motor de PDF escolhido
 if 'dados_linha_selecionada' not in st.session_state:
     st.session_state['dados_linha_selecionada'] = None
 if 'modelo_selecionado_nome' not in st.session_state:
     st.session_state['modelo_selecionado_nome'] = None
+if 'id_sessao' not in st.session_state:
+    st.session_state['id_sessao'] = uuid.uuid4().hex # Chave das conversões em segundo plano e do armazem_sessoes
+if 'versao_uploads' not in st.session_state:
+    st.session_state['versao_uploads'] = 0 # Incrementada no reinício: os uploaders novos descartam os arquivos enviados
+
+# A sessão guarda só vínculos: planilha e modelos ficam uma vez no armazém, para todas as sessões.
+# As ociosas perdem os vínculos (refeitos do upload/registro quando voltarem) e a tarefa em segundo plano
+armazem = armazem_sessoes.obter_armazem()
+armazem.tocar(st.session_state['id_sessao'])
+for id_sessao_ociosa in armazem.remover_ociosas():
+    conversao_fundo.descartar(id_sessao_ociosa)
 
 # --- Criação das Abas ---
 tab_upload, tab_selecao, tab_geracao = st.tabs([
@@ -498,21 +151,30 @@ with tab_upload:
         arquivo_planilha = st.file_uploader(
             "Upload da Planilha",
             type=["ods", "xlsx", "xls"],
-            key="planilha_upload_widget", 
+            key=f"planilha_upload_widget_{st.session_state['versao_uploads']}",
             label_visibility="collapsed"
         )
         if arquivo_planilha:
              try:
-                  planilha_bytes = arquivo_planilha.getvalue()
-                  engine = 'odf' if arquivo_planilha.name.endswith('.ods') else None
-                  df = pd.read_excel(io.BytesIO(planilha_bytes), engine=engine)
-                  st.session_state['planilha_data'] = df
-                  st.session_state['planilha_nome'] = arquivo_planilha.name
+                  # Cada interação gera um rerun: só relê se o arquivo enviado mudou,
+                  # e mesmo assim o cache evita ler de novo um conteúdo já conhecido
+                  id_arquivo = getattr(arquivo_planilha, 'file_id', None)
+                  if id_arquivo is None or id_arquivo != st.session_state.get('planilha_file_id') or planilha_da_sessao() is None:
+                       # Só as colunas usadas na geração ficam em memória (placeholders + nome do arquivo),
+                       # uma vez por conteúdo: sessões com o mesmo arquivo compartilham o DataFrame
+                       planilha_bytes = arquivo_planilha.getvalue()
+                       armazem.vincular(
+                            st.session_state['id_sessao'], "planilha", cache_planilhas.chave_planilha(planilha_bytes, projetar=True),
+                            lambda: cache_planilhas.obter_cache().carregar(planilha_bytes, arquivo_planilha.name, projetar=True))
+                       st.session_state['planilha_nome'] = arquivo_planilha.name
+                       st.session_state['planilha_file_id'] = id_arquivo
+                  df = planilha_da_sessao()
                   st.success(f"✅ Planilha '{arquivo_planilha.name}' carregada com sucesso ({len(df)} linhas).")
              except Exception as e:
                   st.error(f"❌ Erro ao ler a planilha: {e}")
-                  st.session_state['planilha_data'] = None 
+                  armazem.liberar(st.session_state['id_sessao'], ["planilha"])
                   st.session_state['planilha_nome'] = None
+                  st.session_state['planilha_file_id'] = None
 
     st.divider()
 
@@ -523,16 +185,97 @@ with tab_upload:
             "Upload de Modelos ODT",
             type=["odt"],
             accept_multiple_files=True,
-            key="modelos_upload_widget", 
+            key=f"modelos_upload_widget_{st.session_state['versao_uploads']}",
             label_visibility="collapsed"
         )
-        if arquivos_modelo:
-             st.session_state['modelos_info'] = {modelo.name: modelo.getvalue() for modelo in arquivos_modelo}
-             st.success(f"✅ {len(arquivos_modelo)} modelo(s) ODT carregado(s): {', '.join(st.session_state['modelos_info'].keys())}")
+        # Modelos já enviados (por qualquer usuário) ficam no registro e podem ser reusados sem novo upload
+        registro = registro_modelos.obter_registro()
+        nomes_enviados = {modelo.name for modelo in arquivos_modelo or []}
+        registrados = {item["nome"]: item for item in registro.listar() if item["nome"] not in nomes_enviados}
+        # Rótulos prontos em vez de uma função do script: o Streamlit guarda a format_func com o widget,
+        # e uma função daqui prenderia as globais da execução (e a planilha carregada nelas)
+        rotulos_registrados = {nome: f"{nome} (versão {item['versao']})" for nome, item in registrados.items()}
+        modelos_registrados = st.multiselect(
+             "Ou use modelos já cadastrados:",
+             options=list(registrados),
+             format_func=rotulos_registrados.get,
+             key=f"modelos_registrados_select_{st.session_state['versao_uploads']}"
+        ) if registrados else []
+        if arquivos_modelo or modelos_registrados:
+             # Cada modelo é analisado e registrado no upload (a análise fica em cache): problemas aparecem
+             # aqui, antes de qualquer conversão, e o plano compilado é reaproveitado na geração.
+             # A sessão guarda só o hash; os bytes ficam uma única vez no armazém (e em disco no registro).
+             modelos_validos = {}
+             for modelo in arquivos_modelo or []:
+                  try:
+                       hash_modelo = registro.registrar(modelo.getvalue(), nome=modelo.name, em_memoria=False)
+                  except ValueError as e:
+                       st.error(f"❌ Modelo '{modelo.name}' ignorado: {e}")
+                       continue
+                  modelos_validos[modelo.name] = hash_modelo
+                  armazem.vincular(st.session_state['id_sessao'], f"modelo:{modelo.name}", hash_modelo, modelo.getvalue)
+             for nome_modelo in modelos_registrados:
+                  modelos_validos[nome_modelo] = registrados[nome_modelo]["hash"]
+             st.session_state['modelos_info'] = modelos_validos
+             armazem.liberar(st.session_state['id_sessao'], [
+                  papel for papel in armazem.papeis(st.session_state['id_sessao'])
+                  if papel.startswith("modelo:") and papel[len("modelo:"):] not in modelos_validos])
+             if modelos_validos:
+                  st.success(f"✅ {len(modelos_validos)} modelo(s) ODT carregado(s): {', '.join(modelos_validos.keys())}")
+
+             df_colunas = planilha_da_sessao()
+             colunas_planilha = df_colunas.attrs.get('colunas_originais', list(df_colunas.columns)) if df_colunas is not None else None
+             for nome_modelo in modelos_validos:
+                  bytes_modelo = modelo_da_sessao(nome_modelo)
+                  analise = modelo_compilado.analisar_modelo(bytes_modelo)
+                  avisos_modelo = analise.avisos(colunas_planilha)
+                  titulo = f"🧩 Campos do modelo '{nome_modelo}': {sum(analise.campos.values())} campo(s)"
+                  if avisos_modelo:
+                       titulo += f", {len(avisos_modelo)} aviso(s)"
+                  with st.expander(titulo, expanded=bool(avisos_modelo)):
+                       if analise.campos:
+                            import pandas as pd
+                            st.dataframe(pd.DataFrame(
+                                 [{"Placeholder": p, "Ocorrências": n} for p, n in sorted(analise.campos.items())]
+                            ), hide_index=True, use_container_width=True)
+                       for aviso in avisos_modelo:
+                            st.warning(f"⚠️ {aviso}")
+
+                       # Motor de PDF por modelo: o renderizador direto e o esqueleto dispensam o LibreOffice por proposta
+                       opcoes_backend = {
+                            BACKEND_LIBREOFFICE: "LibreOffice",
+                            BACKEND_DIRETO: "Direto (sem LibreOffice)",
+                            BACKEND_ESQUELETO: "Esqueleto (LibreOffice uma vez, campos carimbados)",
+                            BACKEND_MALA_DIRETA: "Mala direta (lote: uma conversão por grupo)",
+                       }
+                       backend_atual = st.session_state['backends_modelos'].get(nome_modelo, BACKEND_PDF_PADRAO)
+                       backend_escolhido = st.radio(
+                            "Motor de PDF", list(opcoes_backend), format_func=opcoes_backend.get, horizontal=True,
+                            index=list(opcoes_backend).index(backend_atual) if backend_atual in opcoes_backend else 0,
+                            key=f"backend_{nome_modelo}",
+                       )
+                       st.session_state['backends_modelos'][nome_modelo] = backend_escolhido
+                       if backend_escolhido == BACKEND_DIRETO:
+                            import renderizador_direto
+                            modelo_direto = renderizador_direto.preparar(bytes_modelo)
+                            if not modelo_direto.compativel:
+                                 st.caption("ℹ️ Este modelo será convertido pelo LibreOffice: " + " ".join(modelo_direto.motivos))
+                       elif backend_escolhido == BACKEND_ESQUELETO:
+                            import esqueleto_pdf
+                            esqueleto = esqueleto_pdf.esqueleto_em_cache(analise.hash)
+                            if esqueleto is None:
+                                 st.caption("ℹ️ A compatibilidade é verificada na primeira geração (o modelo é convertido duas vezes).")
+                            elif not esqueleto.compativel:
+                                 st.caption("ℹ️ Este modelo será convertido pelo LibreOffice: " + " ".join(esqueleto.motivos))
+                       elif backend_escolhido == BACKEND_MALA_DIRETA:
+                            import mala_direta
+                            modelo_mala_direta = mala_direta.preparar(bytes_modelo)
+                            if not modelo_mala_direta.compativel:
+                                 st.caption("ℹ️ O lote deste modelo será convertido linha a linha: " + " ".join(modelo_mala_direta.motivos))
 
     st.divider()
 
-    if st.session_state['planilha_data'] is not None and st.session_state['modelos_info']:
+    if planilha_da_sessao() is not None and st.session_state['modelos_info']:
         if st.button("Avançar para Seleção de Dados →", type="primary", key="goto_selecao"):
             st.session_state['current_tab'] = "Seleção"
             st.rerun() 
@@ -545,16 +288,42 @@ with tab_selecao:
     st.header("Passo 2: Selecione os Dados para a Proposta")
     st.markdown("---")
 
-    if st.session_state['planilha_data'] is None or not st.session_state['modelos_info']:
+    if planilha_da_sessao() is None or not st.session_state['modelos_info']:
         st.warning("⚠️ Volte ao Passo 1 e faça o upload da planilha e dos modelos ODT.")
         if st.button("← Voltar para Upload", key="back_to_upload_selecao"):
             st.session_state['current_tab'] = "Upload"
             st.rerun()
     else:
-        df = st.session_state['planilha_data']
+        import pandas as pd
+        import indice_busca
+        df = planilha_da_sessao()
 
         with st.expander("👁️ Visualizar Planilha Carregada", expanded=False):
-             st.dataframe(df, use_container_width=True, height=300) 
+             # Só a página visível é enviada ao navegador; a busca usa um índice invertido
+             busca_planilha = st.text_input("🔎 Buscar linhas:", key="busca_planilha", placeholder="Ex.: nome do cliente, cidade, modelo...")
+             posicoes_busca = indice_busca.obter_indice(df).buscar(busca_planilha) if busca_planilha.strip() else None
+             total_visiveis = len(df) if posicoes_busca is None else len(posicoes_busca)
+
+             col_pagina, col_tamanho_pagina = st.columns([3, 1])
+             with col_tamanho_pagina:
+                  tamanho_pagina = st.selectbox("Linhas por página:", [25, 50, 100, 200], key="preview_tamanho_pagina")
+             total_paginas = max(1, -(-total_visiveis // tamanho_pagina))
+             if st.session_state.get('preview_pagina', 1) > total_paginas:
+                  st.session_state['preview_pagina'] = total_paginas # A busca ou o tamanho da página mudou
+             with col_pagina:
+                  pagina = st.number_input(f"Página (de 1 a {total_paginas}):", min_value=1, max_value=total_paginas, value=1, step=1, key="preview_pagina")
+
+             inicio_pagina = (pagina - 1) * tamanho_pagina
+             if posicoes_busca is None:
+                  posicoes_pagina = range(inicio_pagina, min(inicio_pagina + tamanho_pagina, len(df)))
+             else:
+                  posicoes_pagina = posicoes_busca[inicio_pagina:inicio_pagina + tamanho_pagina]
+             pagina_df = df.iloc[posicoes_pagina]
+             # Índice com a numeração da planilha, a mesma usada na seleção de linha abaixo
+             pagina_df = pagina_df.set_axis(pd.Index([p + 2 for p in posicoes_pagina], name="Linha"))
+             st.dataframe(pagina_df, use_container_width=True, height=300)
+             if posicoes_busca is not None:
+                  st.caption(f"{total_visiveis} linha(s) encontrada(s) para a busca.")
 
         st.divider()
 
@@ -629,19 +398,28 @@ with tab_geracao:
     st.header("Passo 3: Revise e Gere a Proposta em PDF")
     st.markdown("---")
 
-    if st.session_state.get('dados_linha_selecionada') is None or st.session_state.get('modelo_selecionado_nome') is None:
+    if st.session_state.get('dados_linha_selecionada') is None or st.session_state.get('modelo_selecionado_nome') is None or planilha_da_sessao() is None:
         st.warning("⚠️ Por favor, complete os Passos 1 e 2 primeiro (selecione uma linha válida e um modelo).")
         if st.button("← Voltar para Seleção", key="back_to_selecao_geracao"):
             st.session_state['current_tab'] = "Seleção"
             st.rerun()
     else:
+        import pandas as pd
         dados_linha = st.session_state['dados_linha_selecionada']
         nome_modelo_selecionado = st.session_state['modelo_selecionado_nome']
-        modelo_bytes = st.session_state['modelos_info'].get(nome_modelo_selecionado)
+        try:
+             modelo_bytes = modelo_da_sessao(nome_modelo_selecionado)
+        except KeyError:
+             modelo_bytes = None
 
         if not modelo_bytes:
-             st.error(f"❌ Erro: Modelo ODT '{nome_modelo_selecionado}' não encontrado na memória. Volte ao Passo 1.")
+             st.error(f"❌ Erro: Modelo ODT '{nome_modelo_selecionado}' não encontrado no registro de modelos. Volte ao Passo 1.")
         else:
+            df_colunas = planilha_da_sessao()
+            avisos_modelo = modelo_compilado.analisar_modelo(modelo_bytes).avisos(
+                 df_colunas.attrs.get('colunas_originais', list(df_colunas.columns)) if df_colunas is not None else None)
+            if avisos_modelo:
+                 st.warning(f"⚠️ O modelo '{nome_modelo_selecionado}' tem {len(avisos_modelo)} aviso(s) de campos que não serão preenchidos (detalhes no Passo 1).")
             with st.container(border=True):
                 st.subheader("Revisão das Informações")
                 substituicoes = criar_substituicoes(dados_linha)
@@ -666,64 +444,145 @@ with tab_geracao:
                      })
                      st.dataframe(substituicoes_df, hide_index=True, use_container_width=True)
 
+            # Pré-visualização em HTML (milissegundos): confere a linha antes de pagar a conversão em PDF
+            with st.expander("👁️ Pré-visualização da proposta (sem gerar o PDF)", expanded=True):
+                try:
+                     previa = previa_html.gerar_previa(modelo_bytes, substituicoes)
+                     # '$' escapado: o Markdown do Streamlit interpretaria "R$ ... R$" como fórmula
+                     st.markdown(f'<div class="previa-proposta">{previa.replace("$", "&#36;")}</div>', unsafe_allow_html=True)
+                     st.caption("Os campos preenchidos estão destacados. Paginação, cabeçalho/rodapé e imagens só aparecem no PDF.")
+                except ValueError as e:
+                     st.caption(f"ℹ️ Pré-visualização indisponível: {e}")
+
             st.divider()
 
+            estatisticas_cache = cache_pdf.obter_cache().estatisticas()
+            st.caption(f"♻️ Cache de PDFs: {estatisticas_cache['acertos']} acerto(s), {estatisticas_cache['falhas']} falha(s), {estatisticas_cache['bytes'] / (1024 * 1024):.1f} MB em uso.")
+
             if st.button("🚀 Gerar Documento PDF Agora", type="primary", key="generate_pdf_final", use_container_width=True):
-                 pdf_bytes_result = None  
-                 pdf_filename_result = None 
-
-                 with st.status("⚙️ Iniciando geração da proposta...", expanded=True) as status:
-                    try:
-                        status.update(label="1/4 - Extraindo conteúdo do modelo ODT...")
-                        content_xml = extrair_conteudo_odt(modelo_bytes)
-                        if not content_xml: raise ValueError("Falha ao extrair 'content.xml' do modelo ODT.")
-
-                        status.update(label="2/4 - Aplicando substituições nos dados...")
-                        content_xml_modificado, num_substituicoes = substituir_no_xml(content_xml, substituicoes)
-
-                        status.update(label="3/4 - Recriando arquivo ODT modificado...")
-                        documento_odt_modificado = criar_odt_modificado(modelo_bytes, content_xml_modificado)
-                        if not documento_odt_modificado: raise ValueError("Falha ao recriar o arquivo ODT modificado.")
-
-                        # AQUI ESTÁ A IMPLEMENTAÇÃO DO NOME DA ÚLTIMA COLUNA
-                        try:
-                            # Pega todos os nomes das colunas da planilha
-                            colunas = list(st.session_state['planilha_data'].columns)
-                            ultima_coluna = colunas[-1]
-                            # Pega o valor da ultima coluna
-                            nome_base_desejado = dados_linha.get(ultima_coluna, "")
-                            if not nome_base_desejado or pd.isna(nome_base_desejado):
-                                nome_cliente = str(dados_linha.get('Cliente', 'Proposta')).replace(' ', '_').replace('/','-')
-                                nome_base_desejado = f"Proposta_{nome_cliente}_{datetime.now().strftime('%Y%m%d')}"
-                        except Exception:
-                            # Fallback original
-                            nome_base_desejado = dados_linha.get("NOME DO ARQUIVO", "Proposta_Gerada")
-                        
-                        nome_arquivo_pdf = f"{nome_base_desejado}.pdf"
-
-                        status.update(label=f"4/4 - Convertendo para PDF ('{nome_arquivo_pdf}')... (pode levar alguns segundos)")
-                        pdf_bytes = converter_para_pdf(documento_odt_modificado, nome_base_desejado)
-                        if not pdf_bytes: raise ValueError("Falha ao converter o documento ODT para PDF usando LibreOffice.")
-
-                        pdf_bytes_result = pdf_bytes
-                        pdf_filename_result = nome_arquivo_pdf
-
-                        status.update(label="🎉 Proposta gerada com sucesso!", state="complete", expanded=False)
-
-                    except (ValueError, Exception) as e:
-                        status.update(label=f"❌ Erro ao gerar proposta: {str(e)}", state="error", expanded=True)
-
-                 if pdf_bytes_result and pdf_filename_result:
-                      st.success(f"✅ Documento '{pdf_filename_result}' pronto!") 
-                      st.download_button(
-                           label=f"📥 Baixar {pdf_filename_result}",
-                           data=pdf_bytes_result,
-                           file_name=pdf_filename_result,
-                           mime="application/pdf",
-                           key="download_pdf_final_btn", 
-                           use_container_width=True,
-                           type="primary" 
-                      )
+                 # A conversão roda em segundo plano: o script segue livre e a página acompanha o andamento
+                 nome_base_desejado = definir_nome_arquivo(dados_linha, list(planilha_da_sessao().columns))
+                 conversao_fundo.iniciar(
+                      st.session_state['id_sessao'], modelo_bytes, dados_linha, f"{nome_base_desejado}.pdf",
+                      backend=st.session_state['backends_modelos'].get(nome_modelo_selecionado),
+                 )
+
+            tarefa = conversao_fundo.obter(st.session_state['id_sessao'])
+            if tarefa is not None and tarefa.ativa:
+                 acompanhar_conversao()
+            elif tarefa is not None and tarefa.status == conversao_fundo.CONCLUIDO:
+                 st.success(f"✅ Documento '{tarefa.nome_arquivo}' pronto! {tarefa.etapa}")
+                 st.download_button(
+                      label=f"📥 Baixar {tarefa.nome_arquivo}",
+                      data=tarefa.pdf_bytes,
+                      file_name=tarefa.nome_arquivo,
+                      mime="application/pdf",
+                      key="download_pdf_final_btn",
+                      use_container_width=True,
+                      type="primary"
+                 )
+            elif tarefa is not None and tarefa.status == conversao_fundo.ERRO:
+                 st.error(mensagem_erro_conversao(tarefa.erro))
+            elif tarefa is not None and tarefa.status == conversao_fundo.CANCELADO:
+                 st.info(f"✖️ Geração de '{tarefa.nome_arquivo}' cancelada.")
+
+            st.divider()
+
+            with st.expander("📦 Geração em Lote (várias linhas em um único ZIP)", expanded=False):
+                df_lote = planilha_da_sessao()
+                st.caption("Gera uma proposta por linha e entrega todos os PDFs em um arquivo ZIP. Os nomes seguem a regra da última coluna da planilha.")
+
+                col_lote_ini, col_lote_fim = st.columns(2)
+                with col_lote_ini:
+                     linha_inicial_lote = st.number_input("Linha inicial:", min_value=2, max_value=len(df_lote) + 1, value=2, step=1, key="lote_linha_inicial")
+                with col_lote_fim:
+                     linha_final_lote = st.number_input("Linha final:", min_value=2, max_value=len(df_lote) + 1, value=len(df_lote) + 1, step=1, key="lote_linha_final")
+
+                filtro_lote = st.text_input(
+                     "Filtro opcional (sintaxe do pandas query):",
+                     placeholder='Ex.: Estado == "SP" and `TIPO DE MÁQUINA` == "Escavadeira"',
+                     help="O filtro pode usar as colunas dos placeholders e a coluna do nome do arquivo (última).",
+                     key="lote_filtro"
+                )
+                nomes_modelos_lote = list(st.session_state['modelos_info'].keys())
+                modelo_lote = st.selectbox(
+                     "Modelo ODT do lote:",
+                     options=nomes_modelos_lote,
+                     index=nomes_modelos_lote.index(nome_modelo_selecionado) if nome_modelo_selecionado in nomes_modelos_lote else 0,
+                     key="lote_modelo_select"
+                )
+                gerar_impressao = st.checkbox(
+                     "Gerar também um PDF único para impressão",
+                     help="Todas as propostas do lote em um só PDF, na ordem das linhas.",
+                     key="lote_impressao"
+                )
+
+                if st.button("📦 Gerar Lote em ZIP", type="primary", key="generate_batch_zip", use_container_width=True):
+                     # Remove o ZIP do lote anterior antes de gerar um novo
+                     armazem.remover_arquivos(st.session_state['id_sessao'], [
+                          st.session_state.get(chave_arquivo) for chave_arquivo in ('lote_zip_path', 'lote_impressao_path')])
+                     st.session_state['lote_zip_path'] = st.session_state['lote_impressao_path'] = None
+                     st.session_state['lote_erros'] = []
+
+                     try:
+                          posicoes_lote = selecionar_linhas_lote(df_lote, linha_inicial_lote, linha_final_lote, filtro_lote)
+                     except Exception as e:
+                          st.error(f"❌ Filtro inválido: {e}")
+                          posicoes_lote = None
+
+                     if posicoes_lote is not None and not posicoes_lote:
+                          st.warning("⚠️ Nenhuma linha corresponde ao intervalo/filtro informado.")
+                     elif posicoes_lote:
+                          barra_progresso = st.progress(0.0, text=f"Gerando {len(posicoes_lote)} proposta(s)...")
+
+                          def _atualizar_progresso(concluidos, total, numero_linha):
+                               barra_progresso.progress(concluidos / total, text=f"{concluidos}/{total} - linha {numero_linha} processada")
+
+                          # Registrados no armazém: apagados no reinício ou se a sessão for abandonada
+                          fd_zip, caminho_zip = tempfile.mkstemp(suffix='.zip', prefix='propostas_lote_')
+                          os.close(fd_zip)
+                          armazem.registrar_arquivo(st.session_state['id_sessao'], caminho_zip)
+                          caminho_impressao = None
+                          if gerar_impressao:
+                               fd_impressao, caminho_impressao = tempfile.mkstemp(suffix='.pdf', prefix='propostas_impressao_')
+                               os.close(fd_impressao)
+                               armazem.registrar_arquivo(st.session_state['id_sessao'], caminho_impressao)
+                          try:
+                               gerados, erros_lote = gerar_lote_zip(
+                                    df_lote, posicoes_lote, modelo_da_sessao(modelo_lote),
+                                    caminho_zip, ao_progredir=_atualizar_progresso,
+                                    backend=st.session_state['backends_modelos'].get(modelo_lote),
+                                    caminho_impressao=caminho_impressao,
+                               )
+                               st.session_state['lote_zip_path'] = caminho_zip
+                               st.session_state['lote_impressao_path'] = caminho_impressao
+                               st.session_state['lote_gerados'] = gerados
+                               st.session_state['lote_erros'] = erros_lote
+                          except Exception as e:
+                               armazem.remover_arquivos(st.session_state['id_sessao'], [caminho_zip, caminho_impressao])
+                               st.error(f"❌ Erro ao gerar o lote: {e}")
+
+                caminho_zip_lote = st.session_state.get('lote_zip_path')
+                if caminho_zip_lote and os.path.exists(caminho_zip_lote):
+                     erros_lote = st.session_state.get('lote_erros', [])
+                     if st.session_state.get('lote_gerados'):
+                          st.success(f"✅ {st.session_state['lote_gerados']} proposta(s) gerada(s).")
+                          botao_download_arquivo(
+                               caminho_zip_lote, "📥 Baixar ZIP com as Propostas",
+                               f"Propostas_{datetime.now().strftime('%Y%m%d_%H%M')}.zip", "application/zip",
+                               "download_batch_zip_btn",
+                          )
+                          caminho_impressao_lote = st.session_state.get('lote_impressao_path')
+                          # Vazio quando nenhuma proposta foi gerada (o arquivo é só reservado no início)
+                          if caminho_impressao_lote and os.path.exists(caminho_impressao_lote) and os.path.getsize(caminho_impressao_lote):
+                               botao_download_arquivo(
+                                    caminho_impressao_lote, "🖨️ Baixar PDF Único para Impressão",
+                                    f"Propostas_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf", "application/pdf",
+                                    "download_batch_print_btn",
+                               )
+                     if erros_lote:
+                          st.error(f"❌ {len(erros_lote)} linha(s) com erro:")
+                          st.dataframe(pd.DataFrame(erros_lote), hide_index=True, use_container_width=True)
 
             st.divider()
 
@@ -735,13 +594,58 @@ with tab_geracao:
             with col_btn_new_geracao:
                  if st.button("✨ Iniciar Nova Proposta (Voltar ao Início)", key="new_proposal_geracao", use_container_width=True):
                       st.session_state['current_tab'] = "Upload"
-                      st.session_state['planilha_data'] = None
+                      conversao_fundo.descartar(st.session_state['id_sessao'])
+                      armazem.liberar(st.session_state['id_sessao'])
+                      armazem.remover_arquivos(st.session_state['id_sessao'])
+                      st.session_state['lote_zip_path'] = st.session_state['lote_impressao_path'] = None
                       st.session_state['planilha_nome'] = None
+                      st.session_state['planilha_file_id'] = None
+                      st.session_state['modelos_info'] = {}
+                      st.session_state['versao_uploads'] += 1
                       st.session_state['dados_linha_selecionada'] = None
                       st.session_state['modelo_selecionado_nome'] = None
                       if 'last_selected_line' in st.session_state: del st.session_state['last_selected_line'] 
                       st.rerun()
 
+# --- Painel de depuração (abrir o app com ?debug=1) ---
+if st.query_params.get("debug") == "1":
+    with st.expander("🔧 Latência por etapa (processo inteiro)"):
+        etapas = metricas.exportar_json()
+        if etapas:
+            import pandas as pd
+            st.dataframe(pd.DataFrame([
+                {"Etapa": etapa, "Execuções": r["contagem"], "Erros": r["erros"],
+                 "Média (ms)": round(r["media_segundos"] * 1000, 1),
+                 "p50 ≤ (ms)": r["p50_segundos"] * 1000, "p95 ≤ (ms)": r["p95_segundos"] * 1000}
+                for etapa, r in etapas.items()
+            ]), hide_index=True, use_container_width=True)
+        else:
+            st.caption("Nenhuma etapa executada ainda.")
+        st.download_button("Exportar (Prometheus)", metricas.exportar_prometheus(),
+                           file_name="metricas_propostas.txt", mime="text/plain")
+    with st.expander("🔧 Memória desta sessão"):
+        import pandas as pd
+        # Dados compartilhados contam pela fração da sessão; uploads e PDF pronto são só dela
+        memoria = [{"Item": linha["papel"], "Tamanho (KB)": round(linha["bytes"] / 1024, 1),
+                    "Sessões que compartilham": linha["sessoes"], "Parte desta sessão (KB)": round(linha["bytes_da_sessao"] / 1024, 1)}
+                   for linha in armazem.relatorio(st.session_state['id_sessao'])]
+        arquivos_enviados = ([arquivo_planilha] if arquivo_planilha else []) + list(arquivos_modelo or [])
+        tarefa_sessao = conversao_fundo.obter(st.session_state['id_sessao'])
+        proprios = [(f"upload:{arquivo.name}", arquivo.size) for arquivo in arquivos_enviados]
+        if tarefa_sessao is not None and tarefa_sessao.pdf_bytes:
+            proprios.append((f"pdf:{tarefa_sessao.nome_arquivo}", len(tarefa_sessao.pdf_bytes)))
+        memoria += [{"Item": item, "Tamanho (KB)": round(tamanho / 1024, 1), "Sessões que compartilham": 1,
+                     "Parte desta sessão (KB)": round(tamanho / 1024, 1)} for item, tamanho in proprios]
+        if memoria:
+            st.dataframe(pd.DataFrame(memoria), hide_index=True, use_container_width=True)
+            st.caption(f"Total desta sessão: {sum(m['Parte desta sessão (KB)'] for m in memoria) / 1024:.1f} MB.")
+        else:
+            st.caption("Nenhum dado carregado nesta sessão.")
+        estatisticas_armazem = armazem.estatisticas()
+        st.caption(f"Processo: {estatisticas_armazem['sessoes']} sessão(ões) ativa(s), {estatisticas_armazem['itens']} item(ns) "
+                   f"compartilhado(s), {estatisticas_armazem['bytes'] / (1024 * 1024):.1f} MB em uso "
+                   f"({estatisticas_armazem['bytes_sem_compartilhar'] / (1024 * 1024):.1f} MB sem o compartilhamento).")
+
 st.markdown("---") 
 st.markdown("""
 <div class="footer">
@@ -0,0 +1,192 @@
+"""Armazém dos dados das sessões da interface, compartilhado pelo processo.
+
+As sessões não guardam mais DataFrames nem bytes de modelos no
+st.session_state: cada uma vincula um papel ("planilha", "modelo:<nome>")
+a uma chave de conteúdo, e o objeto fica uma única vez no armazém, com a
+contagem das sessões que o usam. A memória do servidor cresce com os
+arquivos distintos, não com as sessões abertas. O armazém é o único dono
+desses objetos: o cache_planilhas só guarda referências fracas e a
+interface lê os modelos do registro_modelos sem o cache em memória dele.
+Assim o objeto é de fato liberado quando a última sessão o solta, seja por
+troca de arquivo, por "Iniciar Nova Proposta" ou por inatividade. Uma
+sessão ociosa perde seus vínculos, e a interface os refaz a partir do
+upload ou do registro de modelos quando ela volta. Os objetos devolvidos
+são compartilhados e não devem ser modificados no lugar (quem precisar
+alterar, copia). Não entram nas contas os arquivos ainda presos aos
+uploaders do Streamlit (a interface os mostra à parte) nem os caches
+derivados e limitados por modelo (planos compilados, pré-visualizações,
+esqueletos).
+
+Os arquivos temporários da sessão (ZIP e PDF de impressão do lote) também
+são registrados aqui: saem do disco no reinício da sessão e quando ela fica
+ociosa, pois uma sessão abandonada nunca mais roda para apagá-los.
+
+Configuração por variável de ambiente:
+    PROPOSTAS_SESSAO_OCIOSA_MIN  minutos sem uso até os dados da sessão serem liberados (padrão: 30)
+"""
+import os
+import sys
+import logging
+import time
+import threading
+
+logger = logging.getLogger(__name__)
+
+TEMPO_OCIOSO_PADRAO = float(os.environ.get("PROPOSTAS_SESSAO_OCIOSA_MIN", "30")) * 60
+
+
+def _tamanho(objeto):
+    """Bytes ocupados pelo objeto (DataFrames pelo pandas, com as strings)"""
+    memory_usage = getattr(objeto, "memory_usage", None)
+    if memory_usage is not None:
+        return int(memory_usage(deep=True).sum())
+    if isinstance(objeto, (bytes, bytearray)):
+        return len(objeto)
+    return sys.getsizeof(objeto)
+
+
+def _apagar(caminhos):
+    for caminho in caminhos:
+        try:
+            os.unlink(caminho)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Não foi possível apagar o arquivo temporário %s (%s).", caminho, e)
+
+
+class _Item:
+    __slots__ = ("objeto", "tamanho", "sessoes")
+
+    def __init__(self, objeto):
+        self.objeto = objeto
+        self.tamanho = _tamanho(objeto)
+        self.sessoes = set()
+
+
+class ArmazemSessoes:
+    def __init__(self, tempo_ocioso=TEMPO_OCIOSO_PADRAO):
+        self.tempo_ocioso = tempo_ocioso
+        self._itens = {} # chave -> _Item
+        self._vinculos = {} # id da sessão -> {papel: chave}
+        self._ultimo_acesso = {} # id da sessão -> time.time()
+        self._arquivos = {} # id da sessão -> caminhos de arquivos temporários
+        self._lock = threading.Lock()
+
+    def _soltar(self, id_sessao, chave):
+        """Tira a sessão do item; sem sessões, o item sai do armazém. Chamar com o lock"""
+        item = self._itens.get(chave)
+        if item is None:
+            return
+        item.sessoes.discard(id_sessao)
+        if not item.sessoes:
+            del self._itens[chave]
+
+    def vincular(self, id_sessao, papel, chave, carregar):
+        """Objeto da chave para o papel da sessão; carregar() só roda se nenhuma sessão já o tiver"""
+        with self._lock:
+            self._ultimo_acesso[id_sessao] = time.time()
+            item = self._itens.get(chave)
+        if item is None:
+            item = _Item(carregar()) # Fora do lock: a leitura pode ser lenta
+        with self._lock:
+            # Outra sessão pode ter carregado a mesma chave enquanto isso: fica o primeiro
+            item = self._itens.setdefault(chave, item)
+            vinculos = self._vinculos.setdefault(id_sessao, {})
+            anterior = vinculos.get(papel)
+            vinculos[papel] = chave
+            item.sessoes.add(id_sessao)
+            if anterior is not None and anterior != chave:
+                self._soltar(id_sessao, anterior)
+            return item.objeto
+
+    def obter(self, id_sessao, papel):
+        """Objeto vinculado ao papel da sessão, ou None"""
+        with self._lock:
+            self._ultimo_acesso[id_sessao] = time.time()
+            chave = self._vinculos.get(id_sessao, {}).get(papel)
+            item = self._itens.get(chave) if chave is not None else None
+            return item.objeto if item is not None else None
+
+    def papeis(self, id_sessao):
+        """Papéis vinculados da sessão: {papel: chave}"""
+        with self._lock:
+            return dict(self._vinculos.get(id_sessao, {}))
+
+    def liberar(self, id_sessao, papeis=None):
+        """Solta os papéis da sessão (com papeis=None, todos os vínculos dela)"""
+        with self._lock:
+            vinculos = self._vinculos.get(id_sessao, {})
+            for papel in list(vinculos) if papeis is None else papeis:
+                chave = vinculos.pop(papel, None)
+                if chave is not None:
+                    self._soltar(id_sessao, chave)
+            if not vinculos:
+                self._vinculos.pop(id_sessao, None)
+
+    def registrar_arquivo(self, id_sessao, caminho):
+        """Arquivo temporário da sessão, apagado no reinício (remover_arquivos) ou por inatividade"""
+        with self._lock:
+            self._arquivos.setdefault(id_sessao, set()).add(caminho)
+
+    def remover_arquivos(self, id_sessao, caminhos=None):
+        """Apaga os arquivos temporários da sessão (com caminhos=None, todos eles)"""
+        with self._lock:
+            registrados = self._arquivos.get(id_sessao, set())
+            remover = set(registrados) if caminhos is None else {c for c in caminhos if c}
+            registrados -= remover
+            if not registrados:
+                self._arquivos.pop(id_sessao, None)
+        _apagar(remover)
+
+    def tocar(self, id_sessao):
+        """Marca a sessão como ativa (a cada rerun)"""
+        with self._lock:
+            self._ultimo_acesso[id_sessao] = time.time()
+
+    def remover_ociosas(self):
+        """Libera os dados das sessões sem uso há mais de tempo_ocioso; retorna os ids removidos"""
+        limite = time.time() - self.tempo_ocioso
+        arquivos = set()
+        with self._lock:
+            ociosas = [i for i, acesso in self._ultimo_acesso.items() if acesso < limite]
+            for id_sessao in ociosas:
+                del self._ultimo_acesso[id_sessao]
+                for chave in self._vinculos.pop(id_sessao, {}).values():
+                    self._soltar(id_sessao, chave)
+                arquivos |= self._arquivos.pop(id_sessao, set())
+        _apagar(arquivos)
+        return ociosas
+
+    def relatorio(self, id_sessao):
+        """Memória da sessão por papel: bytes do objeto, sessões que o compartilham e a parte da sessão"""
+        with self._lock:
+            linhas = []
+            for papel, chave in sorted(self._vinculos.get(id_sessao, {}).items()):
+                item = self._itens[chave]
+                linhas.append({"papel": papel, "chave": chave, "bytes": item.tamanho,
+                               "sessoes": len(item.sessoes), "bytes_da_sessao": item.tamanho // len(item.sessoes)})
+            return linhas
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                "sessoes": len(self._ultimo_acesso),
+                "itens": len(self._itens),
+                "bytes": sum(item.tamanho for item in self._itens.values()),
+                # O que ocuparia se cada sessão tivesse a própria cópia
+                "bytes_sem_compartilhar": sum(item.tamanho * len(item.sessoes) for item in self._itens.values()),
+            }
+
+
+_armazem = None
+_armazem_lock = threading.Lock()
+
+
+def obter_armazem():
+    """Armazém compartilhado do processo (persiste entre reruns e sessões do Streamlit)"""
+    global _armazem
+    with _armazem_lock:
+        if _armazem is None:
+            _armazem = ArmazemSessoes()
+        return _armazem
@@ -0,0 +1,74 @@
+"""ZIP do lote gravado de forma incremental, sem manter os PDFs em memória.
+
+Cada PDF é anexado ao arquivo assim que fica pronto, em blocos, e pode ser
+liberado logo em seguida. O ZIP vai para um caminho em disco ou para um
+arquivo temporário que só fica em memória enquanto for pequeno. O arquivo
+final é lido de volta também em blocos (iterar_blocos), então o pico de
+memória não cresce com o tamanho do lote.
+"""
+import time
+import tempfile
+import zipfile
+
+TAMANHO_BLOCO = 1024 * 1024
+MAX_MEMORIA_PADRAO = 16 * 1024 * 1024 # Acima disso o arquivo temporário vai para o disco
+
+
+class EscritorZipLote:
+    def __init__(self, caminho=None, max_memoria=MAX_MEMORIA_PADRAO, compressao=zipfile.ZIP_DEFLATED):
+        self.caminho = caminho
+        if caminho:
+            self.arquivo = open(caminho, "w+b")
+        else:
+            self.arquivo = tempfile.SpooledTemporaryFile(max_size=max_memoria, suffix=".zip")
+        self._zip = zipfile.ZipFile(self.arquivo, "w", compressao)
+        self.quantidade = 0
+
+    def adicionar(self, nome_arquivo, dados):
+        """Anexa um arquivo ao ZIP, gravando em blocos de TAMANHO_BLOCO"""
+        info = zipfile.ZipInfo(nome_arquivo, date_time=time.localtime()[:6])
+        info.compress_type = self._zip.compression
+        info.file_size = len(dados) # Tamanho conhecido: decide o ZIP64 antes de gravar
+        visao = memoryview(dados)
+        with self._zip.open(info, "w") as destino:
+            for inicio in range(0, len(visao), TAMANHO_BLOCO):
+                destino.write(visao[inicio:inicio + TAMANHO_BLOCO])
+        self.quantidade += 1
+
+    def finalizar(self):
+        """Grava o diretório central; retorna o tamanho do ZIP em bytes"""
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+        self.arquivo.seek(0, 2)
+        return self.arquivo.tell()
+
+    def iterar_blocos(self, tamanho_bloco=TAMANHO_BLOCO):
+        """Lê o ZIP finalizado em blocos (para respostas HTTP ou cópia para outro destino)"""
+        self.finalizar()
+        self.arquivo.seek(0)
+        while True:
+            bloco = self.arquivo.read(tamanho_bloco)
+            if not bloco:
+                break
+            yield bloco
+
+    def fechar(self):
+        self.finalizar()
+        self.arquivo.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo_excecao, excecao, rastreamento):
+        self.fechar()
+
+
+def iterar_blocos_arquivo(caminho, tamanho_bloco=TAMANHO_BLOCO):
+    """Lê um arquivo em disco em blocos, sem carregá-lo inteiro"""
+    with open(caminho, "rb") as f:
+        while True:
+            bloco = f.read(tamanho_bloco)
+            if not bloco:
+                break
+            yield bloco
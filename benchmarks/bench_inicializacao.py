@@ -0,0 +1,150 @@
+"""Benchmark da partida e dos reruns do app Streamlit.
+
+Cada medição roda em um processo Python novo, com o app executado pelo
+AppTest do Streamlit (sem navegador): a partida a frio é o tempo até o fim da
+primeira execução do script, importações incluídas; o rerun é a mediana das
+execuções seguintes, com a sessão vazia e com uma planilha e um modelo já
+carregados, ao lado do rerun de um script vazio (o custo fixo do Streamlit e
+do AppTest, que não depende do app). Também são listados os módulos pesados
+carregados na partida e, com --importtime, os de importação mais cara
+(python -X importtime).
+
+Uso: python benchmarks/bench_inicializacao.py [--repeticoes 5] [--reruns 50] [--linhas 2000]
+                                             [--importtime] [--saida resultado.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(RAIZ, "app.py")
+
+MODULOS_PESADOS = ("pandas", "numpy", "reportlab", "pdfminer", "pypdf", "openpyxl", "odf")
+
+
+def executar(reruns, linhas):
+    """Roda no processo filho: partida a frio e reruns do app"""
+    inicio = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    importacao_streamlit = time.perf_counter() - inicio
+
+    app = AppTest.from_file(APP, default_timeout=120)
+    inicio = time.perf_counter()
+    app.run()
+    primeira = time.perf_counter() - inicio
+    if app.exception:
+        raise SystemExit(f"O app falhou: {app.exception[0].message}")
+    carregados = sorted(m for m in MODULOS_PESADOS if m in sys.modules)
+
+    def _medir_reruns():
+        duracoes = []
+        for _ in range(reruns):
+            inicio = time.perf_counter()
+            app.run()
+            duracoes.append(time.perf_counter() - inicio)
+        return statistics.median(duracoes)
+
+    rerun_vazio = _medir_reruns()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, RAIZ)
+    from dados_sinteticos import gerar_dataframe, gerar_modelo_odt
+    import armazem_sessoes
+    import registro_modelos
+    # A sessão guarda só o hash; o modelo vai para o registro (diretório temporário do processo filho)
+    hash_modelo = registro_modelos.obter_registro().registrar(gerar_modelo_odt(campos=15, paragrafos=60), "modelo.odt")
+    df = gerar_dataframe(linhas)
+    armazem_sessoes.obter_armazem().vincular(app.session_state["id_sessao"], "planilha", "sintetica", lambda: df)
+    app.session_state["modelos_info"] = {"modelo.odt": hash_modelo}
+    app.session_state["modelo_selecionado_nome"] = "modelo.odt"
+    app.run()
+    rerun_com_dados = _medir_reruns()
+
+    app = AppTest.from_string("import streamlit as st", default_timeout=120)
+    app.run()
+    rerun_script_vazio = _medir_reruns()
+
+    return {
+        "importacao_streamlit_s": importacao_streamlit,
+        "primeira_execucao_s": primeira,
+        "partida_s": importacao_streamlit + primeira,
+        "rerun_vazio_s": rerun_vazio,
+        "rerun_com_dados_s": rerun_com_dados,
+        "rerun_script_vazio_s": rerun_script_vazio,
+        "modulos_pesados_na_partida": carregados,
+    }
+
+
+def _medir_em_processo(reruns, linhas):
+    comando = [sys.executable, os.path.abspath(__file__), "--executar",
+               "--reruns", str(reruns), "--linhas", str(linhas)]
+    with tempfile.TemporaryDirectory() as diretorio_modelos:
+        # Registro de modelos vazio e descartável: a medição não toca no registro real
+        ambiente = dict(os.environ, PROPOSTAS_MODELOS_DIR=diretorio_modelos)
+        saida = subprocess.run(comando, capture_output=True, text=True, cwd=RAIZ, env=ambiente)
+    if saida.returncode != 0:
+        raise SystemExit(saida.stderr.strip().splitlines()[-1])
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+
+def _mais_caros_na_importacao(quantidade=15):
+    """Módulos de maior tempo de importação acumulado ao importar os módulos do app"""
+    modulos = [nome[:-3] for nome in os.listdir(RAIZ)
+               if nome.endswith(".py") and nome not in ("app.py", "servidor_http.py", "gerar_propostas.py")]
+    codigo = "import streamlit\n" + "".join(f"import {m}\n" for m in sorted(modulos))
+    saida = subprocess.run([sys.executable, "-X", "importtime", "-c", codigo],
+                           capture_output=True, text=True, cwd=RAIZ)
+    tempos = []
+    for linha in saida.stderr.splitlines():
+        partes = linha.split("|")
+        if len(partes) == 3 and partes[1].strip().isdigit():
+            nome = partes[2].rstrip()
+            if not nome.startswith("  "): # Só os módulos importados diretamente
+                tempos.append((int(partes[1]), nome.strip()))
+    return sorted(tempos, reverse=True)[:quantidade]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeticoes", type=int, default=5, help="Partidas a frio medidas")
+    parser.add_argument("--reruns", type=int, default=50)
+    parser.add_argument("--linhas", type=int, default=2000, help="Linhas da planilha sintética")
+    parser.add_argument("--importtime", action="store_true", help="Lista os módulos de importação mais cara")
+    parser.add_argument("--saida", help="Arquivo JSON com os resultados")
+    parser.add_argument("--executar", action="store_true", help=argparse.SUPPRESS) # Processo filho
+    args = parser.parse_args()
+
+    if args.executar:
+        print(json.dumps(executar(args.reruns, args.linhas)))
+        return
+
+    resultados = [_medir_em_processo(args.reruns, args.linhas) for _ in range(args.repeticoes)]
+    resumo = {chave: statistics.median(r[chave] for r in resultados)
+              for chave in resultados[0] if chave.endswith("_s")}
+    resumo["modulos_pesados_na_partida"] = resultados[0]["modulos_pesados_na_partida"]
+
+    print(f"Partida a frio (mediana de {args.repeticoes}): {resumo['partida_s'] * 1000:.0f} ms "
+          f"(Streamlit {resumo['importacao_streamlit_s'] * 1000:.0f} ms + primeira execução "
+          f"{resumo['primeira_execucao_s'] * 1000:.0f} ms)")
+    print(f"Rerun, sessão vazia: {resumo['rerun_vazio_s'] * 1000:.1f} ms")
+    print(f"Rerun, planilha de {args.linhas} linhas e modelo carregados: {resumo['rerun_com_dados_s'] * 1000:.1f} ms")
+    print(f"Rerun de um script vazio (custo fixo): {resumo['rerun_script_vazio_s'] * 1000:.1f} ms")
+    print(f"Módulos pesados carregados na partida: {', '.join(resumo['modulos_pesados_na_partida']) or 'nenhum'}")
+    if args.importtime:
+        resumo["importacao_mais_cara"] = _mais_caros_na_importacao()
+        print("Importação mais cara (acumulado, ms):")
+        for microssegundos, nome in resumo["importacao_mais_cara"]:
+            print(f"  {microssegundos / 1000:>8.1f}  {nome}")
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(resumo, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
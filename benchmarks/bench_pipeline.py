@@ -0,0 +1,212 @@
+"""Benchmark do pipeline de geração: cada etapa isolada e o lote de ponta a ponta.
+
+Usa modelos ODT sintéticos (poucos/muitos campos, com imagens) e planilhas
+ODS/XLSX de tamanhos variados. A conversão para PDF usa o LibreOffice quando
+disponível; sem ele (ou com --conversao stub) é substituída por uma função
+que devolve um PDF fixo, para que as demais etapas continuem mensuráveis.
+Com o LibreOffice, o lote de ponta a ponta também é medido no motor
+"mala_direta" (uma conversão por grupo de linhas). O cache de PDFs é
+desativado durante a execução.
+
+O resultado é gravado em JSON; --comparar mostra a variação em relação a um
+resultado anterior (ex.: do commit base).
+
+Uso: python benchmarks/bench_pipeline.py [--linhas 100,1000,10000] [--conversao auto|soffice|stub]
+                                         [--repeticoes 5] [--lote 20] [--saida resultado.json]
+                                         [--comparar anterior.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+# O cache de PDFs mascararia o custo da conversão entre repetições
+os.environ["PROPOSTAS_CACHE_PDF_MAX_MB"] = "0"
+
+import pandas as pd  # noqa: E402
+
+import cache_planilhas  # noqa: E402
+import modelo_compilado  # noqa: E402
+import nucleo  # noqa: E402
+import pool_libreoffice  # noqa: E402
+import previa_html  # noqa: E402
+from dados_sinteticos import gerar_modelo_odt, gerar_ods, gerar_xlsx  # noqa: E402
+
+CENARIOS_MODELO = {
+    "poucos_campos": dict(campos=15, paragrafos=200),
+    "muitos_campos": dict(campos=400, paragrafos=2000),
+    "com_imagens": dict(campos=15, paragrafos=200, imagens=8, tamanho_imagem_kb=512),
+}
+
+GERADORES_PLANILHA = {"ods": gerar_ods, "xlsx": gerar_xlsx}
+
+PDF_STUB = b"%PDF-1.4\n1 0 obj<</Type/Catalog>>endobj\ntrailer<</Root 1 0 R>>\n%%EOF\n"
+
+
+def _converter_stub(odt_bytes, timeout=120, destinos=False):
+    return PDF_STUB
+
+
+def cronometrar(funcao, repeticoes):
+    duracoes = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        duracoes.append(time.perf_counter() - inicio)
+    return {
+        "repeticoes": repeticoes,
+        "media_s": statistics.fmean(duracoes),
+        "mediana_s": statistics.median(duracoes),
+        "min_s": min(duracoes),
+        "max_s": max(duracoes),
+    }
+
+
+def _commit_atual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _registrar(resultados, grupo, cenario, etapa, estatisticas, **extras):
+    resultado = {"grupo": grupo, "cenario": cenario, "etapa": etapa, **extras, **estatisticas}
+    resultados.append(resultado)
+    print(f"{grupo:<9} {cenario:<15} {etapa:<24} {estatisticas['mediana_s'] * 1000:12.2f} ms", file=sys.stderr)
+
+
+def medir_modelos(resultados, repeticoes, linhas_lote, repeticoes_conversao, mala_direta=False):
+    df = cache_planilhas.ler_planilha(gerar_ods(linhas_lote), "lote.ods")
+    dados_linha = df.iloc[0].fillna('').to_dict()
+    substituicoes = nucleo.criar_substituicoes(dados_linha)
+
+    for cenario, parametros in CENARIOS_MODELO.items():
+        modelo_bytes = gerar_modelo_odt(**parametros)
+        extras = {"bytes_modelo": len(modelo_bytes)}
+        content_xml = nucleo.extrair_conteudo_odt(modelo_bytes)
+        plano = modelo_compilado.compilar_conteudo(content_xml)
+        xml_modificado, _ = plano.renderizar(substituicoes)
+        odt_modificado = nucleo.criar_odt_modificado(modelo_bytes, xml_modificado)
+
+        etapas = [
+            ("extrair_conteudo_odt", lambda: nucleo.extrair_conteudo_odt(modelo_bytes), repeticoes),
+            ("compilar_modelo", lambda: modelo_compilado.compilar_conteudo(content_xml), repeticoes),
+            ("substituir_no_xml", lambda: nucleo.substituir_no_xml(content_xml, substituicoes), repeticoes),
+            ("renderizar_plano", lambda: plano.renderizar(substituicoes), repeticoes),
+            ("criar_odt_modificado", lambda: nucleo.criar_odt_modificado(modelo_bytes, xml_modificado), repeticoes),
+            ("converter_para_pdf", lambda: nucleo.converter_odt_em_pdf(odt_modificado), repeticoes_conversao),
+            # Sem o cache de pré-visualizações, que responderia às repetições
+            ("previa_html", lambda: (previa_html._previas.clear(), previa_html.gerar_previa(modelo_bytes, substituicoes)),
+             repeticoes),
+        ]
+        for etapa, funcao, n in etapas:
+            _registrar(resultados, "modelo", cenario, etapa, cronometrar(funcao, n), **extras)
+
+        posicoes = list(range(len(df)))
+        estatisticas = cronometrar(
+            lambda: nucleo.gerar_lote(df, posicoes, modelo_bytes, lambda nome, pdf: None), repeticoes_conversao)
+        _registrar(resultados, "lote", cenario, "ponta_a_ponta", estatisticas, linhas=len(posicoes), **extras)
+        if mala_direta:
+            # O PDF fixo do stub não tem os destinos das propostas: só faz sentido com o LibreOffice
+            estatisticas = cronometrar(lambda: nucleo.gerar_lote(
+                df, posicoes, modelo_bytes, lambda nome, pdf: None, backend=nucleo.BACKEND_MALA_DIRETA),
+                repeticoes_conversao)
+            _registrar(resultados, "lote", cenario, "ponta_a_ponta_mala_direta", estatisticas,
+                       linhas=len(posicoes), **extras)
+
+
+def medir_planilhas(resultados, tamanhos, repeticoes):
+    for linhas in tamanhos:
+        for formato, gerar in GERADORES_PLANILHA.items():
+            planilha_bytes = gerar(linhas)
+            nome_arquivo = f"planilha.{formato}"
+            n = 1 if linhas >= 10000 else repeticoes
+            estatisticas = cronometrar(lambda: cache_planilhas.ler_planilha(planilha_bytes, nome_arquivo), n)
+            _registrar(resultados, "planilha", f"{formato}_{linhas}", "ler_planilha", estatisticas,
+                       linhas=linhas, bytes_planilha=len(planilha_bytes))
+
+        # Mesma preparação por linha que gerar_lote faz antes de renderizar
+        df = cache_planilhas.ler_planilha(gerar_ods(linhas), "planilha.ods")
+
+        def _preparar_todas():
+            for posicao in range(len(df)):
+                nucleo.criar_substituicoes(df.iloc[posicao].fillna('').to_dict())
+
+        _registrar(resultados, "planilha", f"ods_{linhas}", "substituicoes_por_linha",
+                   cronometrar(_preparar_todas, 1), linhas=linhas)
+        _registrar(resultados, "planilha", f"ods_{linhas}", "substituicoes_por_coluna",
+                   cronometrar(lambda: nucleo.preparar_substituicoes_lote(df), 1), linhas=linhas)
+
+
+def comparar(resultados, caminho_anterior):
+    with open(caminho_anterior, encoding="utf-8") as f:
+        anteriores = {(r["grupo"], r["cenario"], r["etapa"]): r for r in json.load(f)["resultados"]}
+    print(f"\n{'etapa':<55} {'antes (ms)':>12} {'agora (ms)':>12} {'variação':>9}", file=sys.stderr)
+    for r in resultados:
+        chave = (r["grupo"], r["cenario"], r["etapa"])
+        anterior = anteriores.get(chave)
+        if anterior is None:
+            continue
+        antes, agora = anterior["mediana_s"] * 1000, r["mediana_s"] * 1000
+        variacao = f"{agora / antes:8.2f}x" if antes else "       -"
+        print(f"{'/'.join(chave):<55} {antes:12.2f} {agora:12.2f} {variacao}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--linhas", default="100,1000,10000",
+                        help="Tamanhos das planilhas, separados por vírgula (ex.: 100,1000,10000,100000)")
+    parser.add_argument("--conversao", choices=("auto", "soffice", "stub"), default="auto")
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--lote", type=int, default=20, help="Linhas do lote de ponta a ponta")
+    parser.add_argument("--saida", help="Arquivo JSON de saída (padrão: saída padrão)")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior para comparação")
+    args = parser.parse_args()
+
+    conversao = args.conversao
+    if conversao == "auto":
+        conversao = "soffice" if pool_libreoffice.localizar_libreoffice() else "stub"
+    if conversao == "stub":
+        nucleo.converter_odt_em_pdf = _converter_stub
+    elif not pool_libreoffice.localizar_libreoffice():
+        parser.error("LibreOffice não encontrado; use --conversao stub")
+    repeticoes_conversao = min(args.repeticoes, 3) if conversao == "soffice" else args.repeticoes
+
+    resultados = []
+    medir_modelos(resultados, args.repeticoes, args.lote, repeticoes_conversao, mala_direta=conversao == "soffice")
+    medir_planilhas(resultados, [int(n) for n in args.linhas.split(",") if n.strip()], args.repeticoes)
+
+    relatorio = {
+        "metadados": {
+            "commit": _commit_atual(),
+            "data": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "plataforma": platform.platform(),
+            "nucleos": os.cpu_count(),
+            "conversao": conversao,
+        },
+        "resultados": resultados,
+    }
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+    else:
+        json.dump(relatorio, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+
+    if args.comparar:
+        comparar(resultados, args.comparar)
+
+
+if __name__ == "__main__":
+    main()
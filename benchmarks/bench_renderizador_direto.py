@@ -0,0 +1,151 @@
+"""Benchmark dos motores de PDF: renderizador direto, esqueleto carimbado e LibreOffice.
+
+Cada motor roda em um processo Python próprio, que gera N propostas de um
+modelo sintético compatível com a renderização direta. São medidas a
+latência por proposta (a primeira à parte, pois inclui a partida do
+LibreOffice ou o registro das fontes) e o pico de memória (RSS) do processo
+Python e dos processos do LibreOffice que ele iniciou. O cache de PDFs é
+desativado. O esqueleto é preparado pelo LibreOffice na primeira proposta, por
+isso só é medido com ele instalado; sem LibreOffice, só o motor direto é medido.
+
+Uso: python benchmarks/bench_renderizador_direto.py [--propostas 20] [--paragrafos 60,200]
+                                                    [--saida resultado.json]
+"""
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import statistics
+import subprocess
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+os.environ["PROPOSTAS_CACHE_PDF_MAX_MB"] = "0"
+
+import nucleo  # noqa: E402
+import pool_libreoffice  # noqa: E402
+import renderizador_direto  # noqa: E402
+from dados_sinteticos import gerar_dataframe, gerar_modelo_odt  # noqa: E402
+
+
+def _processos_descendentes():
+    """PIDs de todos os processos descendentes deste (Linux, via /proc)"""
+    filhos = {}
+    for nome in os.listdir("/proc"):
+        if not nome.isdigit():
+            continue
+        try:
+            with open(f"/proc/{nome}/stat") as f:
+                pid_pai = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        filhos.setdefault(pid_pai, []).append(int(nome))
+    descendentes, pendentes = [], [os.getpid()]
+    while pendentes:
+        for filho in filhos.get(pendentes.pop(), []):
+            descendentes.append(filho)
+            pendentes.append(filho)
+    return descendentes
+
+
+def _pico_rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for linha in f:
+                if linha.startswith("VmHWM:"):
+                    return int(linha.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def executar(backend, paragrafos, propostas):
+    """Roda no processo filho: gera as propostas e devolve as medições"""
+    modelo_bytes = gerar_modelo_odt(campos=15, paragrafos=paragrafos)
+    if backend == nucleo.BACKEND_DIRETO and not renderizador_direto.preparar(modelo_bytes).compativel:
+        raise SystemExit(f"Modelo sintético incompatível: {renderizador_direto.preparar(modelo_bytes).motivos}")
+    df = gerar_dataframe(propostas)
+    duracoes = []
+    tamanho_pdf = 0
+    for posicao in range(propostas):
+        inicio = time.perf_counter()
+        pdf_bytes = nucleo.gerar_proposta_pdf(modelo_bytes, df.iloc[posicao].fillna('').to_dict(), backend)
+        duracoes.append(time.perf_counter() - inicio)
+        tamanho_pdf = len(pdf_bytes)
+
+    # Instâncias do pool ainda vivas: pico de cada uma; conversões avulsas já encerradas: RUSAGE_CHILDREN
+    rss_libreoffice_kb = sum(_pico_rss_kb(pid) for pid in _processos_descendentes())
+    rss_libreoffice_kb = max(rss_libreoffice_kb, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    seguintes = duracoes[1:] or duracoes
+    return {
+        "backend": backend,
+        "motor_efetivo": nucleo.motor_efetivo(modelo_bytes, backend), # Incompatíveis caem no LibreOffice
+        "paragrafos": paragrafos,
+        "propostas": propostas,
+        "primeira_s": duracoes[0],
+        "mediana_s": statistics.median(seguintes),
+        "p95_s": sorted(seguintes)[int(0.95 * (len(seguintes) - 1))],
+        "bytes_pdf": tamanho_pdf,
+        "rss_python_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "rss_libreoffice_mb": rss_libreoffice_kb / 1024,
+    }
+
+
+def _medir_em_processo(backend, paragrafos, propostas):
+    comando = [sys.executable, os.path.abspath(__file__), "--executar", backend,
+               "--paragrafos", str(paragrafos), "--propostas", str(propostas)]
+    saida = subprocess.run(comando, capture_output=True, text=True)
+    if saida.returncode != 0:
+        return {"backend": backend, "paragrafos": paragrafos, "erro": saida.stderr.strip().splitlines()[-1:]}
+    return json.loads(saida.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--propostas", type=int, default=20)
+    parser.add_argument("--paragrafos", default="60,200", help="Tamanhos do modelo (parágrafos), separados por vírgula")
+    parser.add_argument("--saida", help="Arquivo JSON com os resultados")
+    parser.add_argument("--executar", choices=nucleo.BACKENDS_PDF, help=argparse.SUPPRESS) # Processo filho
+    args = parser.parse_args()
+
+    if args.executar:
+        print(json.dumps(executar(args.executar, int(args.paragrafos), args.propostas)))
+        return
+
+    if not renderizador_direto.REPORTLAB_DISPONIVEL:
+        print("O renderizador direto precisa do pacote 'reportlab'.", file=sys.stderr)
+        return
+    backends = [nucleo.BACKEND_DIRETO]
+    if pool_libreoffice.localizar_libreoffice():
+        backends += [nucleo.BACKEND_ESQUELETO, nucleo.BACKEND_LIBREOFFICE]
+    else:
+        print("LibreOffice não encontrado: medindo só o renderizador direto.", file=sys.stderr)
+
+    resultados = []
+    print(f"{'motor':<12} {'parágrafos':>10} {'1ª (ms)':>10} {'mediana (ms)':>13} {'p95 (ms)':>10} "
+          f"{'RSS py (MB)':>12} {'RSS LO (MB)':>12}")
+    for paragrafos in (int(p) for p in args.paragrafos.split(",")):
+        for backend in backends:
+            resultado = _medir_em_processo(backend, paragrafos, args.propostas)
+            resultados.append(resultado)
+            if "erro" in resultado:
+                print(f"{backend:<12} {paragrafos:>10} erro: {resultado['erro']}")
+                continue
+            rotulo = backend if resultado["motor_efetivo"] == backend else f"{backend}*"
+            print(f"{rotulo:<12} {paragrafos:>10} {resultado['primeira_s'] * 1000:>10.1f} "
+                  f"{resultado['mediana_s'] * 1000:>13.1f} {resultado['p95_s'] * 1000:>10.1f} "
+                  f"{resultado['rss_python_mb']:>12.1f} {resultado['rss_libreoffice_mb']:>12.1f}")
+
+    if any(r.get("motor_efetivo", r["backend"]) != r["backend"] for r in resultados):
+        print("* modelo incompatível com o motor: as propostas foram geradas pelo LibreOffice.", file=sys.stderr)
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
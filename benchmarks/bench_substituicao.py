@@ -0,0 +1,102 @@
+"""Benchmark da substituição de placeholders em um modelo grande (várias páginas).
+
+Compara o algoritmo antigo (uma varredura do XML por coluna e por placeholder)
+com a varredura única de modelo_compilado e com o plano pré-compilado.
+
+Uso: python benchmarks/bench_substituicao.py [--paginas 200] [--repeticoes 20]
+"""
+import os
+import re
+import sys
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import modelo_compilado  # noqa: E402
+from modelo_compilado import MAPEAMENTO_COLUNAS  # noqa: E402
+
+CABECALHO = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<office:document-content xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+    'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" '
+    'xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0" office:version="1.2">'
+    '<office:body><office:text>'
+)
+RODAPE = '</office:text></office:body></office:document-content>'
+
+
+def gerar_content_xml(paginas, paragrafos_por_pagina=40):
+    """Gera um content.xml sintético com campos espalhados por todas as páginas"""
+    colunas = list(MAPEAMENTO_COLUNAS)
+    partes = [CABECALHO]
+    for pagina in range(paginas):
+        for i in range(paragrafos_por_pagina):
+            coluna = colunas[(pagina + i) % len(colunas)]
+            if i % 8 == 0:
+                partes.append(
+                    f'<text:p text:style-name="P1">Campo: <text:database-display text:table-name="Planilha1" '
+                    f'text:table-type="table" text:column-name="{coluna}" text:database-name="Base">'
+                    f'&lt;{coluna}&gt;</text:database-display></text:p>'
+                )
+            elif i % 8 == 4:
+                partes.append(f'<text:p text:style-name="P2">Texto livre com {MAPEAMENTO_COLUNAS[coluna]} no meio.</text:p>')
+            else:
+                partes.append(
+                    '<text:p text:style-name="P3">Lorem ipsum dolor sit amet, consectetur adipiscing elit, '
+                    'sed do eiusmod tempor incididunt ut labore et dolore magna aliqua.</text:p>'
+                )
+        partes.append('<text:p text:style-name="QuebraPagina"/>')
+    partes.append(RODAPE)
+    return "".join(partes)
+
+
+def substituir_no_xml_legado(content_xml, substituicoes):
+    """Algoritmo anterior: uma varredura por coluna e outra por placeholder"""
+    texto_modificado = content_xml
+    substituicoes_feitas = 0
+    for coluna, placeholder in MAPEAMENTO_COLUNAS.items():
+        if placeholder in substituicoes:
+            padrao = f'<text:database-display[^>]*text:column-name="{re.escape(coluna)}"[^>]*>([^<]*)</text:database-display>'
+            texto_modificado, num_subs = re.subn(
+                padrao,
+                lambda m: f'<text:database-display text:column-name="{coluna}" text:table-name="Planilha1" text:table-type="table" text:database-name="Formulário propostas Rompedor1">{substituicoes[placeholder]}</text:database-display>',
+                texto_modificado
+            )
+            substituicoes_feitas += num_subs
+    for placeholder, valor in substituicoes.items():
+        texto_modificado, num_subs_simples = re.subn(re.escape(placeholder), str(valor), texto_modificado)
+        substituicoes_feitas += num_subs_simples
+    return texto_modificado, substituicoes_feitas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--paginas", type=int, default=200)
+    parser.add_argument("--repeticoes", type=int, default=20)
+    args = parser.parse_args()
+
+    content_xml = gerar_content_xml(args.paginas)
+    substituicoes = {placeholder: f"Valor de {coluna}" for coluna, placeholder in MAPEAMENTO_COLUNAS.items()}
+
+    esperado = substituir_no_xml_legado(content_xml, substituicoes)
+    obtido = modelo_compilado.substituir_em_passada_unica(content_xml, substituicoes)
+    plano = modelo_compilado.compilar_conteudo(content_xml)
+    assert obtido == esperado, "A varredura única divergiu do algoritmo anterior"
+    assert plano.renderizar(substituicoes) == esperado, "O plano compilado divergiu do algoritmo anterior"
+
+    print(f"content.xml: {len(content_xml) / 1024:.0f} KiB, {args.paginas} páginas, {esperado[1]} substituições")
+    casos = {
+        "legado (2 x 15 varreduras)": lambda: substituir_no_xml_legado(content_xml, substituicoes),
+        "varredura única": lambda: modelo_compilado.substituir_em_passada_unica(content_xml, substituicoes),
+        "plano compilado (join)": lambda: plano.renderizar(substituicoes),
+    }
+    referencia = None
+    for nome, funcao in casos.items():
+        tempo = min(timeit.repeat(funcao, number=1, repeat=args.repeticoes))
+        referencia = referencia or tempo
+        print(f"{nome:<28} {tempo * 1000:9.2f} ms  ({referencia / tempo:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
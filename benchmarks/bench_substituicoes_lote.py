@@ -0,0 +1,80 @@
+"""Benchmark da preparação das substituições: linha a linha x coluna a coluna.
+
+Antes de medir, confere que nucleo.preparar_substituicoes_lote produz
+exatamente o mesmo que criar_substituicoes(df.iloc[p].fillna('').to_dict())
+em DataFrames com casos de borda (vazios, textos monetários, datas em
+vários formatos, colunas ausentes, DataFrame só numérico).
+
+Uso: python benchmarks/bench_substituicoes_lote.py [--linhas 100000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+import nucleo  # noqa: E402
+from dados_sinteticos import gerar_dataframe  # noqa: E402
+
+
+def por_linha(df):
+    return [nucleo.criar_substituicoes(df.iloc[p].fillna('').to_dict()) for p in range(len(df))]
+
+
+def casos_de_borda():
+    gerador = random.Random(1)
+    linhas = 300
+    valores_monetarios = [1234.5, "1.234,56", "abc", "", None, np.nan, 0, -0.005, 1e16, True, "12,5"]
+    datas = ["05/03/2024", "2024-03-05", "abc", "", None, 0, 45000.0, pd.Timestamp("2023-12-31 10:00"),
+             "31/12/2023", "2024-13-01"]
+    misto = pd.DataFrame({
+        "Cliente": [gerador.choice(["Ana", "José Ltda.", "", None, 42, 3.5]) for _ in range(linhas)],
+        "Número": [gerador.choice([1, 2.5, None, "10", pd.Timestamp("2024-01-02")]) for _ in range(linhas)],
+        "Valor Rompedor": [gerador.choice(valores_monetarios) for _ in range(linhas)],
+        "Valor Kit": [gerador.uniform(-1e7, 1e7) for _ in range(linhas)],
+        "Data": [gerador.choice(datas) for _ in range(linhas)],
+        "NOME DO ARQUIVO": [f"arq{i}" for i in range(linhas)],
+    })
+    numerico = pd.DataFrame({
+        "Número": np.arange(linhas),
+        "Valor Kit": [gerador.uniform(0, 1e6) if i % 5 else np.nan for i in range(linhas)],
+        "Telefone": np.arange(linhas) * 1000003,
+    })
+    sinteticos = gerar_dataframe(linhas)
+    sinteticos.loc[::9, "Data"] = pd.NaT
+    sinteticos.loc[::11, "Valor Rompedor"] = np.nan
+    return {"misto": misto, "numerico": numerico, "sinteticos": sinteticos,
+            "datas_como_texto": sinteticos.assign(Data=sinteticos["Data"].astype(str)),
+            "vazio": sinteticos.iloc[:0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--linhas", type=int, default=100000)
+    args = parser.parse_args()
+
+    for nome, df in casos_de_borda().items():
+        assert nucleo.preparar_substituicoes_lote(df) == por_linha(df), f"divergência no caso '{nome}'"
+        print(f"caso '{nome}': {len(df)} linhas idênticas")
+
+    df = gerar_dataframe(args.linhas)
+    inicio = time.perf_counter()
+    vetorizado = nucleo.preparar_substituicoes_lote(df)
+    t_vetorizado = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    linha_a_linha = por_linha(df)
+    t_linha = time.perf_counter() - inicio
+    assert vetorizado == linha_a_linha
+
+    print(f"\n{args.linhas} linhas")
+    print(f"{'linha a linha':<20} {t_linha:8.2f} s")
+    print(f"{'coluna a coluna':<20} {t_vetorizado:8.2f} s  ({t_linha / t_vetorizado:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
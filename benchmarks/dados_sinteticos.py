@@ -0,0 +1,196 @@
+"""Arquivos sintéticos para os benchmarks: modelos ODT e planilhas ODS/XLSX.
+
+Os geradores são determinísticos (mesmos parâmetros, mesmos bytes), então os
+resultados podem ser comparados entre commits.
+"""
+import io
+import random
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+import pandas as pd
+
+COLUNAS = [
+    "Cliente", "Cidade", "Estado", "Número", "Nome", "Telefone", "Email", "Modelo",
+    "TIPO DE MÁQUINA", "MODELO DE MÁQUINA", "Valor Rompedor", "Valor Kit",
+    "Condição de pagamento", "FRETE", "Data", "NOME DO ARQUIVO",
+]
+
+_CABECALHO = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<office:document-content xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+    'xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0" '
+    'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" office:version="1.2">'
+    '<office:body><office:spreadsheet><table:table table:name="Planilha1">'
+)
+_RODAPE = (
+    '<table:table-row table:number-rows-repeated="1048000">'
+    '<table:table-cell table:number-columns-repeated="1024"/></table:table-row>'
+    '</table:table></office:spreadsheet></office:body></office:document-content>'
+)
+
+_MANIFESTO = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">'
+    '<manifest:file-entry manifest:full-path="/" manifest:media-type="application/vnd.oasis.opendocument.spreadsheet"/>'
+    '<manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>'
+    '</manifest:manifest>'
+)
+
+
+def _celula_texto(texto):
+    return f'<table:table-cell office:value-type="string"><text:p>{escape(texto)}</text:p></table:table-cell>'
+
+
+def _celula_numero(valor):
+    return (f'<table:table-cell office:value-type="float" office:value="{valor}">'
+            f'<text:p>{valor}</text:p></table:table-cell>')
+
+
+def _celula_data(dia):
+    data = f"2024-{dia % 12 + 1:02d}-{dia % 28 + 1:02d}"
+    return (f'<table:table-cell office:value-type="date" office:date-value="{data}">'
+            f'<text:p>{data}</text:p></table:table-cell>')
+
+
+def gerar_ods(linhas):
+    """Bytes de um .ods com o cabeçalho de COLUNAS e 'linhas' linhas de dados"""
+    partes = [_CABECALHO, "<table:table-row>"]
+    partes.extend(_celula_texto(coluna) for coluna in COLUNAS)
+    partes.append('<table:table-cell table:number-columns-repeated="1008"/></table:table-row>')
+    for i in range(linhas):
+        partes.append("<table:table-row>")
+        for coluna in COLUNAS:
+            if coluna in ("Valor Rompedor", "Valor Kit"):
+                partes.append(_celula_numero(1000 + i * 1.5))
+            elif coluna == "Número":
+                partes.append(_celula_numero(i))
+            elif coluna == "Data":
+                partes.append(_celula_data(i))
+            elif coluna == "FRETE" and i % 7 == 0:
+                partes.append("<table:table-cell/>")
+            else:
+                partes.append(_celula_texto(f"{coluna} {i}"))
+        partes.append('<table:table-cell table:number-columns-repeated="1008"/></table:table-row>')
+    partes.append(_RODAPE)
+
+    saida = io.BytesIO()
+    with zipfile.ZipFile(saida, "w") as z:
+        z.writestr(zipfile.ZipInfo("mimetype"), "application/vnd.oasis.opendocument.spreadsheet")
+        z.writestr("content.xml", "".join(partes), zipfile.ZIP_DEFLATED)
+        z.writestr("META-INF/manifest.xml", _MANIFESTO, zipfile.ZIP_DEFLATED)
+    return saida.getvalue()
+
+
+def gerar_dataframe(linhas):
+    """DataFrame com os mesmos dados de gerar_ods"""
+    registros = []
+    for i in range(linhas):
+        registro = {}
+        for coluna in COLUNAS:
+            if coluna in ("Valor Rompedor", "Valor Kit"):
+                registro[coluna] = 1000 + i * 1.5
+            elif coluna == "Número":
+                registro[coluna] = i
+            elif coluna == "Data":
+                registro[coluna] = datetime(2024, i % 12 + 1, i % 28 + 1)
+            elif coluna == "FRETE" and i % 7 == 0:
+                registro[coluna] = None
+            else:
+                registro[coluna] = f"{coluna} {i}"
+        registros.append(registro)
+    return pd.DataFrame(registros, columns=COLUNAS)
+
+
+def gerar_xlsx(linhas):
+    """Bytes de um .xlsx com os dados de gerar_dataframe"""
+    saida = io.BytesIO()
+    gerar_dataframe(linhas).to_excel(saida, index=False)
+    return saida.getvalue()
+
+
+_CABECALHO_ODT = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<office:document-content xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+    'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" '
+    'xmlns:draw="urn:oasis:names:tc:opendocument:xmlns:drawing:1.0" '
+    'xmlns:xlink="http://www.w3.org/1999/xlink" '
+    'xmlns:svg="urn:oasis:names:tc:opendocument:xmlns:svg-compatible:1.0" '
+    'xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0" office:version="1.2">'
+    '<office:body><office:text>'
+)
+_RODAPE_ODT = '</office:text></office:body></office:document-content>'
+
+_MANIFESTO_ODT = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">'
+    '<manifest:file-entry manifest:full-path="/" manifest:media-type="application/vnd.oasis.opendocument.text"/>'
+    '<manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>'
+    '<manifest:file-entry manifest:full-path="styles.xml" manifest:media-type="text/xml"/>'
+    '{imagens}'
+    '</manifest:manifest>'
+)
+
+_STYLES_ODT = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<office:document-styles xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" office:version="1.2"/>'
+)
+
+
+def gerar_modelo_odt(campos=15, paragrafos=200, imagens=0, tamanho_imagem_kb=512):
+    """Bytes de um modelo .odt com 'campos' placeholders e 'imagens' imagens incompressíveis.
+
+    Os campos são tags text:database-display (metade em parágrafo próprio,
+    metade no meio de um texto), distribuídos entre os parágrafos.
+    """
+    colunas = COLUNAS[:-1] # NOME DO ARQUIVO não é placeholder
+    paragrafos = max(paragrafos, campos)
+    partes = [_CABECALHO_ODT]
+    intervalo = paragrafos / campos if campos else paragrafos + 1
+    proximo_campo = 0.0
+    campo = 0
+    for i in range(paragrafos):
+        if campo < campos and i >= proximo_campo:
+            coluna = colunas[campo % len(colunas)]
+            if campo % 2 == 0:
+                partes.append(
+                    f'<text:p text:style-name="P1">{escape(coluna)}: <text:database-display '
+                    f'text:table-name="Planilha1" text:table-type="table" text:column-name="{escape(coluna)}" '
+                    f'text:database-name="Base">&lt;{escape(coluna)}&gt;</text:database-display></text:p>'
+                )
+            else:
+                partes.append(
+                    f'<text:p text:style-name="P2">Texto com <text:database-display text:table-name="Planilha1" '
+                    f'text:table-type="table" text:column-name="{escape(coluna)}" text:database-name="Base">'
+                    f'&lt;{escape(coluna)}&gt;</text:database-display> no meio.</text:p>'
+                )
+            campo += 1
+            proximo_campo += intervalo
+        else:
+            partes.append(
+                '<text:p text:style-name="P3">Lorem ipsum dolor sit amet, consectetur adipiscing elit, '
+                'sed do eiusmod tempor incididunt ut labore et dolore magna aliqua.</text:p>'
+            )
+    for n in range(imagens):
+        partes.append(
+            f'<text:p><draw:frame svg:width="10cm" svg:height="5cm"><draw:image '
+            f'xlink:href="Pictures/imagem{n}.png" xlink:type="simple"/></draw:frame></text:p>'
+        )
+    partes.append(_RODAPE_ODT)
+
+    gerador = random.Random(0)
+    manifesto_imagens = "".join(
+        f'<manifest:file-entry manifest:full-path="Pictures/imagem{n}.png" manifest:media-type="image/png"/>'
+        for n in range(imagens)
+    )
+    saida = io.BytesIO()
+    with zipfile.ZipFile(saida, "w") as z:
+        z.writestr(zipfile.ZipInfo("mimetype"), "application/vnd.oasis.opendocument.text")
+        z.writestr("content.xml", "".join(partes), zipfile.ZIP_DEFLATED)
+        z.writestr("styles.xml", _STYLES_ODT, zipfile.ZIP_DEFLATED)
+        for n in range(imagens):
+            # Bytes aleatórios: não comprimem, como uma imagem PNG real
+            z.writestr(f"Pictures/imagem{n}.png", gerador.randbytes(tamanho_imagem_kb * 1024), zipfile.ZIP_STORED)
+        z.writestr("META-INF/manifest.xml", _MANIFESTO_ODT.format(imagens=manifesto_imagens), zipfile.ZIP_DEFLATED)
+    return saida.getvalue()
@@ -0,0 +1,139 @@
+"""Cache em disco dos PDFs gerados, endereçado pelo conteúdo.
+
+A chave é o hash do modelo ODT combinado com as substituições normalizadas
+(saída de criar_substituicoes). Regerar a mesma proposta devolve o PDF
+guardado sem passar pelo LibreOffice. Quando o tamanho total passa do
+limite, os arquivos menos usados recentemente são removidos (LRU pelo mtime).
+
+Configuração por variáveis de ambiente:
+    PROPOSTAS_CACHE_PDF_DIR     diretório do cache (padrão: <tmp>/gerador_propostas_cache_pdf)
+    PROPOSTAS_CACHE_PDF_MAX_MB  tamanho máximo em MB (0 desativa; padrão: 512)
+"""
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+DIRETORIO_PADRAO = os.environ.get(
+    "PROPOSTAS_CACHE_PDF_DIR", os.path.join(tempfile.gettempdir(), "gerador_propostas_cache_pdf"))
+MAX_BYTES_PADRAO = int(float(os.environ.get("PROPOSTAS_CACHE_PDF_MAX_MB", "512")) * 1024 * 1024)
+
+
+def calcular_chave(hash_modelo, substituicoes):
+    """Chave do cache: hash do modelo + substituições normalizadas (ordem e tipos)"""
+    normalizadas = json.dumps({str(k): str(v) for k, v in substituicoes.items()},
+                              sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f"{hash_modelo}\0{normalizadas}".encode("utf-8")).hexdigest()
+
+
+class CachePDF:
+    def __init__(self, diretorio=DIRETORIO_PADRAO, max_bytes=MAX_BYTES_PADRAO):
+        self.diretorio = diretorio
+        self.max_bytes = max_bytes
+        self.acertos = 0
+        self.falhas = 0
+        self.remocoes = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.diretorio, exist_ok=True)
+        self._total_bytes = sum(tamanho for _, _, tamanho in self._entradas())
+
+    @property
+    def ativo(self):
+        return self.max_bytes > 0
+
+    def _caminho(self, chave):
+        return os.path.join(self.diretorio, f"{chave}.pdf")
+
+    def _entradas(self):
+        """(mtime, caminho, tamanho) de cada PDF guardado"""
+        entradas = []
+        with os.scandir(self.diretorio) as it:
+            for entrada in it:
+                if entrada.is_file() and entrada.name.endswith(".pdf"):
+                    try:
+                        info = entrada.stat()
+                    except FileNotFoundError:
+                        continue
+                    entradas.append((info.st_mtime, entrada.path, info.st_size))
+        return entradas
+
+    def obter(self, chave):
+        """Retorna os bytes do PDF em cache ou None"""
+        if not self.ativo:
+            return None
+        caminho = self._caminho(chave)
+        try:
+            with open(caminho, "rb") as f:
+                pdf_bytes = f.read()
+            os.utime(caminho) # Marca como usado recentemente (LRU)
+        except FileNotFoundError:
+            with self._lock:
+                self.falhas += 1
+            return None
+        with self._lock:
+            self.acertos += 1
+        return pdf_bytes
+
+    def guardar(self, chave, pdf_bytes):
+        if not self.ativo or len(pdf_bytes) > self.max_bytes:
+            return
+        caminho = self._caminho(chave)
+        try:
+            # Escrita atômica: grava em arquivo temporário e renomeia
+            fd, caminho_temp = tempfile.mkstemp(dir=self.diretorio, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(pdf_bytes)
+            existia = os.path.exists(caminho)
+            os.replace(caminho_temp, caminho)
+        except OSError:
+            # O cache é apenas uma otimização: falha de disco não deve impedir a geração
+            if 'caminho_temp' in locals() and os.path.exists(caminho_temp):
+                os.unlink(caminho_temp)
+            return
+        with self._lock:
+            if not existia:
+                self._total_bytes += len(pdf_bytes)
+            if self._total_bytes > self.max_bytes:
+                self._remover_excedente()
+
+    def _remover_excedente(self):
+        """Remove os PDFs menos usados até caber em 90% do limite"""
+        entradas = sorted(self._entradas())
+        total = sum(tamanho for _, _, tamanho in entradas)
+        alvo = self.max_bytes * 0.9
+        for _, caminho, tamanho in entradas:
+            if total <= alvo:
+                break
+            try:
+                os.unlink(caminho)
+                total -= tamanho
+                self.remocoes += 1
+            except FileNotFoundError:
+                pass
+        self._total_bytes = total
+
+    def estatisticas(self):
+        with self._lock:
+            consultas = self.acertos + self.falhas
+            return {
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+                "taxa_acerto": self.acertos / consultas if consultas else 0.0,
+                "remocoes": self.remocoes,
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def obter_cache():
+    """Cache compartilhado do processo (persiste entre reruns do Streamlit)"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CachePDF()
+        return _cache
@@ -0,0 +1,108 @@
+"""Cache das planilhas já lidas, compartilhado entre reruns e sessões.
+
+Os DataFrames ficam indexados pelo hash do conteúdo do arquivo, então o
+mesmo arquivo enviado por outro usuário (ou reenviado) não é lido de novo
+enquanto estiver em memória. O cache guarda só referências fracas: quem
+mantém o DataFrame vivo é quem o usa (na interface, o armazem_sessoes),
+e o cache nunca impede que uma planilha solta por todas as sessões seja
+liberada. Os DataFrames devolvidos são compartilhados e não devem ser
+modificados no lugar. Com projetar=True, só as colunas usadas na geração
+ficam em memória (ver projetar_colunas).
+"""
+import io
+import hashlib
+import weakref
+import threading
+
+import metricas
+import modelo_compilado
+
+
+@metricas.cronometrado("ler_planilha")
+def ler_planilha(planilha_bytes, nome_arquivo):
+    """Lê a planilha (.ods, .xlsx, .xls) em um DataFrame"""
+    # pandas só é importado aqui: o app não paga a importação (~0,4 s) antes do primeiro upload
+    import pandas as pd
+    import leitor_ods
+    if nome_arquivo.endswith('.ods'):
+        try:
+            # Leitor por streaming; muito mais rápido e leve que o odfpy
+            return leitor_ods.ler_ods(planilha_bytes)
+        except Exception:
+            pass # Estrutura inesperada: usa o leitor completo do pandas
+        return pd.read_excel(io.BytesIO(planilha_bytes), engine='odf')
+    return pd.read_excel(io.BytesIO(planilha_bytes))
+
+
+def projetar_colunas(df):
+    """Mantém só as colunas mapeadas nos placeholders e a última (nome do arquivo), na ordem original"""
+    if not len(df.columns):
+        return df
+    manter = set(modelo_compilado.MAPEAMENTO_COLUNAS) | {df.columns[-1]}
+    return df.loc[:, df.columns.isin(manter)]
+
+
+def chave_planilha(planilha_bytes, projetar=False):
+    """Chave do conteúdo da planilha (a mesma do cache)"""
+    return hashlib.sha256(planilha_bytes).hexdigest() + (":projetada" if projetar else "")
+
+
+class CachePlanilhas:
+    def __init__(self):
+        self.acertos = 0
+        self.falhas = 0
+        self._itens = weakref.WeakValueDictionary() # hash -> DataFrame, enquanto alguém o usar
+        self._tamanhos = {} # hash -> bytes em memória dos itens vivos
+        self._lock = threading.RLock() # _esquecer pode rodar durante uma coleta com a trava já obtida
+
+    def carregar(self, planilha_bytes, nome_arquivo, projetar=False):
+        """Retorna o DataFrame da planilha, lendo o arquivo só se ninguém mais o tiver em memória"""
+        chave = chave_planilha(planilha_bytes, projetar)
+        with self._lock:
+            df = self._itens.get(chave)
+            if df is not None:
+                self.acertos += 1
+                return df
+            self.falhas += 1
+
+        df = ler_planilha(planilha_bytes, nome_arquivo)
+        if projetar:
+            colunas_originais = list(df.columns)
+            df = projetar_colunas(df).copy() # Cópia: as colunas descartadas são liberadas de fato
+            df.attrs["colunas_originais"] = colunas_originais # Para comparar com os placeholders do modelo
+
+        with self._lock:
+            existente = self._itens.get(chave)
+            if existente is not None:
+                return existente # Lido em paralelo por outra thread: fica o primeiro
+            self._itens[chave] = df
+            self._tamanhos[chave] = int(df.memory_usage(deep=True).sum())
+        weakref.finalize(df, self._esquecer, chave)
+        return df
+
+    def _esquecer(self, chave):
+        with self._lock:
+            if chave not in self._itens:
+                self._tamanhos.pop(chave, None)
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+                "itens": len(self._itens),
+                "bytes": sum(self._tamanhos.get(chave, 0) for chave in list(self._itens.keys())),
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def obter_cache():
+    """Cache compartilhado do processo (persiste entre reruns do Streamlit)"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CachePlanilhas()
+        return _cache
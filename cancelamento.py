@@ -0,0 +1,49 @@
+"""Cancelamento de conversões em andamento.
+
+Quem pede a conversão cria um Cancelamento e o repassa ao nucleo; quem a
+executa registra como interrompê-la (matar o processo soffice da linha de
+comando ou a instância do pool). Ao cancelar, essas ações rodam na hora e a
+conversão termina com ConversaoCancelada.
+"""
+import threading
+
+
+class ConversaoCancelada(Exception):
+    """A conversão foi cancelada por quem a pediu"""
+
+
+class Cancelamento:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._acoes = []
+        self.cancelado = False
+
+    def cancelar(self):
+        with self._lock:
+            if self.cancelado:
+                return
+            self.cancelado = True
+            acoes, self._acoes = self._acoes, []
+        for acao in acoes:
+            try:
+                acao()
+            except Exception:
+                pass # O processo pode já ter terminado
+
+    def registrar(self, acao):
+        """Executa acao() ao cancelar; na hora, se já estiver cancelado"""
+        with self._lock:
+            if not self.cancelado:
+                self._acoes.append(acao)
+                return
+        acao()
+
+    def remover(self, acao):
+        with self._lock:
+            if acao in self._acoes:
+                self._acoes.remove(acao)
+
+    def verificar(self):
+        """Levanta ConversaoCancelada se o cancelamento já foi pedido"""
+        if self.cancelado:
+            raise ConversaoCancelada("A conversão foi cancelada.")
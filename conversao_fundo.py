@@ -0,0 +1,131 @@
+"""Geração de propostas em segundo plano para a interface, uma por sessão.
+
+O clique em "Gerar" só enfileira a tarefa e o script do Streamlit segue
+livre: a página acompanha a etapa atual por consulta periódica, os reruns
+(qualquer interação com os widgets) não descartam o trabalho e o PDF pronto
+fica guardado até ser baixado ou substituído. Cada sessão tem no máximo uma
+tarefa; uma nova substitui (e cancela) a anterior. O cancelamento mata o
+soffice da conversão em andamento (ver cancelamento). Não depende do
+Streamlit.
+"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import nucleo
+from cancelamento import Cancelamento, ConversaoCancelada
+
+VALIDADE_RESULTADOS = 3600 # segundos que uma tarefa concluída fica disponível
+
+NA_FILA = "na_fila"
+PROCESSANDO = "processando"
+CONCLUIDO = "concluido"
+ERRO = "erro"
+CANCELADO = "cancelado"
+
+
+class TarefaConversao:
+    __slots__ = ("nome_arquivo", "status", "etapa", "pdf_bytes", "erro", "cancelamento",
+                 "criado_em", "iniciado_em", "concluido_em")
+
+    def __init__(self, nome_arquivo):
+        self.nome_arquivo = nome_arquivo
+        self.status = NA_FILA
+        self.etapa = "Aguardando uma conversão livre..."
+        self.pdf_bytes = None
+        self.erro = None # Exceção da falha, para quem exibe decidir a mensagem
+        self.cancelamento = Cancelamento()
+        self.criado_em = time.time()
+        self.iniciado_em = None
+        self.concluido_em = None
+
+    @property
+    def ativa(self):
+        return self.status in (NA_FILA, PROCESSANDO)
+
+    @property
+    def decorrido(self):
+        """Segundos desde o pedido (até a conclusão, se já terminou)"""
+        return (self.concluido_em or time.time()) - self.criado_em
+
+
+def _executar(tarefa, modelo_bytes, dados_linha, backend):
+    if tarefa.cancelamento.cancelado:
+        return # Cancelada ainda na fila (o status já foi marcado por cancelar)
+    tarefa.status = PROCESSANDO
+    tarefa.iniciado_em = time.time()
+    try:
+        # As mesmas etapas da geração síncrona, com a etapa atual exposta para a página acompanhar
+        tarefa.pdf_bytes = nucleo.gerar_proposta_pdf(
+            modelo_bytes, dados_linha, backend,
+            ao_mudar_etapa=lambda etapa: setattr(tarefa, "etapa", etapa), cancelamento=tarefa.cancelamento)
+        tarefa.status = CONCLUIDO
+    except ConversaoCancelada:
+        tarefa.status = CANCELADO
+    except Exception as e:
+        tarefa.erro = e
+        tarefa.status = ERRO
+    finally:
+        tarefa.concluido_em = time.time()
+
+
+_executor = None
+_tarefas = {} # id da sessão -> TarefaConversao
+_lock = threading.Lock()
+
+
+def _obter_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=nucleo.calcular_trabalhadores_conversao(),
+                                           thread_name_prefix="conversao_fundo")
+        return _executor
+
+
+def iniciar(id_sessao, modelo_bytes, dados_linha, nome_arquivo, backend=None):
+    """Enfileira a geração da proposta da sessão, cancelando a anterior se ainda estiver em andamento"""
+    tarefa = TarefaConversao(nome_arquivo)
+    executor = _obter_executor()
+    with _lock:
+        anterior = _tarefas.get(id_sessao)
+        _tarefas[id_sessao] = tarefa
+    if anterior is not None and anterior.ativa:
+        _cancelar_tarefa(anterior)
+    executor.submit(_executar, tarefa, modelo_bytes, dados_linha, backend)
+    _remover_expiradas()
+    return tarefa
+
+
+def obter(id_sessao):
+    with _lock:
+        return _tarefas.get(id_sessao)
+
+
+def _cancelar_tarefa(tarefa):
+    tarefa.cancelamento.cancelar()
+    if tarefa.status == NA_FILA:
+        tarefa.status = CANCELADO
+        tarefa.concluido_em = time.time()
+
+
+def cancelar(id_sessao):
+    """Cancela a tarefa da sessão; a conversão em andamento é interrompida"""
+    tarefa = obter(id_sessao)
+    if tarefa is not None and tarefa.ativa:
+        _cancelar_tarefa(tarefa)
+
+
+def descartar(id_sessao):
+    """Esquece a tarefa da sessão (cancelando-a, se ainda estiver em andamento)"""
+    with _lock:
+        tarefa = _tarefas.pop(id_sessao, None)
+    if tarefa is not None and tarefa.ativa:
+        _cancelar_tarefa(tarefa)
+
+
+def _remover_expiradas():
+    limite = time.time() - VALIDADE_RESULTADOS
+    with _lock:
+        for id_sessao in [i for i, t in _tarefas.items() if t.concluido_em is not None and t.concluido_em < limite]:
+            del _tarefas[id_sessao]
@@ -0,0 +1,362 @@
+"""Esqueleto pré-renderizado do PDF, com os campos carimbados por linha.
+
+O modelo é convertido duas vezes, uma única vez por modelo: com um marcador
+único no lugar de cada campo (para descobrir posição, fonte, tamanho e cor
+de cada ocorrência) e com os campos vazios (o esqueleto). Se todo o texto
+fora dos campos ficar exatamente na mesma posição nas duas versões, o
+layout não depende dos valores e o modelo é compatível. Isso recusa campos
+no meio da linha, centralizados ou alinhados à direita.
+
+Cada proposta é então o esqueleto mais uma atualização incremental do PDF
+(objetos anexados ao fim do arquivo) que substitui um fluxo de conteúdo
+reservado em cada página por outro com o texto dos campos. Não há
+LibreOffice nem releitura do esqueleto por linha. Um valor que não cabe na
+linha, ou que usa caracteres fora do WinAnsi, faz a linha seguir pelo
+caminho normal (carimbar devolve None).
+
+Depende de pdfminer.six (posições dos glifos) e pypdf (preparação do
+esqueleto), ambos opcionais. Os campos são escritos com as fontes padrão
+do PDF (Times/Helvetica/Courier), de métricas iguais às das fontes
+Liberation usadas pelo LibreOffice.
+"""
+import io
+import re
+import logging
+import threading
+from collections import OrderedDict
+
+import metricas
+
+try:
+    from pdfminer.fontmetrics import FONT_METRICS
+    from pdfminer.pdfdevice import PDFTextDevice
+    from pdfminer.pdffont import PDFUnicodeNotDefined
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+    from pypdf import PdfReader, PdfWriter
+    from pypdf.generic import ArrayObject, DecodedStreamObject, DictionaryObject, NameObject
+except ImportError:
+    PdfWriter = None
+
+# O pypdf não tem API pública para anexar um objeto indireto ao escritor: _add_object existe
+# em todas as versões testadas (ver o limite em requirements.txt). Sem ele, o motor fica indisponível.
+DEPENDENCIAS_DISPONIVEIS = PdfWriter is not None and hasattr(PdfWriter, "_add_object")
+
+logger = logging.getLogger(__name__)
+
+TOLERANCIA_PONTOS = 0.05 # Diferença de posição tolerada entre a sonda e o esqueleto
+_PREFIXO_SUBCONJUNTO = re.compile(r"^[A-Z]{6}\+")
+# (família genérica, negrito, itálico) -> fonte padrão do PDF
+_FONTES_PADRAO = {
+    ("sans", False, False): "Helvetica", ("sans", True, False): "Helvetica-Bold",
+    ("sans", False, True): "Helvetica-Oblique", ("sans", True, True): "Helvetica-BoldOblique",
+    ("serif", False, False): "Times-Roman", ("serif", True, False): "Times-Bold",
+    ("serif", False, True): "Times-Italic", ("serif", True, True): "Times-BoldItalic",
+    ("mono", False, False): "Courier", ("mono", True, False): "Courier-Bold",
+    ("mono", False, True): "Courier-Oblique", ("mono", True, True): "Courier-BoldOblique",
+}
+
+
+def _fonte_padrao(nome_fonte):
+    """Fonte padrão do PDF equivalente à fonte usada no modelo (ex.: LiberationSerif-Bold -> Times-Bold)"""
+    nome = _PREFIXO_SUBCONJUNTO.sub("", nome_fonte or "").lower()
+    if "mono" in nome or "courier" in nome:
+        familia = "mono"
+    elif "sans" not in nome and ("serif" in nome or "times" in nome or "roman" in nome):
+        familia = "serif"
+    else:
+        familia = "sans"
+    return _FONTES_PADRAO[(familia, "bold" in nome, "italic" in nome or "oblique" in nome)]
+
+
+def _largura_texto(texto, fonte, tamanho):
+    """Largura em pontos pelas métricas da fonte padrão; None se algum caractere não tiver métrica"""
+    larguras = FONT_METRICS[fonte][1]
+    total = 0
+    for caractere in texto:
+        largura = larguras.get(caractere)
+        if largura is None:
+            return None
+        total += largura
+    return total * tamanho / 1000
+
+
+def _texto_pdf(texto):
+    """String literal do PDF em WinAnsi; None se houver caractere sem representação"""
+    try:
+        dados = texto.encode("cp1252")
+    except UnicodeEncodeError:
+        return None
+    return b"(" + dados.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)").replace(b"\r", b"\\r") + b")"
+
+
+def _operador_cor(cor):
+    """Operador de cor de preenchimento do PDF para a cor do glifo"""
+    if isinstance(cor, (int, float)):
+        return f"{cor:g} g"
+    if isinstance(cor, (tuple, list)) and len(cor) == 3:
+        return f"{cor[0]:g} {cor[1]:g} {cor[2]:g} rg"
+    if isinstance(cor, (tuple, list)) and len(cor) == 4:
+        return f"{cor[0]:g} {cor[1]:g} {cor[2]:g} {cor[3]:g} k"
+    return "0 g"
+
+
+if DEPENDENCIAS_DISPONIVEIS:
+    class _ColetorGlifos(PDFTextDevice):
+        """Registra cada glifo desenhado: (texto, x, y, tamanho, fonte, cor, avanço)"""
+
+        def __init__(self, rsrcmgr):
+            super().__init__(rsrcmgr)
+            self.glifos = []
+
+        def render_char(self, matrix, font, fontsize, scaling, rise, cid, ncs, graphicstate):
+            try:
+                texto = font.to_unichr(cid)
+            except PDFUnicodeNotDefined:
+                texto = "\ufffd"
+            a, b, c, d, e, f = matrix
+            avanco = font.char_width(cid) * fontsize * scaling
+            tamanho = fontsize * (c * c + d * d) ** 0.5
+            self.glifos.append((texto, e + c * rise, f + d * rise, tamanho, getattr(font, "fontname", ""),
+                                graphicstate.ncolor, avanco * (a * a + b * b) ** 0.5))
+            return avanco
+
+
+def _extrair_glifos(pdf_bytes):
+    """[(largura_pagina, glifos)] de cada página"""
+    gerenciador = PDFResourceManager()
+    paginas = []
+    for pagina in PDFPage.get_pages(io.BytesIO(pdf_bytes)):
+        coletor = _ColetorGlifos(gerenciador)
+        PDFPageInterpreter(gerenciador, coletor).process_page(pagina)
+        x0, _, x1, _ = pagina.mediabox
+        paginas.append((x1 - x0, coletor.glifos))
+    return paginas
+
+
+class Esqueleto:
+    """PDF do modelo com os campos vazios e a posição de cada ocorrência dos campos"""
+
+    def __init__(self, motivos):
+        self.motivos = motivos # Vazio: modelo compatível
+        self.pdf = b""
+        self.ocorrencias = {} # número do fluxo reservado da página -> [(placeholder, x, y, tamanho, fonte, cor, limite_x)]
+        self.fontes = {} # fonte padrão -> nome do recurso (/FEsq0...)
+        self._trailer = b""
+        self._inicio_xref = 0
+
+    @property
+    def compativel(self):
+        return not self.motivos
+
+    @metricas.cronometrado("carimbar_esqueleto")
+    def carimbar(self, substituicoes):
+        """PDF da proposta (bytes), ou None se algum valor não puder ser carimbado com fidelidade"""
+        objetos = []
+        for numero_fluxo, ocorrencias in self.ocorrencias.items():
+            comandos = []
+            for placeholder, x, y, tamanho, fonte, cor, limite_x in ocorrencias:
+                if placeholder not in substituicoes:
+                    return None
+                # Mesmo tratamento de espaços do ODF: sequências viram um único espaço
+                valor = " ".join(str(substituicoes[placeholder]).split())
+                if not valor:
+                    continue
+                largura = _largura_texto(valor, fonte, tamanho)
+                texto = _texto_pdf(valor)
+                if largura is None or texto is None or x + largura > limite_x:
+                    return None
+                comandos.append(b"BT /%s %.3f Tf %s 1 0 0 1 %.3f %.3f Tm %s Tj ET" % (
+                    self.fontes[fonte].encode(), tamanho, _operador_cor(cor).encode(), x, y, texto))
+            objetos.append((numero_fluxo, b"\n".join(comandos)))
+
+        # Atualização incremental: o esqueleto fica intacto e os fluxos reservados são substituídos
+        partes = [self.pdf]
+        posicao = len(self.pdf)
+        entradas = []
+        for numero_fluxo, conteudo in sorted(objetos):
+            objeto = b"%d 0 obj\n<< /Length %d >>\nstream\n%s\nendstream\nendobj\n" % (numero_fluxo, len(conteudo), conteudo)
+            entradas.append(b"%d 1\n%010d 00000 n \n" % (numero_fluxo, posicao))
+            partes.append(objeto)
+            posicao += len(objeto)
+        partes.append(b"xref\n0 1\n0000000000 65535 f \n" + b"".join(entradas))
+        partes.append(b"trailer\n<< %s /Prev %d >>\nstartxref\n%d\n%%%%EOF\n" % (self._trailer, self._inicio_xref, posicao))
+        return b"".join(partes)
+
+
+def _localizar_marcadores(glifos, marcadores):
+    """Ocorrências [(placeholder, índice do primeiro glifo)] e os índices de todos os glifos de marcadores"""
+    texto = "".join(glifo[0] for glifo in glifos)
+    # Cada glifo tem um caractere (ligaduras raramente atingem marcadores de letras e dígitos)
+    if len(texto) != len(glifos):
+        return None, None
+    ocorrencias, indices = [], set()
+    for placeholder, marcador in marcadores.items():
+        inicio = texto.find(marcador)
+        while inicio >= 0:
+            ocorrencias.append((placeholder, inicio))
+            indices.update(range(inicio, inicio + len(marcador)))
+            inicio = texto.find(marcador, inicio + len(marcador))
+    return ocorrencias, indices
+
+
+def _visiveis(glifos, ignorar=frozenset()):
+    return [(g[0], g[1], g[2]) for i, g in enumerate(glifos) if i not in ignorar and g[0].strip()]
+
+
+def _mesma_posicao(glifos_a, glifos_b):
+    return len(glifos_a) == len(glifos_b) and all(
+        a[0] == b[0] and abs(a[1] - b[1]) <= TOLERANCIA_PONTOS and abs(a[2] - b[2]) <= TOLERANCIA_PONTOS
+        for a, b in zip(glifos_a, glifos_b))
+
+
+def _limite_direito(glifos_esqueleto, x, y, largura_pagina):
+    """Até onde um valor pode ir sem encostar em outro texto da mesma linha (ou passar da margem)"""
+    if not glifos_esqueleto:
+        return largura_pagina
+    margem_esquerda = min(g[1] for g in glifos_esqueleto)
+    limite = max(largura_pagina - margem_esquerda, max(g[1] + g[6] for g in glifos_esqueleto))
+    for texto, gx, gy, *_ in glifos_esqueleto:
+        if texto.strip() and abs(gy - y) <= 1 and gx > x:
+            limite = min(limite, gx)
+    return limite
+
+
+def _montar_esqueleto(esqueleto, pdf_vazio, ocorrencias_por_pagina):
+    """Reserva um fluxo de conteúdo por página com campos e registra as fontes usadas"""
+    escritor = PdfWriter(clone_from=PdfReader(io.BytesIO(pdf_vazio)))
+    fontes_usadas = sorted({o[4] for ocorrencias in ocorrencias_por_pagina.values() for o in ocorrencias})
+    referencias_fontes = {}
+    for i, fonte in enumerate(fontes_usadas):
+        esqueleto.fontes[fonte] = f"FEsq{i}"
+        referencias_fontes[fonte] = escritor._add_object(DictionaryObject({
+            NameObject("/Type"): NameObject("/Font"), NameObject("/Subtype"): NameObject("/Type1"),
+            NameObject("/BaseFont"): NameObject(f"/{fonte}"), NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
+        }))
+
+    reservados = {}
+    for numero_pagina, ocorrencias in ocorrencias_por_pagina.items():
+        pagina = escritor.pages[numero_pagina]
+        # q/Q em volta do conteúdo original: os campos são desenhados no estado gráfico inicial da página
+        abre, fecha, reservado = DecodedStreamObject(), DecodedStreamObject(), DecodedStreamObject()
+        abre.set_data(b"q\n")
+        fecha.set_data(b"\nQ\n")
+        conteudo = pagina.get("/Contents")
+        originais = list(conteudo.get_object()) if isinstance(conteudo.get_object(), ArrayObject) else [conteudo]
+        referencia_reservada = escritor._add_object(reservado)
+        pagina[NameObject("/Contents")] = ArrayObject(
+            [escritor._add_object(abre), *originais, escritor._add_object(fecha), referencia_reservada])
+        recursos = pagina.get("/Resources")
+        recursos = recursos.get_object() if recursos is not None else DictionaryObject()
+        fontes_pagina = recursos.get("/Font")
+        fontes_pagina = fontes_pagina.get_object() if fontes_pagina is not None else DictionaryObject()
+        for fonte in {o[4] for o in ocorrencias}:
+            fontes_pagina[NameObject(f"/{esqueleto.fontes[fonte]}")] = referencias_fontes[fonte]
+        recursos[NameObject("/Font")] = fontes_pagina
+        pagina[NameObject("/Resources")] = recursos
+        reservados[referencia_reservada.idnum] = ocorrencias
+
+    saida = io.BytesIO()
+    escritor.write(saida)
+    esqueleto.pdf = saida.getvalue()
+    if not esqueleto.pdf.endswith(b"\n"):
+        esqueleto.pdf += b"\n" # Os objetos anexados começam em uma linha nova
+    esqueleto.ocorrencias = reservados
+
+    # Dados do trailer para as atualizações incrementais
+    leitor = PdfReader(io.BytesIO(esqueleto.pdf))
+    trailer = leitor.trailer
+    partes = [b"/Size %d" % int(trailer["/Size"]), b"/Root %d 0 R" % trailer.raw_get("/Root").idnum]
+    if "/Info" in trailer:
+        partes.append(b"/Info %d 0 R" % trailer.raw_get("/Info").idnum)
+    if "/ID" in trailer:
+        partes.append(b"/ID [" + b" ".join(b"<" + bytes(getattr(i, "original_bytes", i)).hex().encode() + b">" for i in trailer["/ID"]) + b"]")
+    esqueleto._trailer = b" ".join(partes)
+    fim = esqueleto.pdf.rstrip()
+    esqueleto._inicio_xref = int(fim[fim.rindex(b"startxref") + len(b"startxref"):fim.rindex(b"%%EOF")].strip())
+
+
+def preparar(plano, converter):
+    """Monta o esqueleto a partir do plano do modelo; converter(content_xml) devolve o PDF"""
+    if not DEPENDENCIAS_DISPONIVEIS:
+        return Esqueleto(["Os pacotes 'pdfminer.six' e 'pypdf' (versão compatível) não estão instalados."])
+    placeholders = list(dict.fromkeys(placeholder for placeholder, *_ in plano.campos))
+    if not placeholders:
+        return Esqueleto(["O modelo não tem campos."])
+    marcadores = {placeholder: f"ZQX{i:03d}XQZ" for i, placeholder in enumerate(placeholders)}
+
+    paginas_sonda = _extrair_glifos(converter(plano.renderizar(marcadores)[0]))
+    pdf_vazio = converter(plano.renderizar({placeholder: "" for placeholder in placeholders})[0])
+    paginas_vazio = _extrair_glifos(pdf_vazio)
+    if len(paginas_sonda) != len(paginas_vazio):
+        return Esqueleto(["O número de páginas muda conforme o tamanho dos valores."])
+
+    encontrados = set()
+    ocorrencias_por_pagina = {}
+    for numero_pagina, ((largura, glifos_sonda), (_, glifos_vazio)) in enumerate(zip(paginas_sonda, paginas_vazio)):
+        ocorrencias, indices_marcadores = _localizar_marcadores(glifos_sonda, marcadores)
+        if ocorrencias is None:
+            return Esqueleto(["Não foi possível localizar os campos no PDF (texto com ligaduras ou glifos compostos)."])
+        if not _mesma_posicao(_visiveis(glifos_sonda, indices_marcadores), _visiveis(glifos_vazio)):
+            return Esqueleto(["O texto ao redor de algum campo muda de posição conforme o valor (campo no meio "
+                              "da linha, centralizado ou alinhado à direita)."])
+        for placeholder, inicio in ocorrencias:
+            _, x, y, tamanho, fonte, cor, _ = glifos_sonda[inicio]
+            ocorrencias_por_pagina.setdefault(numero_pagina, []).append((
+                placeholder, x, y, tamanho, _fonte_padrao(fonte), cor, _limite_direito(glifos_vazio, x, y, largura)))
+            encontrados.add(placeholder)
+
+    ausentes = [placeholder for placeholder in placeholders if placeholder not in encontrados]
+    if ausentes:
+        return Esqueleto([f"Campos que não aparecem no PDF (ocultos ou em cabeçalho/rodapé): {', '.join(ausentes)}."])
+
+    esqueleto = Esqueleto([])
+    _montar_esqueleto(esqueleto, pdf_vazio, ocorrencias_por_pagina)
+    return esqueleto
+
+
+MAX_ESQUELETOS_EM_CACHE = 32
+
+_esqueletos = OrderedDict()
+_esqueletos_lock = threading.Lock()
+# Um lock por modelo em preparação: duas threads não convertem o mesmo modelo duas vezes,
+# e a preparação de um modelo não bloqueia os demais
+_preparacoes = {} # hash do modelo -> threading.Lock
+
+
+def obter_esqueleto(hash_modelo, plano, converter):
+    """Esqueleto do modelo, preparado só na primeira vez (falhas de conversão não ficam no cache)"""
+    esqueleto = esqueleto_em_cache(hash_modelo)
+    if esqueleto is not None:
+        return esqueleto
+    with _esqueletos_lock:
+        preparacao_lock = _preparacoes.setdefault(hash_modelo, threading.Lock())
+    with preparacao_lock:
+        esqueleto = esqueleto_em_cache(hash_modelo) # Preparado por outra thread enquanto esta esperava
+        if esqueleto is not None:
+            return esqueleto
+
+        try:
+            with metricas.medir("preparar_esqueleto"):
+                esqueleto = preparar(plano, converter)
+            if not esqueleto.compativel:
+                logger.info("Modelo %s sem esqueleto: %s", hash_modelo[:12], " ".join(esqueleto.motivos))
+
+            with _esqueletos_lock:
+                _esqueletos[hash_modelo] = esqueleto
+                while len(_esqueletos) > MAX_ESQUELETOS_EM_CACHE:
+                    _esqueletos.popitem(last=False)
+        finally:
+            # Quem ainda espera já tem o lock em mãos e encontra o esqueleto no cache
+            with _esqueletos_lock:
+                _preparacoes.pop(hash_modelo, None)
+        return esqueleto
+
+
+def esqueleto_em_cache(hash_modelo):
+    """Esqueleto já preparado, sem preparar (None se ainda não foi)"""
+    with _esqueletos_lock:
+        esqueleto = _esqueletos.get(hash_modelo)
+        if esqueleto is not None:
+            _esqueletos.move_to_end(hash_modelo)
+        return esqueleto
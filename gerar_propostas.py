@@ -0,0 +1,101 @@
+"""Geração de propostas pela linha de comando, sem a interface Streamlit.
+
+Exemplos:
+    python gerar_propostas.py --planilha propostas.ods --modelo modelo.odt --linhas 2-500 --out saida/
+    python gerar_propostas.py --planilha propostas.ods --modelo modelo.odt --filtro 'Estado == "SP"' --zip lote.zip
+    python gerar_propostas.py --planilha propostas.ods --modelo modelo.odt --backend mala_direta --out saida/ --impressao lote.pdf
+
+As linhas seguem a numeração da planilha (a linha 1 é o cabeçalho). O código
+de saída é 0 quando todas as propostas foram geradas, 1 quando alguma linha
+falhou e 2 para erros de uso.
+"""
+import os
+import sys
+import argparse
+
+import cache_planilhas
+from nucleo import BACKEND_PDF_PADRAO, BACKENDS_PDF, gerar_lote, gerar_lote_zip, selecionar_linhas_lote
+
+
+def interpretar_intervalo(texto, total_linhas):
+    """Converte '2-500', '7' ou '10-' em (linha_inicial, linha_final)"""
+    ultima_linha = total_linhas + 1
+    if not texto:
+        return 2, ultima_linha
+    inicio, separador, fim = texto.partition("-")
+    linha_inicial = int(inicio) if inicio else 2
+    if not separador:
+        return linha_inicial, linha_inicial
+    linha_final = int(fim) if fim else ultima_linha
+    return linha_inicial, linha_final
+
+
+def criar_parser():
+    parser = argparse.ArgumentParser(
+        prog="gerar-propostas",
+        description="Gera propostas em PDF a partir de uma planilha e de um modelo ODT.",
+    )
+    parser.add_argument("--planilha", required=True, help="Planilha com os dados (.ods, .xlsx, .xls)")
+    parser.add_argument("--modelo", required=True, help="Modelo da proposta (.odt)")
+    parser.add_argument("--linhas", help="Intervalo de linhas da planilha, ex.: 2-500 (padrão: todas)")
+    parser.add_argument("--filtro", default="", help="Filtro no formato do pandas query, ex.: 'Estado == \"SP\"'")
+    destino = parser.add_mutually_exclusive_group(required=True)
+    destino.add_argument("--out", help="Diretório onde os PDFs serão gravados")
+    destino.add_argument("--zip", help="Arquivo ZIP onde os PDFs serão gravados")
+    parser.add_argument("--trabalhadores", type=int, help="Conversões simultâneas (padrão: núcleos da CPU)")
+    parser.add_argument("--backend", choices=BACKENDS_PDF, default=BACKEND_PDF_PADRAO,
+                        help="Motor de PDF; 'direto' dispensa o LibreOffice nos modelos compatíveis, 'esqueleto' "
+                             "o usa só para preparar o modelo e 'mala_direta' converte as linhas em grupos "
+                             "(padrão: %(default)s)")
+    parser.add_argument("--impressao", help="Grava também um PDF único com todas as propostas, para impressão")
+    parser.add_argument("--silencioso", action="store_true", help="Não exibe o progresso")
+    return parser
+
+
+def main(argv=None):
+    args = criar_parser().parse_args(argv)
+
+    try:
+        with open(args.planilha, "rb") as f:
+            df = cache_planilhas.ler_planilha(f.read(), args.planilha)
+        with open(args.modelo, "rb") as f:
+            modelo_bytes = f.read()
+        linha_inicial, linha_final = interpretar_intervalo(args.linhas, len(df))
+        posicoes = selecionar_linhas_lote(df, linha_inicial, linha_final, args.filtro)
+    except Exception as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 2
+
+    if not posicoes:
+        print("Nenhuma linha corresponde ao intervalo/filtro informado.", file=sys.stderr)
+        return 2
+
+    def _progresso(concluidos, total, numero_linha):
+        if not args.silencioso:
+            print(f"[{concluidos}/{total}] linha {numero_linha}", file=sys.stderr)
+
+    def _gravar(nome_arquivo_pdf, pdf_bytes):
+        # O nome vem da planilha, já limpo por definir_nome_arquivo: não cria subdiretórios nem sai de --out
+        with open(os.path.join(args.out, nome_arquivo_pdf), "wb") as f:
+            f.write(pdf_bytes)
+
+    try:
+        if args.zip:
+            gerados, erros = gerar_lote_zip(df, posicoes, modelo_bytes, args.zip, _progresso, args.trabalhadores,
+                                            args.backend, args.impressao)
+        else:
+            os.makedirs(args.out, exist_ok=True)
+            gerados, erros = gerar_lote(df, posicoes, modelo_bytes, _gravar, _progresso, args.trabalhadores,
+                                        args.backend, args.impressao)
+    except RuntimeError as e: # Ex.: PDF para impressão sem o pypdf
+        print(f"Erro: {e}", file=sys.stderr)
+        return 2
+
+    for erro in erros:
+        print(f"Linha {erro['Linha']}: {erro['Erro']}", file=sys.stderr)
+    print(f"{gerados} proposta(s) gerada(s), {len(erros)} com erro.")
+    return 1 if erros else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""Índice invertido para buscar linhas da planilha sem percorrer o DataFrame.
+
+O índice é montado uma única vez por DataFrame (os valores distintos de cada
+coluna são quebrados em termos uma vez só) e fica compartilhado entre reruns
+e sessões enquanto o DataFrame existir. Cada busca consulta apenas as listas
+de linhas dos termos pesquisados. A comparação ignora acentos e maiúsculas;
+o último termo da busca também casa como prefixo ("ped" encontra "Pedro").
+"""
+import re
+import bisect
+import itertools
+import weakref
+import threading
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+_PADRAO_TERMO = re.compile(r"\w+")
+_MARCAS_DIACRITICAS = re.compile("[\u0300-\u036f]")
+_SEPARADOR = "\x1f" # Separador de unidade (ASCII 31); não é \\w nem costuma aparecer em células
+_PADRAO_TERMO_OU_SEPARADOR = re.compile(r"\w+|\x1f")
+
+
+def normalizar(texto):
+    return _MARCAS_DIACRITICAS.sub("", unicodedata.normalize("NFKD", texto)).lower()
+
+
+def extrair_termos(texto):
+    return _PADRAO_TERMO.findall(normalizar(texto))
+
+
+def _termos_dos_valores(unicos):
+    """(código do valor, termo) de todos os valores distintos de uma coluna, em ordem de código.
+
+    Os valores são unidos por um separador e normalizados/quebrados de uma vez,
+    em vez de uma chamada por valor (mesmo resultado de extrair_termos em cada um).
+    """
+    textos = np.asarray(unicos.astype(str), dtype=object).tolist()
+    texto_unico = _SEPARADOR.join(textos)
+    if texto_unico.count(_SEPARADOR) != len(textos) - 1:
+        # Algum valor contém o próprio separador: quebra valor a valor
+        termos_por_valor = [extrair_termos(texto) for texto in textos]
+        codigos = np.repeat(np.arange(len(textos)), [len(termos) for termos in termos_por_valor])
+        return codigos, np.array(list(itertools.chain.from_iterable(termos_por_valor)), dtype=object)
+    pedacos = np.array(_PADRAO_TERMO_OU_SEPARADOR.findall(normalizar(texto_unico)), dtype=object)
+    separadores = pedacos == _SEPARADOR
+    return np.cumsum(separadores)[~separadores], pedacos[~separadores]
+
+
+class IndiceBusca:
+    def __init__(self, df):
+        self.total_linhas = len(df)
+        termos_colunas, linhas_colunas = [], []
+        for i in range(df.shape[1]):
+            codigos, unicos = pd.factorize(df.iloc[:, i])
+            if not len(unicos):
+                continue
+            codigos_valor, termos = _termos_dos_valores(unicos)
+            quantidades = np.bincount(codigos_valor, minlength=len(unicos))
+            inicios = np.concatenate(([0], np.cumsum(quantidades)[:-1]))
+            # Cada linha recebe os termos do seu valor (linhas vazias, código -1, não entram)
+            validas = np.flatnonzero(codigos >= 0)
+            por_linha = quantidades[codigos[validas]]
+            total = int(por_linha.sum())
+            deslocamento = np.arange(total) - np.repeat(np.cumsum(por_linha) - por_linha, por_linha)
+            termos_colunas.append(termos[np.repeat(inicios[codigos[validas]], por_linha) + deslocamento])
+            linhas_colunas.append(np.repeat(validas.astype(np.int32), por_linha))
+
+        if termos_colunas:
+            codigos_termo, vocabulario = pd.factorize(np.concatenate(termos_colunas), sort=True)
+            linhas = np.concatenate(linhas_colunas)
+        else:
+            codigos_termo, vocabulario, linhas = np.empty(0, dtype=np.intp), [], np.empty(0, dtype=np.int32)
+        # Um único array de linhas ordenado por (termo, linha); cada termo é uma fatia contígua
+        ordem = np.lexsort((linhas, codigos_termo))
+        codigos_termo, linhas = codigos_termo[ordem], linhas[ordem]
+        distintos = np.ones(len(linhas), dtype=bool)
+        distintos[1:] = (codigos_termo[1:] != codigos_termo[:-1]) | (linhas[1:] != linhas[:-1])
+        codigos_termo, self._linhas = codigos_termo[distintos], linhas[distintos]
+        self._vocabulario = list(vocabulario)
+        self._limites = np.searchsorted(codigos_termo, np.arange(len(self._vocabulario) + 1))
+
+    def _linhas_do_termo(self, termo):
+        i = bisect.bisect_left(self._vocabulario, termo)
+        if i == len(self._vocabulario) or self._vocabulario[i] != termo:
+            return np.empty(0, dtype=np.int32)
+        return self._linhas[self._limites[i]:self._limites[i + 1]]
+
+    def _linhas_com_prefixo(self, prefixo):
+        # Termos com o prefixo são vizinhos no vocabulário ordenado: uma única fatia do array
+        inicio = bisect.bisect_left(self._vocabulario, prefixo)
+        fim = bisect.bisect_left(self._vocabulario, prefixo + "\U0010ffff", lo=inicio)
+        return np.unique(self._linhas[self._limites[inicio]:self._limites[fim]])
+
+    def buscar(self, texto):
+        """Posições (base zero, em ordem) das linhas com todos os termos; None se a busca estiver vazia"""
+        termos = extrair_termos(texto or "")
+        if not termos:
+            return None
+        *completos, ultimo = termos
+        resultado = self._linhas_com_prefixo(ultimo)
+        for termo in completos:
+            if not len(resultado):
+                break
+            resultado = np.intersect1d(resultado, self._linhas_do_termo(termo), assume_unique=True)
+        return resultado
+
+
+_indices = {} # id(DataFrame) -> (referência fraca, IndiceBusca)
+_indices_lock = threading.RLock() # O descarte pode ocorrer durante uma coleta com a trava já obtida
+
+
+def obter_indice(df):
+    """Índice do DataFrame, montado só na primeira busca e descartado junto com ele"""
+    chave = id(df)
+    with _indices_lock:
+        item = _indices.get(chave)
+        if item is not None and item[0]() is df:
+            return item[1]
+
+    indice = IndiceBusca(df)
+
+    def _descartar(_, chave=chave):
+        with _indices_lock:
+            _indices.pop(chave, None)
+
+    with _indices_lock:
+        _indices[chave] = (weakref.ref(df, _descartar), indice)
+    return indice
@@ -0,0 +1,151 @@
+"""Leitor rápido de planilhas ODS.
+
+Lê o 'content.xml' de dentro do ZIP com iterparse, linha a linha, sem montar
+o DOM completo do odfpy. As repetições (table:number-columns-repeated e
+table:number-rows-repeated) só são expandidas quando há conteúdo depois
+delas; as milhares de linhas/colunas vazias que o LibreOffice grava no fim
+da planilha nunca chegam a ser criadas.
+
+O resultado é o mesmo de pd.read_excel(..., engine='odf') para a primeira
+aba: mesmas regras de conversão de células e a mesma inferência de tipos
+(TextParser do pandas, cabeçalho na primeira linha).
+"""
+import io
+import zipfile
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+_NS_TABLE = "urn:oasis:names:tc:opendocument:xmlns:table:1.0"
+_NS_OFFICE = "urn:oasis:names:tc:opendocument:xmlns:office:1.0"
+_NS_TEXT = "urn:oasis:names:tc:opendocument:xmlns:text:1.0"
+
+_TABELA = f"{{{_NS_TABLE}}}table"
+_LINHA = f"{{{_NS_TABLE}}}table-row"
+_CELULA = f"{{{_NS_TABLE}}}table-cell"
+_CELULA_COBERTA = f"{{{_NS_TABLE}}}covered-table-cell"
+_REPETE_COLUNAS = f"{{{_NS_TABLE}}}number-columns-repeated"
+_REPETE_LINHAS = f"{{{_NS_TABLE}}}number-rows-repeated"
+_TIPO_VALOR = f"{{{_NS_OFFICE}}}value-type"
+_VALOR = f"{{{_NS_OFFICE}}}value"
+_VALOR_DATA = f"{{{_NS_OFFICE}}}date-value"
+_ESPACOS = f"{{{_NS_TEXT}}}s"
+_QTD_ESPACOS = f"{{{_NS_TEXT}}}c"
+_ANOTACAO = f"{{{_NS_OFFICE}}}annotation"
+
+VAZIO = ""
+
+
+def _texto_celula(elemento):
+    """Texto da célula, expandindo text:s (sequências de espaços) e ignorando anotações"""
+    partes = [(elemento.text or "").strip("\n")]
+    for filho in elemento:
+        if filho.tag == _ESPACOS:
+            partes.append(" " * int(filho.get(_QTD_ESPACOS, 1)))
+        elif filho.tag != _ANOTACAO:
+            partes.append(_texto_celula(filho))
+        partes.append((filho.tail or "").strip("\n"))
+    return "".join(partes)
+
+
+def _texto_exibido(elemento):
+    return "".join(elemento.itertext())
+
+
+def _valor_celula(celula):
+    """Converte a célula com as mesmas regras do leitor 'odf' do pandas"""
+    tipo = celula.get(_TIPO_VALOR)
+    if tipo == "float":
+        valor = float(celula.get(_VALOR))
+        inteiro = int(valor)
+        return inteiro if inteiro == valor else valor
+    if tipo in ("percentage", "currency"):
+        return float(celula.get(_VALOR))
+    if tipo == "date":
+        return pd.Timestamp(celula.get(_VALOR_DATA))
+
+    # Os demais tipos dependem do texto exibido na célula
+    texto = _texto_exibido(celula)
+    if texto == "#N/A":
+        return np.nan
+    if tipo is None:
+        return VAZIO
+    if tipo == "string":
+        return _texto_celula(celula)
+    if tipo == "boolean":
+        return texto == "TRUE"
+    if tipo == "time":
+        return pd.Timestamp(texto).time()
+    raise ValueError(f"Tipo de célula não reconhecido: {tipo}")
+
+
+def iterar_linhas_ods(planilha_bytes):
+    """Gera as linhas da primeira aba como listas de valores.
+
+    Linhas vazias só são emitidas quando seguidas de uma linha com conteúdo, e
+    as linhas não são completadas até a largura máxima (ver ler_ods).
+    """
+    with zipfile.ZipFile(io.BytesIO(planilha_bytes), "r") as zip_ref:
+        with zip_ref.open("content.xml") as content:
+            pilha = []
+            linhas_vazias = 0
+            dentro_tabela = False
+            for evento, elemento in ET.iterparse(content, events=("start", "end")):
+                if evento == "start":
+                    if elemento.tag == _TABELA:
+                        dentro_tabela = True
+                    pilha.append(elemento)
+                    continue
+
+                pilha.pop()
+                if elemento.tag == _TABELA:
+                    return # Apenas a primeira aba, como o read_excel com sheet_name=0
+                if not dentro_tabela or elemento.tag != _LINHA:
+                    continue
+
+                linha = []
+                celulas_vazias = 0
+                for celula in elemento:
+                    if celula.tag == _CELULA:
+                        valor = _valor_celula(celula)
+                    elif celula.tag == _CELULA_COBERTA:
+                        valor = VAZIO
+                    else:
+                        continue
+                    repeticoes = int(celula.get(_REPETE_COLUNAS, 1))
+                    # Células vazias só entram se houver conteúdo depois delas
+                    if isinstance(valor, str) and valor == VAZIO:
+                        celulas_vazias += repeticoes
+                    else:
+                        linha.extend([VAZIO] * celulas_vazias)
+                        celulas_vazias = 0
+                        linha.extend([valor] * repeticoes)
+
+                repeticoes_linha = int(elemento.get(_REPETE_LINHAS, 1))
+                if not linha:
+                    linhas_vazias += repeticoes_linha
+                else:
+                    for _ in range(linhas_vazias):
+                        yield [VAZIO]
+                    linhas_vazias = 0
+                    for _ in range(repeticoes_linha):
+                        yield list(linha)
+
+                # Libera a linha já processada para manter a memória constante
+                elemento.clear()
+                if pilha:
+                    pilha[-1].remove(elemento)
+
+
+def ler_ods(planilha_bytes):
+    """Substituto de pd.read_excel(io.BytesIO(planilha_bytes), engine='odf')"""
+    linhas = list(iterar_linhas_ods(planilha_bytes))
+    largura = max((len(linha) for linha in linhas), default=0)
+    for linha in linhas:
+        if len(linha) < largura:
+            linha.extend([VAZIO] * (largura - len(linha)))
+    if not linhas:
+        return pd.DataFrame()
+    return TextParser(linhas, header=0).read()
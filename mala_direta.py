@@ -0,0 +1,368 @@
+"""Mala direta: várias propostas em um único ODT, convertido uma vez e dividido.
+
+O corpo já substituído de cada linha vira uma seção de um único
+'content.xml': a partir da segunda, cada seção começa em uma página nova,
+com o estilo de página do modelo e a numeração de páginas reiniciada. O
+primeiro parágrafo de cada seção recebe um marcador (text:bookmark), que o
+LibreOffice exporta como destino nomeado do PDF; os destinos dão a página
+inicial de cada proposta, e o PDF combinado é dividido por esses intervalos.
+O custo fixo de cada conversão (carregar e exportar o documento) é pago uma
+vez por grupo em vez de uma vez por proposta. O PDF combinado também serve
+para imprimir o lote de uma vez.
+
+Modelos cujo resultado mudaria ao repetir o corpo no mesmo documento (total
+de páginas, inclusive no cabeçalho/rodapé, notas de rodapé, numeração sequencial, índices, quadros
+ancorados na página, referências cruzadas, listas que continuam outras)
+são recusados e seguem pela conversão linha a linha. Dividir o PDF depende
+do pypdf (pip install pypdf), opcional.
+"""
+import io
+import re
+import threading
+from collections import OrderedDict
+from xml.parsers import expat
+from xml.sax.saxutils import escape
+
+import metricas
+import modelo_compilado
+import pacote_odt
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:
+    PdfWriter = None
+
+PYPDF_DISPONIVEL = PdfWriter is not None
+
+PREFIXO_MARCADOR = "proposta_"
+_NOME_ESTILO_QUEBRA = "PMalaDireta"
+# Filhos de office:text que vêm antes do conteúdo e não se repetem por seção
+_DECLARACOES = frozenset((
+    "text:sequence-decls", "text:variable-decls", "text:user-field-decls", "text:dde-connection-decls",
+    "text:alphabetical-index-auto-mark-file", "office:forms", "table:calculation-settings",
+    "table:content-validations", "table:label-ranges",
+))
+_ELEMENTOS_RECUSADOS = {
+    "text:page-count": "total de páginas (contaria o lote inteiro)",
+    "text:note": "notas de rodapé/fim (a numeração continuaria entre as propostas)",
+    "text:sequence": "numeração sequencial de figuras/tabelas",
+    "text:variable-set": "variáveis", "text:variable-get": "variáveis", "text:variable-input": "variáveis",
+    "text:bookmark-ref": "referências cruzadas", "text:reference-ref": "referências cruzadas",
+    "text:sequence-ref": "referências cruzadas", "text:note-ref": "referências cruzadas",
+    "text:table-of-content": "índices", "text:alphabetical-index": "índices", "text:bibliography": "índices",
+    "text:illustration-index": "índices", "text:table-index": "índices", "text:object-index": "índices",
+    "text:user-index": "índices",
+}
+# Abertura de uma tag: nome, atributos (aspas podem conter '>') e '/' se for vazia
+_TAG_ABERTURA = re.compile(rb"<([\w.:-]+)((?:[^>\"']|\"[^\"]*\"|'[^']*')*?)(/?)>")
+_MESTRE = re.compile(rb"<style:master-page\b[^>]*?\sstyle:name=\"([^\"]*)\"")
+# Prefixos usados no estilo e no marcador acrescentados; declarados na raiz se o modelo não os declarar
+_NAMESPACES = {
+    b"style": b"urn:oasis:names:tc:opendocument:xmlns:style:1.0",
+    b"fo": b"urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0",
+    b"text": b"urn:oasis:names:tc:opendocument:xmlns:text:1.0",
+}
+
+
+def nome_marcador(indice):
+    return f"{PREFIXO_MARCADOR}{indice:05d}"
+
+
+def _atributo(atributos, nome, valor):
+    """Atributos (bytes) com nome=valor, substituindo o valor se o atributo já existir"""
+    novo = b' %s="%s"' % (nome, escape(valor, {'"': "&quot;"}).encode("utf-8"))
+    padrao = re.compile(rb"\s" + re.escape(nome) + rb"\s*=\s*(\"[^\"]*\"|'[^']*')")
+    if padrao.search(atributos):
+        return padrao.sub(lambda _: novo, atributos, count=1)
+    return atributos + novo
+
+
+class _Estrutura:
+    """Posições (em bytes) do 'content.xml' de que a mala direta precisa, em uma única leitura"""
+
+    def __init__(self, conteudo):
+        self.conteudo = conteudo
+        self.recusados = set()
+        self.primeiro = None # (posição, nome, atributos) do primeiro elemento de conteúdo do corpo
+        self.fim_corpo = None # Posição de </office:text>
+        self.estilos_automaticos = None # (posição da abertura, posição do fechamento ou None se vazio)
+        self.inicio_raiz = None
+        self.inicio_body = None
+        self.estilos_paragrafo = {} # nome do estilo automático de parágrafo -> (início, fim, atributos)
+        self._pilha = []
+        self._profundidade_texto = None
+        self._estilo_aberto = None
+
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = self._abrir
+        parser.EndElementHandler = self._fechar
+        self._parser = parser
+        parser.Parse(conteudo, True)
+
+    def _abrir(self, nome, atributos):
+        posicao = self._parser.CurrentByteIndex
+        self._pilha.append(nome)
+        profundidade = len(self._pilha)
+        if profundidade == 1:
+            self.inicio_raiz = posicao
+        elif nome == "office:automatic-styles" and profundidade == 2:
+            self.estilos_automaticos = (posicao, None)
+        elif nome == "office:body" and profundidade == 2:
+            self.inicio_body = posicao
+        elif nome == "office:text" and self.fim_corpo is None and self._profundidade_texto is None:
+            self._profundidade_texto = profundidade
+        elif (nome == "style:style" and profundidade == 3 and self._pilha[1] == "office:automatic-styles"
+              and atributos.get("style:family") == "paragraph"):
+            self._estilo_aberto = (atributos.get("style:name"), posicao, atributos)
+        elif self._profundidade_texto is not None:
+            if profundidade == self._profundidade_texto + 1 and self.primeiro is None and nome not in _DECLARACOES:
+                self.primeiro = (posicao, nome, atributos)
+            if nome in _ELEMENTOS_RECUSADOS:
+                self.recusados.add(_ELEMENTOS_RECUSADOS[nome])
+            if atributos.get("text:anchor-type") == "page":
+                self.recusados.add("quadros ancorados na página")
+            if "text:continue-list" in atributos or atributos.get("text:continue-numbering") == "true":
+                self.recusados.add("listas que continuam a numeração de outras")
+
+    def _fechar(self, nome):
+        posicao = self._parser.CurrentByteIndex
+        profundidade = len(self._pilha)
+        self._pilha.pop()
+        if nome == "office:text" and profundidade == self._profundidade_texto:
+            self.fim_corpo = posicao
+            self._profundidade_texto = None
+        elif nome == "office:automatic-styles" and profundidade == 2:
+            inicio, _ = self.estilos_automaticos
+            self.estilos_automaticos = (inicio, None if self._vazio(inicio) else posicao)
+        elif nome == "style:style" and self._estilo_aberto is not None and profundidade == 3:
+            nome_estilo, inicio, atributos = self._estilo_aberto
+            fim = _TAG_ABERTURA.match(self.conteudo, inicio).end() if self._vazio(inicio) \
+                else self.conteudo.index(b">", posicao) + 1
+            self.estilos_paragrafo[nome_estilo] = (inicio, fim, atributos)
+            self._estilo_aberto = None
+
+    def _vazio(self, inicio):
+        return _TAG_ABERTURA.match(self.conteudo, inicio).group(3) == b"/"
+
+
+def _recusados_nas_paginas(estilos):
+    """Motivos de recusa nos cabeçalhos/rodapés das páginas-mestre ('styles.xml'), onde costuma ficar o 'Página X de Y'"""
+    recusados = set()
+    dentro = []
+
+    def _abrir(nome, atributos):
+        if nome == "office:master-styles":
+            dentro.append(nome)
+        elif dentro and nome in _ELEMENTOS_RECUSADOS:
+            recusados.add(_ELEMENTOS_RECUSADOS[nome])
+
+    def _fechar(nome):
+        if nome == "office:master-styles":
+            dentro.pop()
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = _abrir
+    parser.EndElementHandler = _fechar
+    parser.Parse(estilos, True)
+    return recusados
+
+
+class ModeloMalaDireta:
+    """Modelo preparado para a mala direta (ou os motivos para não usá-la)"""
+
+    def __init__(self, modelo_bytes):
+        self.motivos = [] # Vazio: modelo compatível
+        self._prefixo = self._sufixo = None
+        if not PYPDF_DISPONIVEL:
+            self.motivos.append("O pacote 'pypdf' não está instalado.")
+            return
+        try:
+            conteudo = pacote_odt.ler_membro(modelo_bytes, "content.xml")
+            try:
+                estilos = pacote_odt.ler_membro(modelo_bytes, "styles.xml")
+            except KeyError:
+                estilos = b""
+            estrutura = _Estrutura(conteudo)
+            recusados = estrutura.recusados | (_recusados_nas_paginas(estilos) if estilos else set())
+        except Exception as e:
+            self.motivos.append(f"Não foi possível ler o modelo: {e}")
+            return
+        if estrutura.fim_corpo is None or estrutura.inicio_body is None:
+            self.motivos.append("O modelo não é um documento de texto.")
+            return
+        if recusados:
+            self.motivos.append(f"O modelo usa {', '.join(sorted(recusados))}.")
+        if estrutura.primeiro is None or estrutura.primeiro[1] not in ("text:p", "text:h"):
+            self.motivos.append("O modelo não começa por um parágrafo (ex.: começa por uma tabela ou lista).")
+        if self.motivos:
+            return
+        self._preparar(estrutura, estilos)
+
+    @property
+    def compativel(self):
+        return not self.motivos
+
+    def _preparar(self, estrutura, estilos):
+        conteudo = estrutura.conteudo
+        inicio_primeiro, nome_primeiro, atributos_primeiro = estrutura.primeiro
+        abertura = _TAG_ABERTURA.match(conteudo, inicio_primeiro)
+
+        # Estilo do primeiro parágrafo a partir da segunda seção: o mesmo, com quebra de página
+        # para o estilo de página do modelo e numeração reiniciada
+        estilo_original = atributos_primeiro.get("text:style-name")
+        nomes_usados = set(estrutura.estilos_paragrafo)
+        nome_quebra = _NOME_ESTILO_QUEBRA
+        sufixo_nome = 2
+        while nome_quebra in nomes_usados:
+            nome_quebra = f"{_NOME_ESTILO_QUEBRA}{sufixo_nome}"
+            sufixo_nome += 1
+        automatico = estrutura.estilos_paragrafo.get(estilo_original)
+        mestre = (automatico[2].get("style:master-page-name") if automatico else None) or self._mestre(estilos, estilo_original)
+        if automatico:
+            inicio, fim, _ = automatico
+            estilo = conteudo[inicio:fim]
+            tag = _TAG_ABERTURA.match(estilo)
+            atributos = _atributo(tag.group(2), b"style:name", nome_quebra)
+            if mestre:
+                atributos = _atributo(atributos, b"style:master-page-name", mestre)
+            estilo = b"<%s%s%s>%s" % (tag.group(1), atributos, tag.group(3), estilo[tag.end():])
+            if tag.group(3):
+                estilo = estilo[:-2] + b"></style:style>"
+        else:
+            atributos = _atributo(b' style:family="paragraph"', b"style:name", nome_quebra)
+            if estilo_original:
+                atributos = _atributo(atributos, b"style:parent-style-name", estilo_original)
+            if mestre:
+                atributos = _atributo(atributos, b"style:master-page-name", mestre)
+            estilo = b"<style:style%s></style:style>" % atributos
+        estilo = self._com_quebra(estilo, mestre)
+
+        inicio_estilos, fim_estilos = estrutura.estilos_automaticos or (None, None)
+        if inicio_estilos is None:
+            posicao = estrutura.inicio_body
+            prefixo_combinado = conteudo[:posicao] + b"<office:automatic-styles>" + estilo + \
+                b"</office:automatic-styles>" + conteudo[posicao:inicio_primeiro]
+        elif fim_estilos is None:
+            tag = _TAG_ABERTURA.match(conteudo, inicio_estilos)
+            prefixo_combinado = conteudo[:inicio_estilos] + b"<%s%s>" % (tag.group(1), tag.group(2)) + estilo + \
+                b"</office:automatic-styles>" + conteudo[tag.end():inicio_primeiro]
+        else:
+            prefixo_combinado = conteudo[:fim_estilos] + estilo + conteudo[fim_estilos:inicio_primeiro]
+        raiz = _TAG_ABERTURA.match(prefixo_combinado, estrutura.inicio_raiz)
+        declaracoes = b"".join(b' xmlns:%s="%s"' % (prefixo, uri) for prefixo, uri in _NAMESPACES.items()
+                               if not re.search(rb"\sxmlns:%s\s*=" % prefixo, raiz.group(2)))
+        prefixo_combinado = prefixo_combinado[:raiz.end() - 1] + declaracoes + prefixo_combinado[raiz.end() - 1:]
+
+        vazio = abertura.group(3) == b"/"
+        atributos_quebra = _atributo(abertura.group(2), b"text:style-name", nome_quebra)
+        self._prefixo = conteudo[:abertura.end()].decode("utf-8")
+        self._sufixo = conteudo[estrutura.fim_corpo:].decode("utf-8")
+        self._prefixo_combinado = prefixo_combinado.decode("utf-8")
+        self._aberturas = tuple(
+            (b"<%s%s>" % (abertura.group(1), atributos)).decode("utf-8")
+            for atributos in (abertura.group(2), atributos_quebra)
+        )
+        self._fechamento = f"</{nome_primeiro}>" if vazio else ""
+
+    @staticmethod
+    def _mestre(estilos, estilo_original):
+        """Estilo de página da primeira página: o do estilo comum do parágrafo, senão o padrão"""
+        if estilo_original:
+            nome = escape(estilo_original, {'"': "&quot;"}).encode("utf-8")
+            definicao = re.search(rb"<style:style\b[^>]*?\sstyle:name=\"" + re.escape(nome) + rb"\"[^>]*>", estilos)
+            if definicao:
+                mestre = re.search(rb"\sstyle:master-page-name=\"([^\"]+)\"", definicao.group(0))
+                if mestre:
+                    return mestre.group(1).decode("utf-8")
+        mestres = [m.decode("utf-8") for m in _MESTRE.findall(estilos)]
+        if "Standard" in mestres:
+            return "Standard"
+        return mestres[0] if mestres else None
+
+    @staticmethod
+    def _com_quebra(estilo, mestre):
+        """Acrescenta às propriedades de parágrafo a quebra (numeração reiniciada, com estilo de página)"""
+        propriedade = (b"style:page-number", "1") if mestre else (b"fo:break-before", "page")
+        tag = re.search(rb"<style:paragraph-properties\b", estilo)
+        if tag is None:
+            fim_abertura = _TAG_ABERTURA.match(estilo).end()
+            return estilo[:fim_abertura] + b"<style:paragraph-properties%s/>" % _atributo(b"", *propriedade) + \
+                estilo[fim_abertura:]
+        propriedades = _TAG_ABERTURA.match(estilo, tag.start())
+        return estilo[:tag.start()] + b"<%s%s%s>" % (
+            propriedades.group(1), _atributo(propriedades.group(2), *propriedade), propriedades.group(3),
+        ) + estilo[propriedades.end():]
+
+    def combinar(self, conteudos_xml):
+        """'content.xml' único com uma seção por proposta, na ordem; conteudos_xml são os de cada linha"""
+        partes = [self._prefixo_combinado]
+        for indice, conteudo_xml in enumerate(conteudos_xml):
+            if not (conteudo_xml.startswith(self._prefixo) and conteudo_xml.endswith(self._sufixo)):
+                raise ValueError("O conteúdo de uma proposta não corresponde ao modelo.")
+            partes.append(self._aberturas[indice > 0])
+            partes.append(f'<text:bookmark text:name="{nome_marcador(indice)}"/>')
+            partes.append(self._fechamento)
+            partes.append(conteudo_xml[len(self._prefixo):len(conteudo_xml) - len(self._sufixo)])
+        partes.append(self._sufixo)
+        return "".join(partes)
+
+
+@metricas.cronometrado("dividir_pdf_mala_direta")
+def dividir_pdf(pdf_bytes, quantidade):
+    """PDFs de cada proposta, pelos destinos nomeados dos marcadores; ValueError se faltarem"""
+    leitor = PdfReader(io.BytesIO(pdf_bytes))
+    # No dicionário /Dests do catálogo os nomes vêm com a barra do nome PDF
+    destinos = {str(nome).lstrip("/"): destino for nome, destino in leitor.named_destinations.items()}
+    inicios = []
+    for indice in range(quantidade):
+        destino = destinos.get(nome_marcador(indice))
+        if destino is None:
+            raise ValueError("O PDF combinado não tem os destinos das propostas "
+                             "(o LibreOffice não exportou os marcadores).")
+        inicios.append(leitor.get_destination_page_number(destino))
+    total_paginas = len(leitor.pages)
+    if inicios[0] != 0 or any(b <= a for a, b in zip(inicios, inicios[1:])) or inicios[-1] >= total_paginas:
+        raise ValueError("As páginas iniciais das propostas no PDF combinado são inconsistentes.")
+
+    pdfs = []
+    for inicio, fim in zip(inicios, inicios[1:] + [total_paginas]):
+        escritor = PdfWriter()
+        for pagina in leitor.pages[inicio:fim]:
+            escritor.add_page(pagina)
+        saida = io.BytesIO()
+        escritor.write(saida)
+        pdfs.append(saida.getvalue())
+    return pdfs
+
+
+def juntar_pdfs(caminhos_pdf, caminho_saida):
+    """Grava em caminho_saida os PDFs de caminhos_pdf, na ordem (ex.: para imprimir o lote)"""
+    escritor = PdfWriter()
+    for caminho in caminhos_pdf:
+        escritor.append(caminho, import_outline=False)
+    with open(caminho_saida, "wb") as f:
+        escritor.write(f)
+
+
+MAX_MODELOS_EM_CACHE = 32
+
+_modelos = OrderedDict()
+_modelos_lock = threading.Lock()
+
+
+def preparar(modelo_bytes):
+    """Verifica a compatibilidade e prepara a montagem do modelo, apenas na primeira vez"""
+    chave = modelo_compilado.hash_modelo(modelo_bytes)
+    with _modelos_lock:
+        modelo = _modelos.get(chave)
+        if modelo is not None:
+            _modelos.move_to_end(chave)
+            return modelo
+
+    modelo = ModeloMalaDireta(modelo_bytes)
+
+    with _modelos_lock:
+        _modelos[chave] = modelo
+        while len(_modelos) > MAX_MODELOS_EM_CACHE:
+            _modelos.popitem(last=False)
+    return modelo
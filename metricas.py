@@ -0,0 +1,136 @@
+"""Medição de latência por etapa do pipeline de geração de propostas.
+
+Cada etapa (leitura da planilha, extração do modelo, substituições,
+recriação do ODT, conversão para PDF) registra sua duração em um histograma
+do processo. Os histogramas podem ser exportados no formato texto do
+Prometheus ou como JSON (servidor_http expõe os dois; o app mostra um
+painel de depuração com ?debug=1).
+"""
+import time
+import threading
+from functools import wraps
+from contextlib import contextmanager
+
+# Limites dos buckets, em segundos (de operações em memória até conversões longas)
+LIMITES_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class Histograma:
+    def __init__(self, limites=LIMITES_BUCKETS):
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1) # Último bucket: +Inf
+        self.soma = 0.0
+        self.total = 0
+        self.erros = 0
+        self._lock = threading.Lock()
+
+    def registrar(self, duracao, erro=False):
+        indice = len(self.limites)
+        for i, limite in enumerate(self.limites):
+            if duracao <= limite:
+                indice = i
+                break
+        with self._lock:
+            self.contagens[indice] += 1
+            self.soma += duracao
+            self.total += 1
+            if erro:
+                self.erros += 1
+
+    def percentil(self, fracao):
+        """Estimativa do percentil pelo limite superior do bucket (como no Prometheus)"""
+        with self._lock:
+            if not self.total:
+                return 0.0
+            alvo = fracao * self.total
+            acumulado = 0
+            for i, contagem in enumerate(self.contagens):
+                acumulado += contagem
+                if acumulado >= alvo:
+                    return self.limites[i] if i < len(self.limites) else float("inf")
+        return float("inf")
+
+    def resumo(self):
+        with self._lock:
+            total, soma, erros, contagens = self.total, self.soma, self.erros, list(self.contagens)
+        return {
+            "contagem": total,
+            "erros": erros,
+            "soma_segundos": soma,
+            "media_segundos": soma / total if total else 0.0,
+            "p50_segundos": self.percentil(0.5),
+            "p95_segundos": self.percentil(0.95),
+            "buckets": {str(limite): contagem for limite, contagem in zip(self.limites + ("+Inf",), contagens)},
+        }
+
+
+_histogramas = {}
+_registro_lock = threading.Lock()
+
+
+def histograma(etapa):
+    with _registro_lock:
+        if etapa not in _histogramas:
+            _histogramas[etapa] = Histograma()
+        return _histogramas[etapa]
+
+
+@contextmanager
+def medir(etapa):
+    """Mede a duração do bloco e registra no histograma da etapa"""
+    inicio = time.perf_counter()
+    erro = False
+    try:
+        yield
+    except BaseException:
+        erro = True
+        raise
+    finally:
+        histograma(etapa).registrar(time.perf_counter() - inicio, erro)
+
+
+def cronometrado(etapa):
+    """Decorador equivalente a envolver a função inteira em medir(etapa)"""
+    def decorador(funcao):
+        @wraps(funcao)
+        def envolvida(*args, **kwargs):
+            with medir(etapa):
+                return funcao(*args, **kwargs)
+        return envolvida
+    return decorador
+
+
+def exportar_json():
+    with _registro_lock:
+        etapas = dict(_histogramas)
+    return {etapa: h.resumo() for etapa, h in sorted(etapas.items())}
+
+
+def exportar_prometheus():
+    """Histogramas no formato de exposição em texto do Prometheus"""
+    with _registro_lock:
+        etapas = dict(_histogramas)
+    linhas = [
+        "# HELP propostas_etapa_duracao_segundos Duração das etapas do pipeline de geração de propostas.",
+        "# TYPE propostas_etapa_duracao_segundos histogram",
+    ]
+    erros = [
+        "# HELP propostas_etapa_erros_total Execuções de etapa que terminaram com exceção.",
+        "# TYPE propostas_etapa_erros_total counter",
+    ]
+    for etapa, h in sorted(etapas.items()):
+        with h._lock:
+            contagens, soma, total, qtd_erros = list(h.contagens), h.soma, h.total, h.erros
+        acumulado = 0
+        for limite, contagem in zip(h.limites + ("+Inf",), contagens):
+            acumulado += contagem
+            linhas.append(f'propostas_etapa_duracao_segundos_bucket{{etapa="{etapa}",le="{limite}"}} {acumulado}')
+        linhas.append(f'propostas_etapa_duracao_segundos_sum{{etapa="{etapa}"}} {soma}')
+        linhas.append(f'propostas_etapa_duracao_segundos_count{{etapa="{etapa}"}} {total}')
+        erros.append(f'propostas_etapa_erros_total{{etapa="{etapa}"}} {qtd_erros}')
+    return "\n".join(linhas + erros) + "\n"
+
+
+def limpar():
+    with _registro_lock:
+        _histogramas.clear()
@@ -0,0 +1,282 @@
+"""Compilação de modelos ODT em planos de renderização reutilizáveis.
+
+O 'content.xml' do modelo é analisado uma única vez e dividido em trechos
+literais intercalados com campos (tags text:database-display e placeholders
+<Coluna> em texto simples). Renderizar uma linha passa a ser um único join,
+em vez de uma varredura do XML por placeholder. Os planos ficam em cache,
+indexados pelo hash do conteúdo do modelo.
+
+analisar_modelo valida o modelo no upload (antes de qualquer conversão) e
+aponta o que não será substituído: placeholders partidos entre trechos de
+formatação, campos de colunas fora do mapeamento e colunas ausentes na
+planilha. A análise compila o plano, que fica no cache para a renderização.
+"""
+import re
+import html
+import hashlib
+import threading
+import xml.etree.ElementTree as ET
+from collections import Counter, OrderedDict
+from functools import lru_cache
+
+import metricas
+import pacote_odt
+
+# Mapeamento dos nomes das colunas para os placeholders
+MAPEAMENTO_COLUNAS = {
+    "Cliente": "<Cliente>", "Cidade": "<Cidade>", "Estado": "<Estado>",
+    "Número": "<Número>", "Nome": "<Nome>", "Telefone": "<Telefone>",
+    "Email": "<Email>", "Modelo": "<Modelo>", "TIPO DE MÁQUINA": "<TIPO DE MÁQUINA>",
+    "MODELO DE MÁQUINA": "<MODELO DE MÁQUINA>", "Valor Rompedor": "<Valor Rompedor>",
+    "Valor Kit": "<Valor Kit>", "Condição de pagamento": "<Condição de pagamento>",
+    "FRETE": "<FRETE>", "Data": "<Data>"
+}
+
+# Tag que substitui o campo database-display, preservando a estrutura original
+TAG_DATABASE_DISPLAY = (
+    '<text:database-display text:column-name="{coluna}" text:table-name="Planilha1" '
+    'text:table-type="table" text:database-name="Formulário propostas Rompedor1">'
+)
+FIM_DATABASE_DISPLAY = '</text:database-display>'
+
+_PLACEHOLDERS_MAPEADOS = frozenset(MAPEAMENTO_COLUNAS.values())
+
+MAX_PLANOS_EM_CACHE = 32
+
+
+def _montar_padrao(mapeamento, extras=()):
+    """Regex única que reconhece os campos database-display e os placeholders simples.
+
+    Todas as alternativas comuns começam por '<', então o prefixo é fatorado:
+    o mecanismo de regex só tenta casar nas posições com '<', o que torna a
+    varredura única bem mais rápida que uma alternância simples.
+    """
+    colunas = "|".join(re.escape(coluna) for coluna in mapeamento)
+    todos = set(mapeamento.values()) | set(extras)
+    entre_sinais = [p[1:-1] for p in todos if len(p) > 2 and p[0] == "<" and p[-1] == ">"]
+    outros = [p for p in todos if not (len(p) > 2 and p[0] == "<" and p[-1] == ">")]
+    # Alternativas mais longas primeiro, para que um placeholder nunca "roube" o prefixo de outro
+    nomes = "|".join(re.escape(n) for n in sorted(entre_sinais, key=len, reverse=True))
+    padrao = (
+        f'<(?:text:database-display[^>]*text:column-name="(?P<coluna>{colunas})"[^>]*>[^<]*</text:database-display>'
+        f'|(?P<nome>{nomes})>)'
+    )
+    if outros:
+        padrao += "|(?P<outro>" + "|".join(re.escape(p) for p in sorted(outros, key=len, reverse=True)) + ")"
+    return re.compile(padrao)
+
+
+def _placeholder_do_campo(m):
+    """Placeholder correspondente a um casamento de PADRAO_CAMPOS"""
+    if m.group("coluna") is not None:
+        return MAPEAMENTO_COLUNAS[m.group("coluna")]
+    if m.group("nome") is not None:
+        return f"<{m.group('nome')}>"
+    return m.group("outro")
+
+
+PADRAO_CAMPOS = _montar_padrao(MAPEAMENTO_COLUNAS)
+
+
+@lru_cache(maxsize=64)
+def _padrao_com_extras(extras):
+    return _montar_padrao(MAPEAMENTO_COLUNAS, extras)
+
+
+def substituir_em_passada_unica(content_xml, substituicoes):
+    """Substitui todos os campos do XML em uma única varredura.
+
+    Os valores inseridos não são varridos novamente, então um valor que contenha
+    um placeholder não é reescrito por uma substituição posterior.
+    Retorna (xml_modificado, numero_de_substituicoes).
+    """
+    extras = tuple(sorted(p for p in substituicoes if p not in _PLACEHOLDERS_MAPEADOS))
+    padrao = _padrao_com_extras(extras) if extras else PADRAO_CAMPOS
+    substituicoes_feitas = 0
+
+    def _substituir(m):
+        nonlocal substituicoes_feitas
+        coluna = m.group("coluna")
+        placeholder = _placeholder_do_campo(m)
+        if placeholder not in substituicoes:
+            return m.group(0)
+        substituicoes_feitas += 1
+        if coluna is not None:
+            return f"{TAG_DATABASE_DISPLAY.format(coluna=coluna)}{substituicoes[placeholder]}{FIM_DATABASE_DISPLAY}"
+        return str(substituicoes[placeholder])
+
+    return padrao.sub(_substituir, content_xml), substituicoes_feitas
+
+
+class PlanoRenderizacao:
+    """Modelo pré-tokenizado: literais[i] + campo[i] + literais[i+1] + ..."""
+
+    __slots__ = ("literais", "campos")
+
+    def __init__(self, literais, campos):
+        self.literais = literais
+        # Cada campo: (placeholder, texto_original, prefixo, sufixo)
+        self.campos = campos
+
+    @metricas.cronometrado("substituir_no_xml")
+    def renderizar(self, substituicoes):
+        """Retorna (xml_renderizado, numero_de_substituicoes)"""
+        partes = [self.literais[0]]
+        substituicoes_feitas = 0
+        for (placeholder, original, prefixo, sufixo), literal in zip(self.campos, self.literais[1:]):
+            if placeholder in substituicoes:
+                partes.append(f"{prefixo}{substituicoes[placeholder]}{sufixo}")
+                substituicoes_feitas += 1
+            else:
+                partes.append(original)
+            partes.append(literal)
+        return "".join(partes), substituicoes_feitas
+
+
+def compilar_conteudo(content_xml, mapeamento=MAPEAMENTO_COLUNAS):
+    """Divide o 'content.xml' em literais e campos, uma única varredura"""
+    padrao = PADRAO_CAMPOS if mapeamento is MAPEAMENTO_COLUNAS else _montar_padrao(mapeamento)
+    literais = []
+    campos = []
+    posicao = 0
+    for m in padrao.finditer(content_xml):
+        literais.append(content_xml[posicao:m.start()])
+        coluna = m.group("coluna")
+        if coluna is not None:
+            campos.append((mapeamento[coluna], m.group(0),
+                           TAG_DATABASE_DISPLAY.format(coluna=coluna), FIM_DATABASE_DISPLAY))
+        else:
+            campos.append((f"<{m.group('nome')}>", m.group(0), "", ""))
+        posicao = m.end()
+    literais.append(content_xml[posicao:])
+    return PlanoRenderizacao(literais, campos)
+
+
+def hash_modelo(modelo_bytes):
+    return hashlib.sha256(modelo_bytes).hexdigest()
+
+
+_planos = OrderedDict()
+_planos_lock = threading.Lock()
+
+
+def obter_plano(modelo_bytes, content_xml=None):
+    """Retorna o plano compilado do modelo, compilando apenas na primeira vez
+
+    content_xml, se já extraído (ex.: guardado pelo registro_modelos), evita descompactar o modelo.
+    """
+    chave = hash_modelo(modelo_bytes)
+    with _planos_lock:
+        plano = _planos.get(chave)
+        if plano is not None:
+            _planos.move_to_end(chave)
+            return plano
+
+    if content_xml is None:
+        with metricas.medir("extrair_conteudo_odt"):
+            content_xml = pacote_odt.ler_membro(modelo_bytes, 'content.xml').decode('utf-8')
+    with metricas.medir("compilar_modelo"):
+        plano = compilar_conteudo(content_xml)
+
+    with _planos_lock:
+        _planos[chave] = plano
+        while len(_planos) > MAX_PLANOS_EM_CACHE:
+            _planos.popitem(last=False)
+    return plano
+
+
+_PADRAO_DATABASE_DISPLAY = re.compile(
+    r'<text:database-display[^>]*text:column-name="([^"]*)"[^>]*>[^<]*</text:database-display>')
+_PADRAO_FIM_PARAGRAFO = re.compile(r"</text:(?:p|h)>|<text:line-break/>")
+_PADRAO_TAG = re.compile(r"<[^>]*>")
+_PADRAO_PLACEHOLDER_VISIVEL = re.compile(r"<([^<>\s](?:[^<>\n]{0,78}[^<>\s])?)>") # "1 < 2 e 3 > 1" não conta
+
+_COLUNA_DO_PLACEHOLDER = {placeholder: coluna for coluna, placeholder in MAPEAMENTO_COLUNAS.items()}
+_VALOR_COLUNA_AUSENTE = {"Valor Rompedor": "R$ 0,00", "Valor Kit": "R$ 0,00", "Data": "a data de hoje"}
+
+
+class AnaliseModelo:
+    """Campos encontrados no modelo e tudo que ficaria sem substituição"""
+
+    def __init__(self, hash_modelo, erro=None, plano=None):
+        self.hash = hash_modelo
+        self.erro = erro # Modelo inutilizável (não é ODT, XML inválido...)
+        self.plano = plano
+        self.campos = Counter() # placeholder -> ocorrências reconhecidas
+        self.fragmentados = Counter() # placeholders visíveis partidos entre trechos (text:span)
+        self.texto_simples = Counter() # placeholders visíveis fora de um campo reconhecido
+        self.campos_nao_mapeados = Counter() # colunas de campos database-display fora do mapeamento
+        if plano is None:
+            return
+        self.campos.update(placeholder for placeholder, *_ in plano.campos)
+        for literal in plano.literais:
+            self.campos_nao_mapeados.update(_PADRAO_DATABASE_DISPLAY.findall(literal))
+            literal = _PADRAO_DATABASE_DISPLAY.sub("\n", literal)
+            texto_visivel = html.unescape(_PADRAO_TAG.sub("", _PADRAO_FIM_PARAGRAFO.sub("\n", literal)))
+            for nome in _PADRAO_PLACEHOLDER_VISIVEL.findall(texto_visivel):
+                contiguo = f"&lt;{html.escape(nome, quote=False)}&gt;" in literal
+                (self.texto_simples if contiguo else self.fragmentados)[f"<{nome}>"] += 1
+
+    def avisos(self, colunas_planilha=None):
+        """Mensagens sobre o que não será preenchido (considerando as colunas da planilha, se informadas)"""
+        if self.erro:
+            return [self.erro]
+        avisos = []
+        if not self.campos:
+            avisos.append("Nenhum campo reconhecido: o PDF sairá igual ao modelo.")
+        for placeholder in sorted(self.fragmentados):
+            avisos.append(f"'{placeholder}' está partido em trechos com formatações diferentes e não será "
+                          "substituído. Apague e digite o placeholder de novo, de uma só vez.")
+        for placeholder in sorted(self.texto_simples):
+            if placeholder in _COLUNA_DO_PLACEHOLDER:
+                avisos.append(f"'{placeholder}' está como texto comum, fora de um campo de banco de dados, "
+                              "e não será substituído.")
+            elif colunas_planilha is not None and placeholder[1:-1] in colunas_planilha:
+                avisos.append(f"'{placeholder}' corresponde a uma coluna da planilha que não está no mapeamento "
+                              "de placeholders e não será substituído.")
+            else:
+                avisos.append(f"'{placeholder}' não corresponde a nenhuma coluna conhecida e não será substituído.")
+        for coluna in sorted(self.campos_nao_mapeados):
+            avisos.append(f"O campo de banco de dados da coluna '{coluna}' não está no mapeamento e não será substituído.")
+        if colunas_planilha is not None:
+            for placeholder in self.campos:
+                coluna = _COLUNA_DO_PLACEHOLDER.get(placeholder)
+                if coluna is not None and coluna not in colunas_planilha:
+                    valor = _VALOR_COLUNA_AUSENTE.get(coluna)
+                    consequencia = f"será preenchido com {valor}" if valor else "ficará vazio"
+                    avisos.append(f"'{placeholder}' usa a coluna '{coluna}', que não existe na planilha ({consequencia}).")
+        return avisos
+
+
+MAX_ANALISES_EM_CACHE = 32
+
+_analises = OrderedDict()
+_analises_lock = threading.Lock()
+
+
+def analisar_modelo(modelo_bytes, content_bytes=None):
+    """Valida o modelo e indexa seus campos; o plano compilado fica no cache para a renderização"""
+    chave = hash_modelo(modelo_bytes)
+    with _analises_lock:
+        analise = _analises.get(chave)
+        if analise is not None:
+            _analises.move_to_end(chave)
+            return analise
+
+    try:
+        if content_bytes is None:
+            content_bytes = pacote_odt.ler_membro(modelo_bytes, 'content.xml')
+        ET.fromstring(content_bytes) # XML malformado só falharia dentro do LibreOffice
+        analise = AnaliseModelo(chave, plano=obter_plano(modelo_bytes, content_bytes.decode('utf-8')))
+    except KeyError:
+        analise = AnaliseModelo(chave, erro="O arquivo não contém 'content.xml' (não é um documento ODT).")
+    except ET.ParseError as e:
+        analise = AnaliseModelo(chave, erro=f"O 'content.xml' do modelo não é um XML válido: {e}")
+    except Exception as e:
+        analise = AnaliseModelo(chave, erro=f"Não foi possível ler o modelo ODT: {e}")
+
+    with _analises_lock:
+        _analises[chave] = analise
+        while len(_analises) > MAX_ANALISES_EM_CACHE:
+            _analises.popitem(last=False)
+    return analise
@@ -0,0 +1,750 @@
+"""Núcleo da geração de propostas, sem dependência do Streamlit.
+
+Reúne as etapas do pipeline (substituições, recriação do ODT, conversão
+para PDF e geração em lote) para uso pela interface (app.py), pela linha
+de comando (gerar_propostas.py) e por outros scripts. Falhas são
+informadas por exceções; cabe a quem chama decidir como exibi-las.
+"""
+import io
+import os
+import re
+import shutil
+import logging
+import tempfile
+import zipfile
+import subprocess
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from pathlib import Path
+
+import arquivo_lote
+import cache_pdf
+import metricas
+import modelo_compilado
+import pacote_odt
+import pool_libreoffice
+
+# pandas, renderizador_direto (reportlab), esqueleto_pdf (pdfminer, pypdf) e
+# mala_direta (pypdf) são importados nas funções que os usam: o app abre sem carregá-los
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_BLOCO_PREPARACAO = 512 # Linhas preparadas de uma vez em gerar_lote
+TAMANHO_MAX_NOME_ARQUIVO = 150 # Caracteres do nome base do PDF (sem a extensão)
+# Máximo de propostas por conversão no motor "mala_direta"
+TAMANHO_GRUPO_MALA_DIRETA = int(os.environ.get("PROPOSTAS_MALA_DIRETA_GRUPO", "50"))
+
+# Motor de PDF: "libreoffice" sempre converte pelo LibreOffice; "direto" usa o
+# renderizador_direto e "esqueleto" carimba os campos sobre o esqueleto_pdf do
+# modelo. "mala_direta" também usa o LibreOffice, mas no lote converte um
+# documento por grupo de linhas e o divide por página (ver mala_direta).
+# Modelos incompatíveis com o motor escolhido usam o LibreOffice.
+BACKEND_LIBREOFFICE = "libreoffice"
+BACKEND_DIRETO = "direto"
+BACKEND_ESQUELETO = "esqueleto"
+BACKEND_MALA_DIRETA = "mala_direta"
+BACKENDS_PDF = (BACKEND_LIBREOFFICE, BACKEND_DIRETO, BACKEND_ESQUELETO, BACKEND_MALA_DIRETA)
+BACKEND_PDF_PADRAO = os.environ.get("PROPOSTAS_BACKEND_PDF", BACKEND_LIBREOFFICE)
+
+
+@metricas.cronometrado("extrair_conteudo_odt")
+def extrair_conteudo_odt(arquivo_bytes):
+    """Extrai o conteúdo de um arquivo ODT"""
+    try:
+        # Lido direto da memória, sem arquivo temporário
+        return pacote_odt.ler_membro(arquivo_bytes, 'content.xml').decode('utf-8')
+    except Exception as e:
+        raise ValueError(f"Erro ao extrair conteúdo do arquivo ODT: {str(e)}")
+
+@metricas.cronometrado("substituir_no_xml")
+def substituir_no_xml(content_xml, substituicoes):
+    """Substitui texto no conteúdo XML do arquivo ODT"""
+    # Uma única varredura reconhece tanto as tags database-display quanto os
+    # placeholders em texto simples (ver modelo_compilado.PADRAO_CAMPOS)
+    return modelo_compilado.substituir_em_passada_unica(content_xml, substituicoes)
+
+
+@metricas.cronometrado("criar_odt_modificado")
+def criar_odt_modificado(arquivo_original_bytes, content_xml_modificado):
+    """Cria um novo arquivo ODT com o conteúdo modificado"""
+    novo_content = content_xml_modificado.encode('utf-8') # Garantir encoding utf-8
+    try:
+        # Caminho rápido: só o content.xml é comprimido; os demais membros são copiados como estão
+        return pacote_odt.reempacotar_odt(arquivo_original_bytes, {'content.xml': novo_content})
+    except ValueError:
+        pass # ZIP64/criptografia: recria o arquivo inteiro com o zipfile, ainda em memória
+    except Exception as e:
+        raise ValueError(f"Erro ao criar arquivo ODT modificado: {str(e)}")
+
+    try:
+        saida = io.BytesIO()
+        with zipfile.ZipFile(io.BytesIO(arquivo_original_bytes), 'r') as zip_original:
+            with zipfile.ZipFile(saida, 'w', zipfile.ZIP_DEFLATED) as zip_modificado: # Usar compressão
+                for item in zip_original.infolist():
+                    if item.filename == 'content.xml':
+                        zip_modificado.writestr('content.xml', novo_content)
+                    else:
+                        zip_modificado.writestr(item, zip_original.read(item.filename))
+        return saida.getvalue()
+    except Exception as e:
+        raise ValueError(f"Erro ao criar arquivo ODT modificado: {str(e)}")
+
+@metricas.cronometrado("converter_para_pdf")
+def converter_odt_em_pdf(odt_bytes, timeout=120, destinos=False, cancelamento=None):
+    """Converte ODT para PDF usando LibreOffice, levantando exceção em caso de falha
+
+    Com destinos=True, os marcadores do documento são exportados como destinos
+    nomeados do PDF (ver mala_direta). Com um cancelamento.Cancelamento, a
+    conversão pode ser interrompida (o soffice é morto) e termina com
+    ConversaoCancelada.
+    """
+    if cancelamento is not None:
+        cancelamento.verificar()
+    # Caminho rápido: instâncias persistentes do LibreOffice (ponte UNO)
+    pool = pool_libreoffice.obter_pool()
+    if pool is not None:
+        try:
+            return pool.converter(odt_bytes, timeout=timeout, destinos=destinos, cancelamento=cancelamento)
+        except pool_libreoffice.PoolIndisponivel as e:
+            # Só quando o pool não sobe; falhas do documento não são repetidas pela linha de comando
+            logger.warning("Pool do LibreOffice indisponível (%s). Usando conversão direta.", e)
+
+    libreoffice_path = pool_libreoffice.localizar_libreoffice()
+
+    if not libreoffice_path:
+        raise FileNotFoundError("LibreOffice não encontrado. Verifique a instalação ou o caminho no código.")
+
+    temp_odt_path = None
+    temp_pdf_dir = None
+    temp_perfil_dir = None
+    pdf_path = None # Inicializa pdf_path
+
+    try:
+        with tempfile.NamedTemporaryFile(suffix='.odt', delete=False) as temp_odt:
+            temp_odt.write(odt_bytes)
+            temp_odt_path = temp_odt.name
+
+        temp_pdf_dir = tempfile.mkdtemp()
+        # Perfil de usuário isolado para não disputar o perfil padrão com outras conversões simultâneas
+        temp_perfil_dir = tempfile.mkdtemp(prefix="lo_perfil_")
+
+        filtro = 'pdf'
+        if destinos:
+            # Opções do filtro em JSON na linha de comando (LibreOffice 7.4+)
+            filtro = 'pdf:writer_pdf_Export:{"ExportBookmarksToPDFDestination":{"type":"boolean","value":"true"}}'
+
+        comando = [
+            libreoffice_path,
+            '--headless',
+            f'-env:UserInstallation={Path(temp_perfil_dir).as_uri()}',
+            '--convert-to', filtro,
+            '--outdir', temp_pdf_dir,
+            temp_odt_path
+        ]
+
+        # Usar Popen para melhor controle, especialmente no Windows
+        process = subprocess.Popen(comando, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=(os.name == 'nt'),
+                                   start_new_session=pool_libreoffice.NOVA_SESSAO)
+
+        def _matar():
+            pool_libreoffice.matar_processo(process)
+
+        if cancelamento is not None:
+            cancelamento.registrar(_matar)
+        try:
+            stdout, stderr = process.communicate(timeout=timeout) # Timeout aumentado
+        except subprocess.TimeoutExpired:
+            _matar()
+            process.communicate()
+            raise TimeoutError("A conversão para PDF excedeu o tempo limite.")
+        finally:
+            if cancelamento is not None:
+                cancelamento.remover(_matar)
+        if cancelamento is not None:
+            cancelamento.verificar() # Morto pelo cancelamento: o código de saída não é um erro do LibreOffice
+
+        if process.returncode != 0:
+            error_message = stderr.decode('utf-8', errors='ignore')
+            # Tentar extrair mensagem mais útil do erro do LibreOffice
+            if "Error: source file could not be loaded" in error_message:
+                 raise RuntimeError("Erro do LibreOffice: O arquivo ODT de origem não pôde ser carregado (pode estar corrompido ou ter permissões incorretas).")
+            elif "error while loading shared libraries" in error_message:
+                 raise RuntimeError(f"Erro do LibreOffice: Falta de bibliotecas compartilhadas. Detalhes: {error_message}")
+            else:
+                 raise RuntimeError(f"Erro na conversão (código {process.returncode}): {error_message}. Comando executado: {' '.join(comando)}")
+
+
+        # O nome do arquivo PDF gerado pelo LibreOffice será o mesmo do ODT, mas com extensão .pdf
+        pdf_filename = os.path.basename(temp_odt_path).replace('.odt', '.pdf')
+        pdf_path = os.path.join(temp_pdf_dir, pdf_filename)
+
+
+        if not os.path.exists(pdf_path):
+             # Adicionar verificação do stdout para pistas
+             output_message = stdout.decode('utf-8', errors='ignore')
+             raise RuntimeError(f"Arquivo PDF não foi gerado em '{temp_pdf_dir}'. Output: {output_message}")
+
+
+        with open(pdf_path, 'rb') as f:
+            pdf_bytes = f.read()
+
+        return pdf_bytes
+
+    finally:
+        # Limpeza final
+        if temp_odt_path and os.path.exists(temp_odt_path):
+            os.unlink(temp_odt_path)
+        if pdf_path and os.path.exists(pdf_path):
+             os.unlink(pdf_path)
+        if temp_pdf_dir:
+             # Pode falhar se o LibreOffice ainda tiver algum lock, mas tentamos
+             shutil.rmtree(temp_pdf_dir, ignore_errors=True)
+        if temp_perfil_dir:
+             shutil.rmtree(temp_perfil_dir, ignore_errors=True)
+
+
+def formatar_valor_monetario(valor):
+    """Formata um valor como moeda brasileira (R$)"""
+    try:
+        # Tenta converter para float, tratando vírgula como separador decimal se necessário
+        if isinstance(valor, str):
+            valor = valor.replace('.', '').replace(',', '.')
+        valor_float = float(valor)
+        # Formatação padrão brasileira
+        return f"R$ {valor_float:,.2f}".replace(',', 'v').replace('.', ',').replace('v', '.')
+    except (ValueError, TypeError):
+        return "R$ 0,00" # Retorna R$ 0,00 se a conversão falhar
+
+
+def formatar_data(valor, data_hoje):
+    """Formata a data da proposta como dd/mm/aaaa (vazia: data de hoje)"""
+    import pandas as pd
+    if pd.isna(valor) or valor == "":
+        return data_hoje
+    if isinstance(valor, datetime):
+        return valor.strftime("%d/%m/%Y")
+    # Tenta converter string para data, se falhar usa o valor como está ou data de hoje
+    try:
+        data_obj = pd.to_datetime(valor, errors='coerce')
+        if pd.isna(data_obj):
+            return str(valor) if valor else data_hoje
+        return data_obj.strftime("%d/%m/%Y")
+    except Exception:
+        return str(valor) if valor else data_hoje
+
+
+def criar_substituicoes(dados):
+    """Prepara dicionário de substituições a partir de uma linha (dict) do DataFrame"""
+    substituicoes = {}
+    data_hoje = datetime.today().strftime("%d/%m/%Y")
+
+    # Mapeamento dos placeholders para as colunas (considerando nomes exatos)
+    mapeamento_placeholders = {
+        "<Cliente>": "Cliente", "<Cidade>": "Cidade", "<Estado>": "Estado",
+        "<Número>": "Número", "<Nome>": "Nome", "<Telefone>": "Telefone",
+        "<Email>": "Email", "<Modelo>": "Modelo", "<TIPO DE MÁQUINA>": "TIPO DE MÁQUINA",
+        "<MODELO DE MÁQUINA>": "MODELO DE MÁQUINA", "<Valor Rompedor>": "Valor Rompedor",
+        "<Valor Kit>": "Valor Kit", "<Condição de pagamento>": "Condição de pagamento",
+        "<FRETE>": "FRETE", "<Data>": "Data"
+    }
+
+    for placeholder, coluna in mapeamento_placeholders.items():
+        valor = dados.get(coluna, "") # Pega o valor da coluna correspondente
+
+        # Tratamento especial para valores monetários
+        if coluna in ["Valor Rompedor", "Valor Kit"]:
+            valor_formatado = formatar_valor_monetario(valor)
+            substituicoes[placeholder] = valor_formatado
+        # Tratamento especial para Data
+        elif coluna == "Data":
+             substituicoes[placeholder] = formatar_data(valor, data_hoje)
+        # Para outros campos, apenas converte para string
+        else:
+            substituicoes[placeholder] = str(valor)
+
+    return substituicoes
+
+
+_TROCA_SEPARADORES = str.maketrans(",.", ".,")
+
+
+def _parte_do_lote(df, posicoes):
+    parte = df if posicoes is None else df.iloc[list(posicoes)]
+    if len(parte):
+        # Em um DataFrame só de números, df.iloc[p] converte a linha inteira para o
+        # tipo comum (ex.: inteiros viram float); a preparação por coluna faz o mesmo
+        tipo_linha = parte.iloc[0].dtype
+        if tipo_linha != object:
+            parte = parte.astype(tipo_linha)
+    return parte
+
+
+def _coluna_do_lote(parte, coluna):
+    import pandas as pd
+    serie = parte[coluna]
+    if isinstance(serie, pd.DataFrame):
+        serie = serie.iloc[:, -1] # Colunas duplicadas: to_dict() mantém a última
+    return serie
+
+
+def _valores_linha(serie):
+    """Valores da coluna como aparecem em df.iloc[p].fillna('').to_dict()"""
+    valores = serie.to_numpy(dtype=object, copy=True)
+    valores[serie.isna().to_numpy()] = ''
+    return valores
+
+
+def _formatar_coluna_monetaria(serie, valores):
+    import pandas as pd
+    if pd.api.types.is_numeric_dtype(serie.dtype) and not pd.api.types.is_bool_dtype(serie.dtype):
+        ausentes = serie.isna().to_numpy()
+        numeros = serie.to_numpy(dtype=float, na_value=0.0)
+        formatados = [f"R$ {numero:,.2f}".translate(_TROCA_SEPARADORES) for numero in numeros.tolist()]
+        return ["R$ 0,00" if ausente else texto for ausente, texto in zip(ausentes.tolist(), formatados)]
+    return [formatar_valor_monetario(valor) for valor in valores]
+
+
+def _formatar_coluna_data(serie, valores, data_hoje):
+    import pandas as pd
+    if pd.api.types.is_datetime64_any_dtype(serie.dtype):
+        return serie.dt.strftime("%d/%m/%Y").fillna(data_hoje).tolist()
+    # pd.to_datetime em um array infere um único formato para todos os valores;
+    # por isso cada valor distinto é convertido isoladamente, como na linha a linha
+    formatados = {}
+    resultado = []
+    for valor in valores:
+        chave = (type(valor), valor) # 1, 1.0 e True são chaves iguais em um dict
+        try:
+            texto = formatados[chave]
+        except KeyError:
+            texto = formatados[chave] = formatar_data(valor, data_hoje)
+        resultado.append(texto)
+    return resultado
+
+
+def _formatar_coluna_texto(serie, valores):
+    import pandas as pd
+    if pd.api.types.is_numeric_dtype(serie.dtype):
+        textos = serie.astype(str).to_numpy(dtype=object)
+        textos[serie.isna().to_numpy()] = ''
+        return textos.tolist()
+    return [str(valor) for valor in valores]
+
+
+def preparar_substituicoes_lote(df, posicoes=None):
+    """Prepara as substituições de várias linhas de uma vez, coluna a coluna.
+
+    Produz exatamente o mesmo que criar_substituicoes(df.iloc[p].fillna('').to_dict())
+    para cada posição, sem montar uma Series e um dict por linha. Retorna uma
+    lista de dicionários na ordem de 'posicoes' (padrão: todas as linhas).
+    """
+    parte = _parte_do_lote(df, posicoes)
+    if not len(parte):
+        return []
+
+    data_hoje = datetime.today().strftime("%d/%m/%Y")
+    colunas_formatadas = []
+    for coluna, placeholder in modelo_compilado.MAPEAMENTO_COLUNAS.items():
+        if coluna not in parte.columns:
+            vazio = criar_substituicoes({})[placeholder]
+            colunas_formatadas.append([vazio] * len(parte))
+            continue
+        serie = _coluna_do_lote(parte, coluna)
+        valores = _valores_linha(serie)
+        if coluna in ("Valor Rompedor", "Valor Kit"):
+            colunas_formatadas.append(_formatar_coluna_monetaria(serie, valores))
+        elif coluna == "Data":
+            colunas_formatadas.append(_formatar_coluna_data(serie, valores, data_hoje))
+        else:
+            colunas_formatadas.append(_formatar_coluna_texto(serie, valores))
+
+    placeholders = list(modelo_compilado.MAPEAMENTO_COLUNAS.values())
+    return [dict(zip(placeholders, linha)) for linha in zip(*colunas_formatadas)]
+
+
+def _dados_para_nome_lote(df, posicoes, colunas):
+    """Só as colunas que definir_nome_arquivo consulta, já preenchidas como nas linhas"""
+    parte = _parte_do_lote(df, posicoes)
+    usadas = {coluna for coluna in (colunas[-1:] + ['Cliente']) if coluna in parte.columns}
+    valores = {coluna: _valores_linha(_coluna_do_lote(parte, coluna)).tolist() for coluna in usadas}
+    return [{coluna: valores[coluna][i] for coluna in usadas} for i in range(len(parte))]
+
+
+def _limpar_nome_arquivo(nome):
+    """Nome seguro para arquivo e entrada de ZIP: sem subdiretórios, '..' nem caracteres de controle"""
+    nome = "".join(c for c in nome if unicodedata.category(c)[0] != "C")
+    nome = re.sub(r'[\\/:*?"<>|]', "-", nome) # Separadores e o que o Windows não aceita em nomes
+    nome = re.sub(r"\.{2,}", ".", nome)
+    nome = nome[:TAMANHO_MAX_NOME_ARQUIVO].strip(" .")
+    return nome or "Proposta_Gerada"
+
+
+def definir_nome_arquivo(dados_linha, colunas):
+    """Define o nome base do PDF a partir da última coluna da planilha (já limpo, igual em todas as saídas)"""
+    import pandas as pd
+    # AQUI ESTÁ A IMPLEMENTAÇÃO DO NOME DA ÚLTIMA COLUNA
+    try:
+        ultima_coluna = colunas[-1]
+        # Pega o valor da ultima coluna
+        nome_base_desejado = dados_linha.get(ultima_coluna, "")
+        if not nome_base_desejado or pd.isna(nome_base_desejado):
+            nome_cliente = str(dados_linha.get('Cliente', 'Proposta')).replace(' ', '_').replace('/','-')
+            nome_base_desejado = f"Proposta_{nome_cliente}_{datetime.now().strftime('%Y%m%d')}"
+    except Exception:
+        # Fallback original
+        nome_base_desejado = dados_linha.get("NOME DO ARQUIVO", "Proposta_Gerada")
+    return _limpar_nome_arquivo(str(nome_base_desejado))
+
+
+def selecionar_linhas_lote(df, linha_inicial, linha_final, filtro=""):
+    """Retorna as posições (base zero) das linhas do lote, aplicando o intervalo e o filtro opcional"""
+    posicoes = range(max(linha_inicial - 2, 0), min(linha_final - 1, len(df)))
+    if filtro and filtro.strip():
+        # Filtro no formato do pandas.DataFrame.query (ex.: `Estado` == "SP")
+        mascara = df.index.isin(df.query(filtro).index)
+        return [p for p in posicoes if mascara[p]]
+    return list(posicoes)
+
+
+def obter_plano_validado(modelo_bytes):
+    """Plano de renderização da análise do modelo (feita no upload); modelo inválido não chega ao LibreOffice"""
+    analise = modelo_compilado.analisar_modelo(modelo_bytes)
+    if analise.erro:
+        raise ValueError(f"Modelo ODT inválido: {analise.erro}")
+    return analise.plano
+
+
+def obter_esqueleto(modelo_bytes):
+    """Esqueleto do modelo, convertido pelo LibreOffice só na primeira vez"""
+    import esqueleto_pdf
+    return esqueleto_pdf.obter_esqueleto(
+        modelo_compilado.hash_modelo(modelo_bytes), obter_plano_validado(modelo_bytes),
+        lambda content_xml: converter_conteudo_em_pdf(modelo_bytes, content_xml)[0])
+
+
+def motor_efetivo(modelo_bytes, backend=None):
+    """Motor que de fato gera os PDFs do modelo: o escolhido, se o modelo for compatível; senão o LibreOffice"""
+    backend = backend or BACKEND_PDF_PADRAO
+    if backend == BACKEND_DIRETO:
+        import renderizador_direto
+        if renderizador_direto.preparar(modelo_bytes).compativel:
+            return BACKEND_DIRETO
+    if backend == BACKEND_ESQUELETO:
+        try:
+            if obter_esqueleto(modelo_bytes).compativel:
+                return BACKEND_ESQUELETO
+        except Exception as e:
+            logger.warning("Não foi possível preparar o esqueleto do modelo (%s). Usando o LibreOffice.", e)
+    if backend == BACKEND_MALA_DIRETA:
+        import mala_direta
+        if mala_direta.preparar(modelo_bytes).compativel:
+            return BACKEND_MALA_DIRETA
+    return BACKEND_LIBREOFFICE
+
+
+def calcular_chave_cache(modelo_bytes, substituicoes, direto=False):
+    """Chave do cache de PDFs; cada motor tem as suas entradas (os PDFs não são idênticos)
+
+    A mala direta usa as do LibreOffice: as páginas de cada proposta são as mesmas.
+    Ao guardar, direto é o motor que de fato gerou o PDF (ver converter_conteudo_em_pdf).
+    """
+    hash_modelo = modelo_compilado.hash_modelo(modelo_bytes)
+    return cache_pdf.calcular_chave(f"{hash_modelo}:{BACKEND_DIRETO}" if direto else hash_modelo, substituicoes)
+
+
+def converter_conteudo_em_pdf(modelo_bytes, content_xml_modificado, direto=False, cancelamento=None):
+    """PDF do 'content.xml' já substituído; se a renderização direta falhar, usa o LibreOffice.
+
+    Retorna (pdf_bytes, direto), com direto=True só se o PDF saiu do
+    renderizador direto: é o motor que vale para a chave do cache.
+    """
+    if direto:
+        try:
+            import renderizador_direto
+            return renderizador_direto.renderizar_pdf(modelo_bytes, content_xml_modificado), True
+        except Exception as e:
+            logger.warning("Renderização direta falhou (%s). Usando o LibreOffice.", e)
+    odt_bytes = criar_odt_modificado(modelo_bytes, content_xml_modificado)
+    return converter_odt_em_pdf(odt_bytes, cancelamento=cancelamento), False
+
+
+def converter_grupo_mala_direta(modelo_bytes, conteudos_xml):
+    """PDFs de várias propostas com uma única conversão pelo LibreOffice (ver mala_direta)"""
+    import mala_direta
+    conteudo_combinado = mala_direta.preparar(modelo_bytes).combinar(conteudos_xml)
+    odt_combinado = criar_odt_modificado(modelo_bytes, conteudo_combinado)
+    # O tempo limite cresce com o grupo: o custo por página continua sendo pago
+    pdf_combinado = converter_odt_em_pdf(odt_combinado, timeout=120 + 5 * len(conteudos_xml), destinos=True)
+    return mala_direta.dividir_pdf(pdf_combinado, len(conteudos_xml))
+
+
+def gerar_proposta_pdf(modelo_bytes, dados_linha, backend=None, ao_mudar_etapa=None, cancelamento=None):
+    """Gera o PDF de uma proposta (uma linha da planilha), usando o cache de PDFs
+
+    Com ao_mudar_etapa(texto), informa cada etapa (ex.: a geração em segundo
+    plano da interface); com um cancelamento.Cancelamento, pode ser
+    interrompida entre as etapas e durante a conversão (ConversaoCancelada).
+    """
+    def _etapa(texto):
+        if ao_mudar_etapa is not None:
+            ao_mudar_etapa(texto)
+
+    def _verificar():
+        if cancelamento is not None:
+            cancelamento.verificar()
+
+    substituicoes = criar_substituicoes(dados_linha)
+    if backend == BACKEND_ESQUELETO and ao_mudar_etapa is not None:
+        import esqueleto_pdf
+        if esqueleto_pdf.esqueleto_em_cache(modelo_compilado.hash_modelo(modelo_bytes)) is None:
+            _etapa("🧩 Preparando o esqueleto do modelo (só na primeira vez)...")
+    motor = motor_efetivo(modelo_bytes, backend)
+    if motor == BACKEND_ESQUELETO:
+        # Carimbar custa menos que ler o PDF do cache; sem carimbo, segue pelo LibreOffice (e pelo cache)
+        pdf_bytes = obter_esqueleto(modelo_bytes).carimbar(substituicoes)
+        if pdf_bytes is not None:
+            _etapa("🧩 Proposta carimbada sobre o esqueleto do modelo.")
+            return pdf_bytes
+    direto = motor == BACKEND_DIRETO
+    # Mesma proposta (modelo + valores) já gerada antes: devolve o PDF do cache
+    cache = cache_pdf.obter_cache()
+    chave_cache = calcular_chave_cache(modelo_bytes, substituicoes, direto)
+    pdf_bytes = cache.obter(chave_cache)
+    if pdf_bytes:
+        _etapa("♻️ Proposta recuperada do cache (já gerada anteriormente).")
+        return pdf_bytes
+
+    _verificar()
+    _etapa("1/4 - Extraindo conteúdo do modelo ODT...")
+    plano = obter_plano_validado(modelo_bytes)
+    _etapa("2/4 - Aplicando substituições nos dados...")
+    content_xml_modificado, _ = plano.renderizar(substituicoes)
+
+    if direto:
+        _etapa("3/3 - Renderizando o PDF sem LibreOffice...")
+        pdf_bytes, direto_pdf = converter_conteudo_em_pdf(modelo_bytes, content_xml_modificado, True, cancelamento)
+        if not direto_pdf:
+            chave_cache = calcular_chave_cache(modelo_bytes, substituicoes) # Caiu no LibreOffice
+    else:
+        _etapa("3/4 - Recriando arquivo ODT modificado...")
+        documento_odt_modificado = criar_odt_modificado(modelo_bytes, content_xml_modificado)
+        if not documento_odt_modificado:
+            raise ValueError("Falha ao recriar o arquivo ODT modificado.")
+        _verificar()
+        _etapa("4/4 - Convertendo para PDF... (pode levar alguns segundos)")
+        pdf_bytes = converter_odt_em_pdf(documento_odt_modificado, cancelamento=cancelamento)
+    if not pdf_bytes:
+        raise ValueError("Falha ao converter o documento ODT para PDF usando LibreOffice.")
+    cache.guardar(chave_cache, pdf_bytes)
+    _etapa("🎉 Proposta gerada com sucesso!")
+    return pdf_bytes
+
+
+def calcular_trabalhadores_conversao():
+    """Quantidade de conversões simultâneas: núcleos da CPU, limitada ao tamanho do pool do LibreOffice"""
+    nucleos = os.cpu_count() or 1
+    pool = pool_libreoffice.obter_pool()
+    if pool is not None:
+        return max(1, min(nucleos, pool.tamanho))
+    return nucleos
+
+
+def gerar_lote(df, posicoes, modelo_bytes, gravar_pdf, ao_progredir=None, max_trabalhadores=None, backend=None,
+               caminho_impressao=None):
+    """Gera um PDF por linha e entrega cada um a gravar_pdf(nome, bytes) assim que fica pronto.
+
+    As etapas leves (substituições e recriação do ODT) rodam na thread principal,
+    sobrepostas às conversões, que são distribuídas entre várias threads. No
+    máximo 2x o número de trabalhadores ficam na fila (contrapressão), o que
+    também limita quantos ODTs/PDFs ficam em memória ao mesmo tempo.
+    Com o motor "direto" e um modelo compatível, o PDF é renderizado sem
+    LibreOffice (e sem recriar o ODT); com o motor "esqueleto", os campos são
+    carimbados na thread principal e só as linhas sem carimbo são convertidas.
+    Com o motor "mala_direta", as linhas são convertidas em grupos, um único
+    documento por grupo; se o grupo falhar, suas linhas são convertidas uma a uma.
+    Com caminho_impressao, grava também um PDF único com todas as propostas, na
+    ordem das linhas (requer o pypdf).
+    Retorna (quantidade_gerada, lista_de_erros).
+    """
+    # Modelo validado e compilado uma única vez; cada linha vira um único join
+    plano = obter_plano_validado(modelo_bytes)
+
+    cache = cache_pdf.obter_cache()
+    motor = motor_efetivo(modelo_bytes, backend)
+    esqueleto = obter_esqueleto(modelo_bytes) if motor == BACKEND_ESQUELETO else None
+    direto = motor == BACKEND_DIRETO
+    trabalhadores = max_trabalhadores or calcular_trabalhadores_conversao()
+    limite_fila = trabalhadores * 2
+    colunas = list(df.columns)
+    nomes_usados = set()
+    erros = []
+    total = len(posicoes)
+    concluidos = 0
+    pendentes = {} # futuro -> lista de (posicao, numero_linha, nome_arquivo_pdf, chave_cache, content_xml, substituicoes)
+    # Grupos pequenos o bastante para ocupar todos os trabalhadores em lotes curtos
+    tamanho_grupo = max(1, min(TAMANHO_GRUPO_MALA_DIRETA, -(-total // trabalhadores)))
+    grupo = []
+    diretorio_impressao = None
+    if caminho_impressao:
+        import mala_direta
+        if not mala_direta.PYPDF_DISPONIVEL:
+            raise RuntimeError("O PDF único para impressão requer o pacote 'pypdf'.")
+        # Cada PDF vai para o disco com o nome na ordem da linha; no fim, são juntados
+        diretorio_impressao = tempfile.mkdtemp(prefix="impressao_")
+
+    def _entregar(posicao, nome_arquivo_pdf, pdf_bytes):
+        gravar_pdf(nome_arquivo_pdf, pdf_bytes)
+        if diretorio_impressao:
+            with open(os.path.join(diretorio_impressao, f"{posicao:010d}.pdf"), "wb") as f:
+                f.write(pdf_bytes)
+
+    def _registrar_conclusao(numero_linha):
+        nonlocal concluidos
+        concluidos += 1
+        if ao_progredir:
+            ao_progredir(concluidos, total, numero_linha)
+
+    def _coletar_prontos(bloquear):
+        """Grava os PDFs já convertidos (gravar_pdf só é chamado pela thread principal)"""
+        if not pendentes:
+            return
+        prontos, _ = wait(list(pendentes), timeout=None if bloquear else 0, return_when=FIRST_COMPLETED)
+        for futuro in prontos:
+            linhas = pendentes.pop(futuro)
+            pdfs = None
+            if len(linhas) > 1:
+                try:
+                    pdfs = futuro.result()
+                except Exception as e:
+                    logger.warning("Conversão em mala direta falhou (%s). Convertendo as %d linhas uma a uma.",
+                                   e, len(linhas))
+                    _submeter_uma_a_uma(linhas)
+                    continue
+            for indice, (posicao, numero_linha, nome_arquivo_pdf, chave_cache, _, substituicoes) in enumerate(linhas):
+                try:
+                    # O PDF vai direto para o destino e é liberado da memória em seguida
+                    pdf_bytes = futuro.result() if pdfs is None else pdfs[indice]
+                    if direto:
+                        pdf_bytes, direto_pdf = pdf_bytes
+                        if not direto_pdf:
+                            chave_cache = calcular_chave_cache(modelo_bytes, substituicoes) # Caiu no LibreOffice
+                    _entregar(posicao, nome_arquivo_pdf, pdf_bytes)
+                    cache.guardar(chave_cache, pdf_bytes)
+                except Exception as e:
+                    erros.append({"Linha": numero_linha, "Erro": str(e)})
+                _registrar_conclusao(numero_linha)
+
+    def _submeter_linha(linha):
+        """Conversão de uma única linha (fora da mala direta, ou quando o grupo falhou)"""
+        content_xml_modificado = linha[4]
+        if direto:
+            futuro = executor.submit(converter_conteudo_em_pdf, modelo_bytes, content_xml_modificado, True)
+        else:
+            documento_odt_modificado = criar_odt_modificado(modelo_bytes, content_xml_modificado)
+            if not documento_odt_modificado:
+                raise ValueError("Falha ao recriar o arquivo ODT modificado.")
+            futuro = executor.submit(converter_odt_em_pdf, documento_odt_modificado)
+        pendentes[futuro] = [linha]
+
+    def _submeter_uma_a_uma(linhas):
+        for linha in linhas:
+            try:
+                _submeter_linha(linha)
+            except Exception as e:
+                erros.append({"Linha": linha[1], "Erro": str(e)})
+                _registrar_conclusao(linha[1])
+
+    def _submeter_grupo():
+        linhas = list(grupo)
+        grupo.clear()
+        if len(linhas) > 1:
+            futuro = executor.submit(converter_grupo_mala_direta, modelo_bytes, [linha[4] for linha in linhas])
+            pendentes[futuro] = linhas
+        else:
+            _submeter_uma_a_uma(linhas)
+
+    def _linhas_preparadas():
+        """(posicao, dados_linha, substituicoes), preparados coluna a coluna em blocos"""
+        for inicio in range(0, total, TAMANHO_BLOCO_PREPARACAO):
+            bloco = posicoes[inicio:inicio + TAMANHO_BLOCO_PREPARACAO]
+            try:
+                substituicoes_bloco = preparar_substituicoes_lote(df, bloco)
+                dados_bloco = _dados_para_nome_lote(df, bloco, colunas)
+            except Exception:
+                # Preparação linha a linha, para que o erro fique só na linha problemática
+                substituicoes_bloco = dados_bloco = [None] * len(bloco)
+            yield from zip(bloco, dados_bloco, substituicoes_bloco)
+
+    try:
+        with ThreadPoolExecutor(max_workers=trabalhadores) as executor:
+            for posicao, dados_linha, substituicoes in _linhas_preparadas():
+                # Contrapressão: só prepara o próximo ODT quando há vaga na fila de conversão
+                while len(pendentes) >= limite_fila:
+                    _coletar_prontos(bloquear=True)
+                _coletar_prontos(bloquear=False)
+
+                numero_linha = posicao + 2 # Numeração da planilha (linha 1 é o cabeçalho)
+                try:
+                    if substituicoes is None:
+                        dados_linha = df.iloc[posicao].fillna('').to_dict()
+                        substituicoes = criar_substituicoes(dados_linha)
+
+                    # Evita sobrescrever PDFs com o mesmo nome no destino
+                    nome_base = definir_nome_arquivo(dados_linha, colunas)
+                    nome_arquivo_pdf = f"{nome_base}.pdf"
+                    sufixo = 2
+                    while nome_arquivo_pdf in nomes_usados:
+                        nome_arquivo_pdf = f"{nome_base}_{sufixo}.pdf"
+                        sufixo += 1
+                    nomes_usados.add(nome_arquivo_pdf)
+
+                    pdf_carimbado = esqueleto.carimbar(substituicoes) if esqueleto is not None else None
+                    if pdf_carimbado is not None:
+                        _entregar(posicao, nome_arquivo_pdf, pdf_carimbado)
+                        _registrar_conclusao(numero_linha)
+                        continue
+
+                    # Proposta idêntica já convertida antes: grava o PDF do cache sem passar pelo LibreOffice
+                    chave_cache = calcular_chave_cache(modelo_bytes, substituicoes, direto)
+                    pdf_em_cache = cache.obter(chave_cache)
+                    if pdf_em_cache:
+                        _entregar(posicao, nome_arquivo_pdf, pdf_em_cache)
+                        _registrar_conclusao(numero_linha)
+                        continue
+
+                    content_xml_modificado, _ = plano.renderizar(substituicoes)
+                    linha = (posicao, numero_linha, nome_arquivo_pdf, chave_cache, content_xml_modificado, substituicoes)
+                    if motor == BACKEND_MALA_DIRETA:
+                        grupo.append(linha)
+                        if len(grupo) >= tamanho_grupo:
+                            _submeter_grupo()
+                        continue
+                    _submeter_linha(linha)
+                except Exception as e:
+                    erros.append({"Linha": numero_linha, "Erro": str(e)})
+                    _registrar_conclusao(numero_linha)
+
+            _submeter_grupo()
+            while pendentes:
+                _coletar_prontos(bloquear=True)
+
+        if diretorio_impressao:
+            arquivos = sorted(os.listdir(diretorio_impressao))
+            if arquivos:
+                mala_direta.juntar_pdfs([os.path.join(diretorio_impressao, nome) for nome in arquivos],
+                                        caminho_impressao)
+    finally:
+        if diretorio_impressao:
+            shutil.rmtree(diretorio_impressao, ignore_errors=True)
+
+    erros.sort(key=lambda erro: erro["Linha"])
+    return total - len(erros), erros
+
+
+def gerar_lote_zip(df, posicoes, modelo_bytes, caminho_zip, ao_progredir=None, max_trabalhadores=None, backend=None,
+                   caminho_impressao=None):
+    """Gera o lote gravando cada PDF no ZIP em disco assim que fica pronto"""
+    with arquivo_lote.EscritorZipLote(caminho_zip) as zip_saida:
+        return gerar_lote(df, posicoes, modelo_bytes, zip_saida.adicionar, ao_progredir, max_trabalhadores, backend,
+                          caminho_impressao)
@@ -0,0 +1,125 @@
+"""Leitura e reempacotamento de arquivos ODT totalmente em memória.
+
+O reempacotamento copia os bytes já comprimidos dos membros inalterados
+(imagens, estilos, manifesto...) direto para o novo arquivo, sem
+descomprimir e comprimir de novo. Apenas os membros substituídos (em geral
+só o 'content.xml') são comprimidos. Conforme a especificação ODF, o membro
+'mimetype' é gravado primeiro e sem compressão.
+"""
+import io
+import zlib
+import struct
+import zipfile
+
+# Estruturas do formato ZIP (APPNOTE.TXT), as mesmas usadas pelo módulo zipfile
+_CABECALHO_LOCAL = struct.Struct("<4s2B4HL2L2H")
+_ASSINATURA_LOCAL = b"PK\003\004"
+_CABECALHO_CENTRAL = struct.Struct("<4s4B4HL2L5H2L")
+_ASSINATURA_CENTRAL = b"PK\001\002"
+_FIM_DIRETORIO = struct.Struct("<4s4H2LH")
+_ASSINATURA_FIM = b"PK\005\006"
+
+_FLAG_CRIPTOGRAFADO = 0x1
+_FLAG_DESCRITOR_DADOS = 0x8
+_FLAG_NOME_UTF8 = 0x800
+_VERSAO_EXTRACAO = 20
+_LIMITE_ZIP32 = 0xFFFFFFFF
+
+NIVEL_COMPRESSAO = 6
+
+
+def ler_membro(odt_bytes, nome='content.xml'):
+    """Lê um membro do ODT direto dos bytes, sem arquivo temporário"""
+    with zipfile.ZipFile(io.BytesIO(odt_bytes), 'r') as zip_ref:
+        return zip_ref.read(nome)
+
+
+def _data_hora_dos(date_time):
+    ano, mes, dia, hora, minuto, segundo = date_time
+    data = (max(ano, 1980) - 1980) << 9 | mes << 5 | dia
+    tempo = hora << 11 | minuto << 5 | segundo // 2
+    return data, tempo
+
+
+def _nome_codificado(nome):
+    try:
+        return nome.encode('ascii'), 0
+    except UnicodeEncodeError:
+        return nome.encode('utf-8'), _FLAG_NOME_UTF8
+
+
+def _dados_brutos(arquivo, info):
+    """Bytes comprimidos de um membro, exatamente como estão no ZIP original"""
+    arquivo.seek(info.header_offset)
+    cabecalho = arquivo.read(_CABECALHO_LOCAL.size)
+    campos = _CABECALHO_LOCAL.unpack(cabecalho)
+    if campos[0] != _ASSINATURA_LOCAL:
+        raise zipfile.BadZipFile(f"Cabeçalho local inválido para '{info.filename}'.")
+    tamanho_nome, tamanho_extra = campos[10], campos[11]
+    arquivo.seek(tamanho_nome + tamanho_extra, io.SEEK_CUR)
+    return arquivo.read(info.compress_size)
+
+
+def _comprimir(dados):
+    compressor = zlib.compressobj(NIVEL_COMPRESSAO, zlib.DEFLATED, -15)
+    return compressor.compress(dados) + compressor.flush()
+
+
+def reempacotar_odt(odt_bytes, membros_substituidos):
+    """Recria o ODT trocando apenas os membros informados ({nome: bytes}).
+
+    Levanta ValueError se o arquivo usar recursos não suportados pela cópia
+    direta (ZIP64 ou criptografia no nível do ZIP).
+    """
+    origem = io.BytesIO(odt_bytes)
+    with zipfile.ZipFile(origem, 'r') as zip_original:
+        infos = zip_original.infolist()
+
+    # 'mimetype' sempre primeiro, como exige a especificação ODF
+    infos.sort(key=lambda info: info.filename != 'mimetype')
+
+    saida = io.BytesIO()
+    diretorio_central = []
+    for info in infos:
+        if info.flag_bits & _FLAG_CRIPTOGRAFADO:
+            raise ValueError(f"Membro criptografado não suportado: '{info.filename}'.")
+        if max(info.compress_size, info.file_size, info.header_offset) >= _LIMITE_ZIP32:
+            raise ValueError(f"Membro ZIP64 não suportado: '{info.filename}'.")
+
+        nome_bytes, flags = _nome_codificado(info.filename)
+        if info.filename in membros_substituidos:
+            dados = membros_substituidos[info.filename]
+            crc, tamanho = zlib.crc32(dados), len(dados)
+            if info.filename == 'mimetype':
+                metodo, dados_gravados = zipfile.ZIP_STORED, dados
+            else:
+                metodo, dados_gravados = zipfile.ZIP_DEFLATED, _comprimir(dados)
+        elif info.filename == 'mimetype' and info.compress_type != zipfile.ZIP_STORED:
+            dados = ler_membro(odt_bytes, 'mimetype')
+            crc, tamanho = zlib.crc32(dados), len(dados)
+            metodo, dados_gravados = zipfile.ZIP_STORED, dados
+        else:
+            crc, tamanho, metodo = info.CRC, info.file_size, info.compress_type
+            dados_gravados = _dados_brutos(origem, info)
+            # Mantém as flags de compressão (bits 1-2); o descritor de dados não é usado
+            flags |= info.flag_bits & ~(_FLAG_DESCRITOR_DADOS | _FLAG_NOME_UTF8)
+
+        data, tempo = _data_hora_dos(info.date_time)
+        deslocamento = saida.tell()
+        saida.write(_CABECALHO_LOCAL.pack(
+            _ASSINATURA_LOCAL, _VERSAO_EXTRACAO, 0, flags, metodo, tempo, data,
+            crc, len(dados_gravados), tamanho, len(nome_bytes), 0))
+        saida.write(nome_bytes)
+        saida.write(dados_gravados)
+        diretorio_central.append(_CABECALHO_CENTRAL.pack(
+            _ASSINATURA_CENTRAL, _VERSAO_EXTRACAO, info.create_system, _VERSAO_EXTRACAO, 0,
+            flags, metodo, tempo, data, crc, len(dados_gravados), tamanho,
+            len(nome_bytes), 0, 0, 0, info.internal_attr, info.external_attr, deslocamento) + nome_bytes)
+
+    inicio_diretorio = saida.tell()
+    for entrada in diretorio_central:
+        saida.write(entrada)
+    saida.write(_FIM_DIRETORIO.pack(
+        _ASSINATURA_FIM, 0, 0, len(diretorio_central), len(diretorio_central),
+        saida.tell() - inicio_diretorio, inicio_diretorio, 0))
+    return saida.getvalue()
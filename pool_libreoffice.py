@@ -0,0 +1,325 @@
+"""Pool de instâncias persistentes do LibreOffice para conversão ODT -> PDF.
+
+Cada instância roda em modo headless, com perfil de usuário isolado
+(-env:UserInstallation) e aceita conversões pela ponte UNO por um pipe com
+nome único. Vários processos (interface, servidor HTTP, linha de comando)
+podem ter seus pools ao mesmo tempo: nenhum se conecta ao LibreOffice de
+outro, nem o mata ou encerra.
+O pool reinicia a instância após N conversões, quando a verificação de
+saúde falha ou quando a conversão quebra/estoura o tempo limite. Se a
+instância nem consegue subir, a conversão termina com PoolIndisponivel
+(o chamador pode recorrer à conversão avulsa pela linha de comando); as
+falhas do próprio documento seguem como estão.
+
+Configuração por variáveis de ambiente:
+    PROPOSTAS_POOL_LIBREOFFICE     tamanho do pool (0 desativa; padrão: núcleos da CPU)
+    PROPOSTAS_POOL_MAX_CONVERSOES  conversões por instância antes de reiniciar (padrão: 200)
+"""
+import os
+import sys
+import queue
+import signal
+import shutil
+import atexit
+import tempfile
+import threading
+import subprocess
+import time
+import uuid
+from pathlib import Path
+
+from cancelamento import ConversaoCancelada
+
+try:
+    import uno
+except ImportError:
+    # O módulo 'uno' vem com o LibreOffice; tenta o diretório padrão do programa
+    for _caminho_uno in ("/usr/lib/libreoffice/program", "/opt/libreoffice/program"):
+        if os.path.isdir(_caminho_uno) and _caminho_uno not in sys.path:
+            sys.path.append(_caminho_uno)
+    try:
+        import uno
+    except ImportError:
+        uno = None
+
+if uno is not None:
+    from com.sun.star.beans import PropertyValue
+    from com.sun.star.connection import NoConnectException
+
+UNO_DISPONIVEL = uno is not None
+
+TAMANHO_POOL = int(os.environ.get("PROPOSTAS_POOL_LIBREOFFICE", str(os.cpu_count() or 2)))
+MAX_CONVERSOES_POR_INSTANCIA = int(os.environ.get("PROPOSTAS_POOL_MAX_CONVERSOES", "200"))
+
+CAMINHOS_LIBREOFFICE = [
+    r"C:\Program Files\LibreOffice\program\soffice.exe",
+    r"C:\Program Files (x86)\LibreOffice\program\soffice.exe",
+    "/usr/bin/libreoffice",
+    "/Applications/LibreOffice.app/Contents/MacOS/soffice",
+    "/usr/bin/soffice"
+]
+
+
+class PoolIndisponivel(RuntimeError):
+    """A instância do LibreOffice do pool não pôde ser iniciada (não é falha do documento)"""
+
+
+def localizar_libreoffice():
+    """Retorna o caminho do executável do LibreOffice ou None"""
+    for path in CAMINHOS_LIBREOFFICE:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+# Em grupo de processos próprio: o soffice é só um lançador (oosplash -> soffice.bin),
+# e matar apenas ele deixaria a conversão rodando
+NOVA_SESSAO = os.name != 'nt'
+
+
+def matar_processo(processo):
+    """Mata o processo do LibreOffice e os que ele criou
+
+    O grupo é morto mesmo que o lançador já tenha terminado: o soffice.bin
+    continua no grupo dele e sobreviveria.
+    """
+    if NOVA_SESSAO:
+        try:
+            os.killpg(processo.pid, signal.SIGKILL)
+            return
+        except OSError:
+            pass
+    if processo.poll() is None:
+        processo.kill()
+
+
+def _propriedades(**valores):
+    """Monta a tupla de PropertyValue esperada pela API UNO"""
+    props = []
+    for nome, valor in valores.items():
+        prop = PropertyValue()
+        prop.Name = nome
+        prop.Value = valor
+        props.append(prop)
+    return tuple(props)
+
+
+class InstanciaLibreOffice:
+    """Um processo soffice headless com perfil próprio, controlado via UNO"""
+
+    def __init__(self, caminho_soffice):
+        self.caminho_soffice = caminho_soffice
+        # Nome único: só o soffice iniciado por esta instância atende neste pipe
+        self.pipe = f"propostas_{os.getpid()}_{uuid.uuid4().hex}"
+        self.perfil_dir = tempfile.mkdtemp(prefix="lo_perfil_")
+        self.trabalho_dir = tempfile.mkdtemp(prefix="lo_trabalho_")
+        self.processo = None
+        self.desktop = None
+        self.conversoes = 0
+
+    def iniciar(self, timeout=60):
+        comando = [
+            self.caminho_soffice,
+            '--headless', '--invisible', '--nologo', '--norestore',
+            '--nodefault', '--nolockcheck', '--nofirststartwizard',
+            f'-env:UserInstallation={Path(self.perfil_dir).as_uri()}',
+            f'--accept=pipe,name={self.pipe};urp;StarOffice.ComponentContext',
+        ]
+        self.processo = subprocess.Popen(comando, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                         start_new_session=NOVA_SESSAO)
+
+        contexto_local = uno.getComponentContext()
+        resolver = contexto_local.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", contexto_local)
+        limite = time.monotonic() + timeout
+        while True:
+            if self.processo.poll() is not None:
+                raise RuntimeError(f"LibreOffice encerrou ao iniciar (código {self.processo.returncode}).")
+            try:
+                contexto = resolver.resolve(f"uno:pipe,name={self.pipe};urp;StarOffice.ComponentContext")
+                break
+            except NoConnectException:
+                if time.monotonic() > limite:
+                    self.encerrar()
+                    raise TimeoutError(f"LibreOffice não aceitou conexões no pipe {self.pipe}.")
+                time.sleep(0.25)
+        if self.processo.poll() is not None:
+            # O pipe é só deste processo; se ele já terminou, quem respondeu não é o nosso LibreOffice
+            self.encerrar()
+            raise RuntimeError("LibreOffice encerrou durante a conexão.")
+
+        self.desktop = contexto.ServiceManager.createInstanceWithContext(
+            "com.sun.star.frame.Desktop", contexto)
+        self.conversoes = 0
+
+    def saudavel(self):
+        """Verificação de saúde: processo vivo e ponte UNO respondendo"""
+        if self.processo is None or self.processo.poll() is not None or self.desktop is None:
+            return False
+        try:
+            self.desktop.getComponents()
+            return True
+        except Exception:
+            return False
+
+    def converter(self, odt_bytes, destinos=False):
+        odt_path = os.path.join(self.trabalho_dir, f"doc_{self.conversoes}.odt")
+        pdf_path = os.path.join(self.trabalho_dir, f"doc_{self.conversoes}.pdf")
+        documento = None
+        try:
+            with open(odt_path, 'wb') as f:
+                f.write(odt_bytes)
+            documento = self.desktop.loadComponentFromURL(
+                Path(odt_path).as_uri(), "_blank", 0, _propriedades(Hidden=True, ReadOnly=True))
+            if documento is None:
+                raise RuntimeError("O arquivo ODT de origem não pôde ser carregado pelo LibreOffice.")
+            filtro = {"FilterName": "writer_pdf_Export"}
+            if destinos:
+                # Marcadores viram destinos nomeados no PDF (usados pela mala direta)
+                filtro["FilterData"] = uno.Any("[]com.sun.star.beans.PropertyValue",
+                                               _propriedades(ExportBookmarksToPDFDestination=True))
+            documento.storeToURL(Path(pdf_path).as_uri(), _propriedades(**filtro))
+            with open(pdf_path, 'rb') as f:
+                return f.read()
+        finally:
+            if documento is not None:
+                try:
+                    documento.close(True)
+                except Exception:
+                    pass
+            for caminho in (odt_path, pdf_path):
+                if os.path.exists(caminho):
+                    os.unlink(caminho)
+
+    def matar(self):
+        """Mata o processo imediatamente (usado no estouro de tempo e no cancelamento)"""
+        if self.processo is not None:
+            matar_processo(self.processo)
+
+    def encerrar(self):
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass
+            self.desktop = None
+        if self.processo is not None:
+            if self.processo.poll() is None:
+                self.processo.terminate()
+                try:
+                    self.processo.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    pass
+            # O terminate só alcança o lançador: o soffice.bin, no mesmo grupo, é morto junto
+            matar_processo(self.processo)
+            self.processo.wait()
+        self.processo = None
+        shutil.rmtree(self.perfil_dir, ignore_errors=True)
+        shutil.rmtree(self.trabalho_dir, ignore_errors=True)
+
+
+class PoolLibreOffice:
+    """Conjunto fixo de slots; cada slot guarda uma instância iniciada sob demanda"""
+
+    def __init__(self, caminho_soffice, tamanho=TAMANHO_POOL,
+                 max_conversoes=MAX_CONVERSOES_POR_INSTANCIA):
+        self.caminho_soffice = caminho_soffice
+        self.tamanho = tamanho
+        self.max_conversoes = max_conversoes
+        self._instancias = [None] * tamanho
+        # LIFO: reutiliza primeiro as instâncias já aquecidas; as demais só sobem sob concorrência
+        self._slots_livres = queue.LifoQueue()
+        for indice in reversed(range(tamanho)):
+            self._slots_livres.put(indice)
+        self.reinicios = 0
+
+    def _instancia_pronta(self, indice):
+        """Devolve a instância do slot, (re)iniciando se necessário"""
+        instancia = self._instancias[indice]
+        if instancia is not None and not instancia.saudavel():
+            instancia.encerrar()
+            instancia = None
+            self.reinicios += 1
+        if instancia is None:
+            instancia = InstanciaLibreOffice(self.caminho_soffice)
+            self._instancias[indice] = instancia
+            try:
+                instancia.iniciar()
+            except Exception as e:
+                self._instancias[indice] = None
+                instancia.encerrar()
+                raise PoolIndisponivel(f"LibreOffice do pool não iniciou: {e}") from e
+        return instancia
+
+    def converter(self, odt_bytes, timeout=120, destinos=False, cancelamento=None):
+        """Converte um ODT em PDF usando a próxima instância livre do pool"""
+        try:
+            indice = self._slots_livres.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("Nenhuma instância do LibreOffice ficou livre a tempo.")
+        if cancelamento is not None and cancelamento.cancelado:
+            self._slots_livres.put(indice)
+            raise ConversaoCancelada("A conversão foi cancelada.")
+
+        try:
+            instancia = self._instancia_pronta(indice)
+            estourou = threading.Event()
+
+            def _estouro():
+                estourou.set()
+                instancia.matar()
+
+            cronometro = threading.Timer(timeout, _estouro)
+            cronometro.start()
+            if cancelamento is not None:
+                cancelamento.registrar(instancia.matar)
+            try:
+                pdf_bytes = instancia.converter(odt_bytes, destinos=destinos)
+            except Exception:
+                # Instância possivelmente corrompida: descarta para reiniciar no próximo uso
+                instancia.encerrar()
+                self._instancias[indice] = None
+                if cancelamento is not None and cancelamento.cancelado:
+                    raise ConversaoCancelada("A conversão foi cancelada.")
+                if estourou.is_set():
+                    raise TimeoutError("A conversão para PDF excedeu o tempo limite.")
+                raise
+            finally:
+                cronometro.cancel()
+                if cancelamento is not None:
+                    cancelamento.remover(instancia.matar)
+
+            instancia.conversoes += 1
+            if instancia.conversoes >= self.max_conversoes:
+                instancia.encerrar()
+                self._instancias[indice] = None
+                self.reinicios += 1
+            return pdf_bytes
+        finally:
+            self._slots_livres.put(indice)
+
+    def encerrar(self):
+        for indice, instancia in enumerate(self._instancias):
+            if instancia is not None:
+                instancia.encerrar()
+                self._instancias[indice] = None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def obter_pool():
+    """Retorna o pool compartilhado do processo, ou None se indisponível"""
+    global _pool
+    if not UNO_DISPONIVEL or TAMANHO_POOL <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            caminho = localizar_libreoffice()
+            if caminho is None:
+                return None
+            _pool = PoolLibreOffice(caminho)
+            atexit.register(_pool.encerrar)
+        return _pool
+
@@ -0,0 +1,235 @@
+"""Pré-visualização da proposta em HTML, sem conversão para PDF.
+
+O 'content.xml' é renderizado pelo mesmo plano compilado da geração do PDF,
+com cada valor inserido entre dois marcadores; o corpo do documento vira um
+HTML leve (parágrafos, títulos, listas, tabelas, negrito/itálico/sublinhado,
+alinhamento e cor) em que os campos preenchidos aparecem destacados (<mark>).
+Não reproduz a paginação, o cabeçalho/rodapé nem as imagens: serve para
+conferir a linha antes de pagar a conversão pelo LibreOffice. Só usa a
+biblioteca padrão.
+"""
+import re
+import html
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+
+import cache_pdf
+import metricas
+import modelo_compilado
+import pacote_odt
+
+_NS = {
+    "office": "urn:oasis:names:tc:opendocument:xmlns:office:1.0",
+    "style": "urn:oasis:names:tc:opendocument:xmlns:style:1.0",
+    "text": "urn:oasis:names:tc:opendocument:xmlns:text:1.0",
+    "fo": "urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0",
+    "table": "urn:oasis:names:tc:opendocument:xmlns:table:1.0",
+    "draw": "urn:oasis:names:tc:opendocument:xmlns:drawing:1.0",
+}
+
+# Caracteres de uso privado (válidos em XML) que delimitam os valores inseridos
+_INICIO_CAMPO = "\ue000"
+_FIM_CAMPO = "\ue001"
+_ESPACOS = re.compile(r"\s+")
+
+
+def _q(nome):
+    """'text:p' -> '{urn...text...}p' (notação do ElementTree)"""
+    prefixo, local = nome.split(":")
+    return f"{{{_NS[prefixo]}}}{local}"
+
+
+# Sem texto visível na pré-visualização
+_IGNORADOS = frozenset(_q(nome) for nome in (
+    "text:note", "text:soft-page-break", "text:bookmark", "text:bookmark-start", "text:bookmark-end",
+    "text:sequence-decls", "text:variable-decls", "text:user-field-decls", "office:forms",
+    "table:table-columns", "table:table-column", "table:covered-table-cell", "text:tracked-changes",
+))
+_TEXTO_ALINHAMENTO = {"start": "left", "end": "right", "left": "left", "right": "right",
+                      "center": "center", "justify": "justify"}
+
+
+def _propriedades(estilo):
+    propriedades = {}
+    for filho in estilo:
+        if filho.tag in (_q("style:paragraph-properties"), _q("style:text-properties")):
+            propriedades.update(filho.attrib)
+    return propriedades
+
+
+def _definicoes(raiz):
+    """(família, nome) -> (nome_pai, propriedades) dos estilos de um XML do ODT"""
+    definicoes = {}
+    if raiz is None:
+        return definicoes
+    for bloco in ("office:styles", "office:automatic-styles"):
+        for container in raiz.iter(_q(bloco)):
+            for estilo in container.iter(_q("style:style")):
+                chave = (estilo.get(_q("style:family")), estilo.get(_q("style:name")))
+                definicoes[chave] = (estilo.get(_q("style:parent-style-name")), _propriedades(estilo))
+    return definicoes
+
+
+def _css(definicoes, familia, nome, cache):
+    """Declarações CSS do estilo, pela cadeia de pais (só o que a pré-visualização mostra)"""
+    chave = (familia, nome)
+    if chave in cache:
+        return cache[chave]
+    cadeia = []
+    visitados = set()
+    while nome and (familia, nome) in definicoes and nome not in visitados:
+        visitados.add(nome)
+        nome, propriedades = definicoes[(familia, nome)]
+        cadeia.append(propriedades)
+    resolvidas = {}
+    for propriedades in reversed(cadeia):
+        resolvidas.update(propriedades)
+
+    declaracoes = []
+    peso = resolvidas.get(_q("fo:font-weight"), "normal")
+    if peso == "bold" or (peso.isdigit() and int(peso) >= 600):
+        declaracoes.append("font-weight:bold")
+    if resolvidas.get(_q("fo:font-style"), "normal") in ("italic", "oblique"):
+        declaracoes.append("font-style:italic")
+    if resolvidas.get(_q("style:text-underline-style"), "none") != "none":
+        declaracoes.append("text-decoration:underline")
+    cor = resolvidas.get(_q("fo:color"), "")
+    if re.fullmatch(r"#[0-9a-fA-F]{6}", cor):
+        declaracoes.append(f"color:{cor}")
+    alinhamento = _TEXTO_ALINHAMENTO.get(resolvidas.get(_q("fo:text-align"), ""))
+    if familia == "paragraph" and alinhamento:
+        declaracoes.append(f"text-align:{alinhamento}")
+    cache[chave] = ";".join(declaracoes)
+    return cache[chave]
+
+
+class _Conversor:
+    """Corpo do 'content.xml' -> HTML"""
+
+    def __init__(self, definicoes):
+        self.definicoes = definicoes
+        self._css = {}
+
+    def _estilo(self, familia, elemento):
+        css = _css(self.definicoes, familia, elemento.get(_q("text:style-name")), self._css)
+        return f' style="{css}"' if css else ""
+
+    def _texto(self, texto):
+        return html.escape(_ESPACOS.sub(" ", texto or ""), quote=False)
+
+    def _conteudo(self, elemento):
+        """Texto e filhos de um elemento, com a cauda de cada filho"""
+        partes = [self._texto(elemento.text)]
+        for filho in elemento:
+            partes.append(self.elemento(filho))
+            partes.append(self._texto(filho.tail))
+        return "".join(partes)
+
+    def _filhos(self, elemento):
+        return "".join(self.elemento(filho) for filho in elemento)
+
+    def elemento(self, elemento):
+        tag = elemento.tag
+        if tag in _IGNORADOS:
+            return ""
+        if tag == _q("text:p"):
+            return f"<p{self._estilo('paragraph', elemento)}>{self._conteudo(elemento) or '&nbsp;'}</p>"
+        if tag == _q("text:h"):
+            nivel = min(max(int(elemento.get(_q("text:outline-level"), "1") or 1), 1), 6)
+            return f"<h{nivel}{self._estilo('paragraph', elemento)}>{self._conteudo(elemento)}</h{nivel}>"
+        if tag == _q("text:span"):
+            estilo = self._estilo("text", elemento)
+            conteudo = self._conteudo(elemento)
+            return f"<span{estilo}>{conteudo}</span>" if estilo else conteudo
+        if tag == _q("text:s"):
+            return "&nbsp;" * int(elemento.get(_q("text:c"), "1") or 1)
+        if tag == _q("text:tab"):
+            return "&emsp;"
+        if tag == _q("text:line-break"):
+            return "<br>"
+        if tag == _q("text:list"):
+            return f"<ul>{self._filhos(elemento)}</ul>"
+        if tag in (_q("text:list-item"), _q("text:list-header")):
+            return f"<li>{self._filhos(elemento)}</li>"
+        if tag == _q("table:table"):
+            return f"<table>{self._filhos(elemento)}</table>"
+        if tag == _q("table:table-row"):
+            return f"<tr>{self._filhos(elemento)}</tr>"
+        if tag == _q("table:table-cell"):
+            atributos = ""
+            for atributo, nome in (("table:number-columns-spanned", "colspan"), ("table:number-rows-spanned", "rowspan")):
+                valor = elemento.get(_q(atributo))
+                if valor and valor.isdigit() and int(valor) > 1:
+                    atributos += f' {nome}="{valor}"'
+            return f"<td{atributos}>{self._filhos(elemento)}</td>"
+        if tag == _q("draw:image"):
+            return '<span class="previa-imagem">[imagem]</span>'
+        # Contêineres (quadro, seção, link, grupos de linhas), campos (data, página,
+        # database-display...) e demais elementos: só o conteúdo interessa
+        return self._conteudo(elemento)
+
+
+MAX_MODELOS_EM_CACHE = 32
+MAX_PREVIAS_EM_CACHE = 64
+
+_estilos_modelos = OrderedDict()
+_previas = OrderedDict()
+_lock = threading.Lock()
+
+
+def _estilos_do_modelo(chave, modelo_bytes):
+    """Estilos nomeados do modelo (styles.xml), lidos apenas na primeira vez"""
+    with _lock:
+        definicoes = _estilos_modelos.get(chave)
+        if definicoes is not None:
+            _estilos_modelos.move_to_end(chave)
+            return definicoes
+
+    try:
+        definicoes = _definicoes(ET.fromstring(pacote_odt.ler_membro(modelo_bytes, "styles.xml")))
+    except (KeyError, ET.ParseError):
+        definicoes = {}
+
+    with _lock:
+        _estilos_modelos[chave] = definicoes
+        while len(_estilos_modelos) > MAX_MODELOS_EM_CACHE:
+            _estilos_modelos.popitem(last=False)
+    return definicoes
+
+
+@metricas.cronometrado("previa_html")
+def gerar_previa(modelo_bytes, substituicoes):
+    """HTML do corpo da proposta, com os campos preenchidos destacados; ValueError se o modelo for inválido"""
+    hash_modelo = modelo_compilado.hash_modelo(modelo_bytes)
+    chave = cache_pdf.calcular_chave(hash_modelo, substituicoes)
+    with _lock:
+        previa = _previas.get(chave)
+        if previa is not None:
+            _previas.move_to_end(chave)
+            return previa
+
+    # Valores escapados: a pré-visualização não pode quebrar com um '&' vindo da planilha
+    marcadas = {placeholder: f"{_INICIO_CAMPO}{escape(str(valor))}{_FIM_CAMPO}"
+                for placeholder, valor in substituicoes.items()}
+    content_xml, _ = modelo_compilado.obter_plano(modelo_bytes).renderizar(marcadas)
+    try:
+        raiz = ET.fromstring(content_xml.encode("utf-8"))
+    except ET.ParseError as e:
+        raise ValueError(f"Não foi possível ler o conteúdo do modelo: {e}")
+    corpo = raiz.find(f"{_q('office:body')}/{_q('office:text')}")
+    if corpo is None:
+        raise ValueError("O modelo não é um documento de texto.")
+
+    definicoes = dict(_estilos_do_modelo(hash_modelo, modelo_bytes))
+    definicoes.update(_definicoes(raiz)) # Estilos automáticos do próprio conteúdo
+    conversor = _Conversor(definicoes)
+    corpo_html = "".join(conversor.elemento(elemento) for elemento in corpo)
+    previa = corpo_html.replace(_INICIO_CAMPO, "<mark>").replace(_FIM_CAMPO, "</mark>")
+
+    with _lock:
+        _previas[chave] = previa
+        while len(_previas) > MAX_PREVIAS_EM_CACHE:
+            _previas.popitem(last=False)
+    return previa
@@ -0,0 +1,259 @@
+"""Registro persistente de modelos ODT, endereçado pelo conteúdo.
+
+Cada modelo é gravado em disco uma única vez, em um diretório com o hash do
+seu conteúdo (modelo_compilado.hash_modelo), junto com o que é derivado
+dele: o 'content.xml' já extraído e os campos reconhecidos (campos.json).
+Os nomes apontam para os hashes, com uma versão nova a cada vez que um
+modelo de mesmo nome chega com outro conteúdo. As sessões da interface e o
+servidor HTTP guardam só o hash. O servidor lê os bytes por obter, que
+os mantém em um cache em memória do processo; a interface lê por ler, sem
+cache, e os bytes ficam no armazem_sessoes enquanto alguma sessão os usa.
+Um processo novo reaproveita o 'content.xml' gravado em vez de
+descompactar o modelo de novo.
+
+Retenção: cada nome guarda só as últimas versões, e um modelo que nenhuma
+versão de nome referencia (versão descartada ou enviado sem nome) é
+apagado do disco quando passa do prazo sem ser registrado de novo. A
+coleta roda a cada modelo novo gravado, ou por coletar(). Vários processos
+podem usar o mesmo diretório: a gravação dos modelos, o nomes.json e a
+coleta ficam sob uma trava de arquivo (.lock, via fcntl; no Windows, só a
+trava entre threads do processo).
+
+Estrutura do diretório:
+    <hash>/modelo.odt, <hash>/content.xml, <hash>/campos.json
+    nomes.json    nome -> versões [{"versao", "hash", "registrado_em"}], da mais antiga à atual
+    .lock         trava entre processos
+
+Configuração por variável de ambiente:
+    PROPOSTAS_MODELOS_DIR            diretório do registro (padrão: ~/.gerador_propostas/modelos)
+    PROPOSTAS_MODELOS_MAX_VERSOES    versões mantidas por nome (padrão: 10; 0 mantém todas)
+    PROPOSTAS_MODELOS_RETENCAO_DIAS  dias até um modelo sem nome ser apagado (padrão: 30; 0 nunca apaga)
+"""
+import os
+import re
+import json
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+import modelo_compilado
+import pacote_odt
+
+logger = logging.getLogger(__name__)
+
+DIRETORIO_PADRAO = os.environ.get(
+    "PROPOSTAS_MODELOS_DIR", os.path.join(os.path.expanduser("~"), ".gerador_propostas", "modelos"))
+MAX_MODELOS_EM_MEMORIA = 32
+MAX_VERSOES_PADRAO = int(os.environ.get("PROPOSTAS_MODELOS_MAX_VERSOES", "10"))
+RETENCAO_PADRAO = float(os.environ.get("PROPOSTAS_MODELOS_RETENCAO_DIAS", "30")) * 86400
+
+_PADRAO_HASH = re.compile(r"[0-9a-f]{64}")
+
+
+def _gravar_atomico(caminho, dados):
+    """Grava em arquivo temporário e renomeia: leitores nunca veem um arquivo pela metade"""
+    fd, caminho_temp = tempfile.mkstemp(dir=os.path.dirname(caminho), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(dados)
+        os.replace(caminho_temp, caminho)
+    except OSError:
+        if os.path.exists(caminho_temp):
+            os.unlink(caminho_temp)
+        raise
+
+
+class RegistroModelos:
+    def __init__(self, diretorio=DIRETORIO_PADRAO, max_versoes=MAX_VERSOES_PADRAO, retencao=RETENCAO_PADRAO):
+        self.diretorio = diretorio
+        self.max_versoes = max_versoes
+        self.retencao = retencao
+        self._lock = threading.Lock()
+        self._lock_disco = threading.Lock()
+        self._em_memoria = OrderedDict() # hash -> bytes do modelo (LRU)
+        os.makedirs(self.diretorio, exist_ok=True)
+
+    @contextmanager
+    def _trava(self):
+        """Exclusão no disco entre as threads do processo e entre processos"""
+        with self._lock_disco:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.diretorio, ".lock"), "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _pasta(self, hash_modelo):
+        # O hash pode vir de fora (ex.: servidor HTTP): nunca vira um caminho arbitrário
+        if not isinstance(hash_modelo, str) or not _PADRAO_HASH.fullmatch(hash_modelo):
+            raise KeyError(hash_modelo)
+        return os.path.join(self.diretorio, hash_modelo)
+
+    def _guardar_em_memoria(self, hash_modelo, modelo_bytes):
+        with self._lock:
+            self._em_memoria[hash_modelo] = modelo_bytes
+            self._em_memoria.move_to_end(hash_modelo)
+            while len(self._em_memoria) > MAX_MODELOS_EM_MEMORIA:
+                self._em_memoria.popitem(last=False)
+
+    def registrar(self, modelo_bytes, nome=None, em_memoria=True):
+        """Valida e grava o modelo (só se ainda não estiver no registro); retorna o hash.
+
+        Um modelo inválido levanta ValueError e nunca é gravado. Com nome, o
+        hash vira a versão atual desse nome (se já não for). Com
+        em_memoria=False, os bytes não entram no cache em memória (quem os
+        mantém é o chamador, ex.: o armazem_sessoes).
+        """
+        analise = modelo_compilado.analisar_modelo(modelo_bytes)
+        if analise.erro:
+            raise ValueError(analise.erro)
+        pasta = self._pasta(analise.hash)
+        if em_memoria:
+            self._guardar_em_memoria(analise.hash, modelo_bytes)
+        try:
+            with self._trava():
+                caminho_modelo = os.path.join(pasta, "modelo.odt")
+                novo = not os.path.exists(caminho_modelo)
+                if novo:
+                    os.makedirs(pasta, exist_ok=True)
+                    _gravar_atomico(os.path.join(pasta, "content.xml"), pacote_odt.ler_membro(modelo_bytes, "content.xml"))
+                    _gravar_atomico(os.path.join(pasta, "campos.json"),
+                                    json.dumps(dict(analise.campos), ensure_ascii=False).encode("utf-8"))
+                    # Por último: a presença do modelo.odt marca o registro como completo
+                    _gravar_atomico(caminho_modelo, modelo_bytes)
+                else:
+                    os.utime(caminho_modelo) # Reenviado: o prazo de retenção recomeça
+                if nome:
+                    self._adicionar_versao(nome, analise.hash)
+                if novo:
+                    self._coletar()
+        except OSError as e:
+            # Sem disco, o modelo ainda serve a este processo pelo cache em memória
+            logger.warning("Não foi possível gravar o modelo no registro (%s).", e)
+            if not em_memoria:
+                self._guardar_em_memoria(analise.hash, modelo_bytes)
+        return analise.hash
+
+    def _ler_nomes(self):
+        try:
+            with open(os.path.join(self.diretorio, "nomes.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _adicionar_versao(self, nome, hash_modelo):
+        """Chamar com a trava de disco"""
+        nomes = self._ler_nomes() # Relido: outro processo pode ter registrado versões
+        versoes = nomes.setdefault(nome, [])
+        if versoes and versoes[-1]["hash"] == hash_modelo:
+            return
+        numero = versoes[-1].get("versao", len(versoes)) + 1 if versoes else 1
+        versoes.append({"versao": numero, "hash": hash_modelo, "registrado_em": time.time()})
+        if self.max_versoes > 0:
+            del versoes[:-self.max_versoes]
+        _gravar_atomico(os.path.join(self.diretorio, "nomes.json"),
+                        json.dumps(nomes, ensure_ascii=False, indent=1).encode("utf-8"))
+
+    def coletar(self):
+        """Apaga do disco os modelos sem nome há mais tempo que a retenção; retorna os hashes apagados"""
+        with self._trava():
+            return self._coletar()
+
+    def _coletar(self):
+        """Chamar com a trava de disco"""
+        if self.retencao <= 0:
+            return []
+        referenciados = {versao["hash"] for versoes in self._ler_nomes().values() for versao in versoes}
+        limite = time.time() - self.retencao
+        apagados = []
+        for hash_modelo in os.listdir(self.diretorio):
+            pasta = os.path.join(self.diretorio, hash_modelo)
+            if not _PADRAO_HASH.fullmatch(hash_modelo) or hash_modelo in referenciados or not os.path.isdir(pasta):
+                continue
+            caminho_modelo = os.path.join(pasta, "modelo.odt")
+            # Sem modelo.odt, a gravação foi interrompida: a pasta conta pela própria data
+            try:
+                ultimo_uso = os.path.getmtime(caminho_modelo if os.path.exists(caminho_modelo) else pasta)
+            except OSError:
+                continue
+            if ultimo_uso >= limite:
+                continue
+            shutil.rmtree(pasta, ignore_errors=True)
+            apagados.append(hash_modelo)
+        if apagados:
+            # Quem já tinha os bytes em memória (ex.: trabalhos na fila do servidor) continua atendido
+            logger.info("Registro de modelos: %d modelo(s) sem nome apagado(s) pela retenção.", len(apagados))
+        return apagados
+
+    def obter(self, hash_modelo):
+        """Bytes do modelo, guardados no cache em memória; KeyError se o hash não estiver no registro"""
+        with self._lock:
+            modelo_bytes = self._em_memoria.get(hash_modelo)
+            if modelo_bytes is not None:
+                self._em_memoria.move_to_end(hash_modelo)
+                return modelo_bytes
+        modelo_bytes = self.ler(hash_modelo)
+        self._guardar_em_memoria(hash_modelo, modelo_bytes)
+        return modelo_bytes
+
+    def ler(self, hash_modelo):
+        """Bytes do modelo sem guardá-los no cache em memória; KeyError se o hash não estiver no registro"""
+        with self._lock:
+            modelo_bytes = self._em_memoria.get(hash_modelo)
+        if modelo_bytes is not None:
+            return modelo_bytes
+        pasta = self._pasta(hash_modelo)
+        try:
+            with open(os.path.join(pasta, "modelo.odt"), "rb") as f:
+                modelo_bytes = f.read()
+            with open(os.path.join(pasta, "content.xml"), "rb") as f:
+                content_bytes = f.read()
+        except FileNotFoundError:
+            raise KeyError(hash_modelo)
+        # Análise e plano a partir do 'content.xml' gravado, sem descompactar o modelo
+        modelo_compilado.analisar_modelo(modelo_bytes, content_bytes)
+        return modelo_bytes
+
+    def campos(self, hash_modelo):
+        """Placeholders do modelo e suas ocorrências, sem carregar o modelo"""
+        try:
+            with open(os.path.join(self._pasta(hash_modelo), "campos.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return dict(modelo_compilado.analisar_modelo(self.ler(hash_modelo)).campos)
+
+    def versoes(self, nome):
+        """Versões do nome, da mais antiga à atual: [{"versao", "hash", "registrado_em"}]"""
+        return [dict(versao, versao=versao.get("versao", numero))
+                for numero, versao in enumerate(self._ler_nomes().get(nome, []), start=1)]
+
+    def listar(self):
+        """Versão atual de cada nome registrado, em ordem alfabética"""
+        return [{"nome": nome, **versoes[-1], "versao": versoes[-1].get("versao", len(versoes))}
+                for nome, versoes in sorted(self._ler_nomes().items()) if versoes]
+
+
+_registro = None
+_registro_lock = threading.Lock()
+
+
+def obter_registro():
+    """Registro compartilhado do processo (persiste entre reruns e sessões do Streamlit)"""
+    global _registro
+    with _registro_lock:
+        if _registro is None:
+            _registro = RegistroModelos()
+        return _registro
@@ -0,0 +1,406 @@
+"""Renderização direta do ODT em PDF, sem LibreOffice, para modelos simples.
+
+Modelos feitos só de parágrafos/títulos com texto formatado (fonte, tamanho,
+negrito, itálico, sublinhado, cor, alinhamento, recuos e espaçamentos) são
+desenhados em Python com o reportlab a partir do 'content.xml' já
+substituído e dos estilos do modelo. A verificação de compatibilidade
+(preparar) recusa o que não seria reproduzido fielmente: tabelas, imagens,
+listas, seções, campos calculados, cabeçalho/rodapé, colunas, bordas e fundos.
+Modelos recusados, ou sem o reportlab instalado (pip install reportlab),
+seguem pelo LibreOffice.
+
+Configuração por variável de ambiente:
+    PROPOSTAS_DIRETORIO_FONTES  diretório com as fontes TrueType Liberation
+                                (padrão: procura nos diretórios usuais do sistema)
+"""
+import io
+import os
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+
+import metricas
+import modelo_compilado
+import pacote_odt
+
+try:
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY, TA_LEFT, TA_RIGHT
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Spacer
+except ImportError:
+    ParagraphStyle = None
+
+REPORTLAB_DISPONIVEL = ParagraphStyle is not None
+
+_NS = {
+    "office": "urn:oasis:names:tc:opendocument:xmlns:office:1.0",
+    "style": "urn:oasis:names:tc:opendocument:xmlns:style:1.0",
+    "text": "urn:oasis:names:tc:opendocument:xmlns:text:1.0",
+    "fo": "urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0",
+    "svg": "urn:oasis:names:tc:opendocument:xmlns:svg-compatible:1.0",
+    "table": "urn:oasis:names:tc:opendocument:xmlns:table:1.0",
+    "draw": "urn:oasis:names:tc:opendocument:xmlns:drawing:1.0",
+}
+
+
+def _q(nome):
+    """'text:p' -> '{urn...text...}p' (notação do ElementTree)"""
+    prefixo, local = nome.split(":")
+    return f"{{{_NS[prefixo]}}}{local}"
+
+
+def _nome_curto(tag):
+    """'{urn...text...}p' -> 'text:p', para as mensagens de incompatibilidade"""
+    for prefixo, uri in _NS.items():
+        if tag.startswith(f"{{{uri}}}"):
+            return f"{prefixo}:{tag[len(uri) + 2:]}"
+    return tag
+
+
+# Elementos do corpo que o renderizador reproduz (ou ignora sem efeito visual)
+_ELEMENTOS_SUPORTADOS = frozenset(_q(nome) for nome in (
+    "text:p", "text:h", "text:span", "text:s", "text:tab", "text:line-break", "text:soft-page-break",
+    "text:database-display", "text:a", "text:bookmark", "text:bookmark-start", "text:bookmark-end",
+    "text:sequence-decls", "text:sequence-decl", "text:variable-decls", "text:user-field-decls",
+    "office:forms",
+))
+_ELEMENTOS_IGNORADOS = frozenset(_q(nome) for nome in (
+    "text:soft-page-break", "text:bookmark", "text:bookmark-start", "text:bookmark-end",
+    "text:sequence-decls", "text:variable-decls", "text:user-field-decls", "office:forms",
+))
+
+_FATOR_PONTOS = {"pt": 1.0, "cm": 72 / 2.54, "mm": 72 / 25.4, "in": 72.0, "pc": 12.0, "px": 0.75}
+_ALINHAMENTOS = {} if not REPORTLAB_DISPONIVEL else {
+    "start": TA_LEFT, "left": TA_LEFT, "center": TA_CENTER, "end": TA_RIGHT, "right": TA_RIGHT, "justify": TA_JUSTIFY,
+}
+ESPACOS_POR_TABULACAO = 4
+ENTRELINHA_PADRAO = 1.15 # Espaçamento simples do LibreOffice com as fontes Liberation
+FONTE_PADRAO_PT = 12.0
+
+_DIRETORIOS_FONTES = [d for d in (
+    os.environ.get("PROPOSTAS_DIRETORIO_FONTES"),
+    "/usr/share/fonts/truetype/liberation",
+    "/usr/share/fonts/truetype/liberation2",
+    "/usr/share/fonts/liberation",
+) if d]
+# Família genérica -> (fonte TrueType Liberation, fonte padrão do PDF como alternativa)
+_FAMILIAS = {
+    "sans": ("LiberationSans", ("Helvetica", "Helvetica-Bold", "Helvetica-Oblique", "Helvetica-BoldOblique")),
+    "serif": ("LiberationSerif", ("Times-Roman", "Times-Bold", "Times-Italic", "Times-BoldItalic")),
+    "mono": ("LiberationMono", ("Courier", "Courier-Bold", "Courier-Oblique", "Courier-BoldOblique")),
+}
+
+
+def _para_pontos(valor, referencia=None):
+    """'2cm', '12pt', '0.5in' -> pontos; '150%' usa a referência; None se não reconhecer"""
+    if not valor:
+        return None
+    valor = valor.strip()
+    if valor.endswith("%"):
+        return float(valor[:-1]) / 100 * referencia if referencia is not None else None
+    for unidade, fator in _FATOR_PONTOS.items():
+        if valor.endswith(unidade):
+            try:
+                return float(valor[:-len(unidade)]) * fator
+            except ValueError:
+                return None
+    return None
+
+
+_fontes = {}
+_fontes_lock = threading.Lock()
+
+
+def _fonte_da_familia(familia_generica, negrito=False, italico=False):
+    """Nome da fonte registrada no reportlab (Liberation, se houver no sistema; senão a padrão do PDF)"""
+    with _fontes_lock:
+        if familia_generica not in _fontes:
+            base, variantes = _FAMILIAS[familia_generica]
+            for diretorio in _DIRETORIOS_FONTES:
+                nomes = [f"{base}-{v}" for v in ("Regular", "Bold", "Italic", "BoldItalic")]
+                caminhos = [os.path.join(diretorio, f"{nome}.ttf") for nome in nomes]
+                if all(os.path.exists(caminho) for caminho in caminhos):
+                    for nome, caminho in zip(nomes, caminhos):
+                        pdfmetrics.registerFont(TTFont(nome, caminho))
+                    variantes = tuple(nomes)
+                    break
+            _fontes[familia_generica] = variantes
+        # A variante é escolhida aqui: <font name="..."> dentro de <b>/<i> anularia o negrito/itálico
+        return _fontes[familia_generica][negrito + 2 * italico]
+
+
+def _familia_generica(nome_fonte):
+    nome = (nome_fonte or "").lower()
+    if "mono" in nome or "courier" in nome or "consol" in nome:
+        return "mono"
+    if "sans" not in nome and ("serif" in nome or "times" in nome or "roman" in nome or "georgia" in nome):
+        return "serif"
+    return "sans"
+
+
+class _Estilos:
+    """Estilos do modelo (padrão, nomeados e automáticos), resolvidos pela herança"""
+
+    def __init__(self, raiz_estilos, raiz_conteudo):
+        self.definicoes = {} # (família, nome) -> (nome_pai, propriedades)
+        self.padroes = {} # família -> propriedades do style:default-style
+        self.fontes = {} # style:font-name -> família da fonte
+        self._resolvidos = {}
+        for raiz in (raiz_estilos, raiz_conteudo):
+            if raiz is None:
+                continue
+            for face in raiz.iter(_q("style:font-face")):
+                self.fontes[face.get(_q("style:name"))] = (face.get(_q("svg:font-family")) or "").strip("'\"")
+            for bloco in ("office:styles", "office:automatic-styles"):
+                for container in raiz.iter(_q(bloco)):
+                    for estilo in container:
+                        if estilo.tag == _q("style:default-style"):
+                            self.padroes[estilo.get(_q("style:family"))] = self._propriedades(estilo)
+                        elif estilo.tag == _q("style:style"):
+                            chave = (estilo.get(_q("style:family")), estilo.get(_q("style:name")))
+                            self.definicoes[chave] = (estilo.get(_q("style:parent-style-name")), self._propriedades(estilo))
+
+    @staticmethod
+    def _propriedades(estilo):
+        propriedades = {}
+        for filho in estilo:
+            if filho.tag in (_q("style:paragraph-properties"), _q("style:text-properties")):
+                for atributo, valor in filho.attrib.items():
+                    propriedades[_nome_curto(atributo)] = valor
+        return propriedades
+
+    def resolver(self, familia, nome):
+        """Propriedades efetivas do estilo: padrão da família + cadeia de pais + o próprio"""
+        chave = (familia, nome)
+        if chave not in self._resolvidos:
+            cadeia = []
+            visitados = set()
+            while nome and (familia, nome) in self.definicoes and nome not in visitados:
+                visitados.add(nome)
+                pai, propriedades = self.definicoes[(familia, nome)]
+                cadeia.append(propriedades)
+                nome = pai
+            resolvidas = dict(self.padroes.get(familia, {}))
+            for propriedades in reversed(cadeia):
+                resolvidas.update(propriedades)
+            self._resolvidos[chave] = resolvidas
+        return self._resolvidos[chave]
+
+
+def _visivel(valor):
+    return bool(valor) and valor not in ("none", "transparent", "0pt", "0cm", "0in")
+
+
+class ModeloDireto:
+    """Modelo preparado para a renderização direta (ou os motivos para não usá-la)"""
+
+    def __init__(self, modelo_bytes):
+        self.motivos = [] # Vazio: modelo compatível
+        self.estilos = None
+        self.pagina = None # (largura, altura, margem_sup, margem_inf, margem_esq, margem_dir) em pontos
+        if not REPORTLAB_DISPONIVEL:
+            self.motivos.append("O pacote 'reportlab' não está instalado.")
+            return
+        try:
+            raiz_conteudo = ET.fromstring(pacote_odt.ler_membro(modelo_bytes, "content.xml"))
+            try:
+                raiz_estilos = ET.fromstring(pacote_odt.ler_membro(modelo_bytes, "styles.xml"))
+            except KeyError:
+                raiz_estilos = None
+        except Exception as e:
+            self.motivos.append(f"Não foi possível ler o modelo: {e}")
+            return
+        self.estilos = _Estilos(raiz_estilos, raiz_conteudo)
+        self.pagina = self._ler_pagina(raiz_estilos)
+        self._verificar_corpo(raiz_conteudo)
+        self._verificar_estilos()
+
+    @property
+    def compativel(self):
+        return not self.motivos
+
+    def _ler_pagina(self, raiz_estilos):
+        largura, altura = A4
+        margens = [2 * _FATOR_PONTOS["cm"]] * 4
+        if raiz_estilos is None:
+            return (largura, altura, *margens)
+        layouts = {layout.get(_q("style:name")): layout for layout in raiz_estilos.iter(_q("style:page-layout"))}
+        mestres = list(raiz_estilos.iter(_q("style:master-page")))
+        mestre = next((m for m in mestres if m.get(_q("style:name")) == "Standard"), mestres[0] if mestres else None)
+        if mestre is None:
+            return (largura, altura, *margens)
+        for parte in ("style:header", "style:footer", "style:header-left", "style:footer-left"):
+            secao = mestre.find(_q(parte))
+            if secao is not None and secao.get(_q("style:display")) != "false" and len(secao):
+                self.motivos.append("O modelo tem cabeçalho ou rodapé.")
+                break
+        layout = layouts.get(mestre.get(_q("style:page-layout-name")))
+        propriedades = layout.find(_q("style:page-layout-properties")) if layout is not None else None
+        if propriedades is None:
+            return (largura, altura, *margens)
+        largura = _para_pontos(propriedades.get(_q("fo:page-width"))) or largura
+        altura = _para_pontos(propriedades.get(_q("fo:page-height"))) or altura
+        for i, lado in enumerate(("top", "bottom", "left", "right")):
+            margem = _para_pontos(propriedades.get(_q(f"fo:margin-{lado}")))
+            if margem is not None:
+                margens[i] = margem
+        colunas = propriedades.find(_q("style:columns"))
+        if colunas is not None and int(colunas.get(_q("fo:column-count"), "1") or 1) > 1:
+            self.motivos.append("A página tem mais de uma coluna.")
+        if _visivel(propriedades.get(_q("fo:border"))) or propriedades.find(_q("style:background-image")) is not None:
+            self.motivos.append("A página tem borda ou imagem de fundo.")
+        return (largura, altura, *margens)
+
+    def _verificar_corpo(self, raiz_conteudo):
+        corpo = raiz_conteudo.find(f"{_q('office:body')}/{_q('office:text')}")
+        if corpo is None:
+            self.motivos.append("O modelo não é um documento de texto.")
+            return
+        nao_suportados = sorted({_nome_curto(e.tag) for e in corpo.iter() if e is not corpo and e.tag not in _ELEMENTOS_SUPORTADOS})
+        if nao_suportados:
+            self.motivos.append(f"Elementos não suportados: {', '.join(nao_suportados)}.")
+        self._estilos_usados = {
+            ("paragraph" if e.tag in (_q("text:p"), _q("text:h")) else "text", e.get(_q("text:style-name")))
+            for e in corpo.iter() if e.get(_q("text:style-name"))
+        }
+
+    def _verificar_estilos(self):
+        for familia, nome in sorted(getattr(self, "_estilos_usados", ())):
+            propriedades = self.estilos.resolver(familia, nome)
+            if _visivel(propriedades.get("fo:border")) or any(
+                    _visivel(propriedades.get(f"fo:border-{lado}")) for lado in ("top", "bottom", "left", "right")):
+                self.motivos.append(f"O estilo '{nome}' tem bordas.")
+            if _visivel(propriedades.get("fo:background-color")):
+                self.motivos.append(f"O estilo '{nome}' tem cor de fundo.")
+            if propriedades.get("style:text-position", "0%").split()[0] not in ("0%", "0"):
+                self.motivos.append(f"O estilo '{nome}' usa sobrescrito/subscrito.")
+
+    # --- Renderização ---
+
+    def _formatacao_texto(self, propriedades, tamanho_pai):
+        """(fonte, tamanho, negrito, itálico, sublinhado, cor) das propriedades de texto"""
+        nome_fonte = self.estilos.fontes.get(propriedades.get("style:font-name")) or propriedades.get("fo:font-family")
+        tamanho = _para_pontos(propriedades.get("fo:font-size"), tamanho_pai) or tamanho_pai
+        peso = propriedades.get("fo:font-weight", "normal")
+        negrito = peso == "bold" or (peso.isdigit() and int(peso) >= 600)
+        italico = propriedades.get("fo:font-style", "normal") in ("italic", "oblique")
+        sublinhado = propriedades.get("style:text-underline-style", "none") != "none"
+        return nome_fonte, tamanho, negrito, italico, sublinhado, propriedades.get("fo:color")
+
+    def _marcacao(self, elemento, formatacao_pai):
+        """Conteúdo de um parágrafo na marcação de parágrafos do reportlab"""
+        partes = [escape(elemento.text or "")]
+        for filho in elemento:
+            if filho.tag in _ELEMENTOS_IGNORADOS:
+                pass
+            elif filho.tag == _q("text:s"):
+                partes.append("&nbsp;" * int(filho.get(_q("text:c"), "1") or 1))
+            elif filho.tag == _q("text:tab"):
+                partes.append("&nbsp;" * ESPACOS_POR_TABULACAO)
+            elif filho.tag == _q("text:line-break"):
+                partes.append("<br/>")
+            elif filho.tag == _q("text:span") and filho.get(_q("text:style-name")):
+                # O tamanho herdado já está resolvido: um tamanho em % do trecho é relativo a ele
+                combinadas = dict(formatacao_pai, **{"fo:font-size": f"{formatacao_pai['_tamanho']}pt"})
+                combinadas.update(self.estilos.resolver("text", filho.get(_q("text:style-name"))))
+                nome_fonte, tamanho, negrito, italico, sublinhado, cor = self._formatacao_texto(
+                    combinadas, formatacao_pai["_tamanho"])
+                conteudo = self._marcacao(filho, dict(combinadas, _tamanho=tamanho))
+                atributos = f'name="{_fonte_da_familia(_familia_generica(nome_fonte), negrito, italico)}" size="{tamanho:g}"'
+                if cor:
+                    atributos += f' color="{cor}"'
+                conteudo = f"<font {atributos}>{conteudo}</font>"
+                partes.append(f"<u>{conteudo}</u>" if sublinhado else conteudo)
+            else:
+                partes.append(self._marcacao(filho, formatacao_pai)) # span sem estilo, link, campo...
+            partes.append(escape(filho.tail or ""))
+        return "".join(partes)
+
+    def _paragrafo(self, elemento):
+        """Flowables do reportlab para um text:p/text:h"""
+        propriedades = self.estilos.resolver("paragraph", elemento.get(_q("text:style-name")))
+        nome_fonte, tamanho, negrito, italico, sublinhado, cor = self._formatacao_texto(propriedades, FONTE_PADRAO_PT)
+        entrelinha = _para_pontos(propriedades.get("fo:line-height"), tamanho * ENTRELINHA_PADRAO)
+        estilo = ParagraphStyle(
+            "p",
+            fontName=_fonte_da_familia(_familia_generica(nome_fonte), negrito, italico),
+            fontSize=tamanho,
+            leading=entrelinha or tamanho * ENTRELINHA_PADRAO,
+            alignment=_ALINHAMENTOS.get(propriedades.get("fo:text-align", "start"), TA_LEFT),
+            spaceBefore=_para_pontos(propriedades.get("fo:margin-top")) or 0,
+            spaceAfter=_para_pontos(propriedades.get("fo:margin-bottom")) or 0,
+            leftIndent=_para_pontos(propriedades.get("fo:margin-left")) or 0,
+            rightIndent=_para_pontos(propriedades.get("fo:margin-right")) or 0,
+            firstLineIndent=_para_pontos(propriedades.get("fo:text-indent")) or 0,
+            textColor=colors.HexColor(cor) if cor else colors.black,
+        )
+        flowables = []
+        if propriedades.get("fo:break-before") == "page":
+            flowables.append(PageBreak())
+        conteudo = self._marcacao(elemento, dict(propriedades, _tamanho=tamanho))
+        if conteudo.strip():
+            flowables.append(Paragraph(f"<u>{conteudo}</u>" if sublinhado else conteudo, estilo))
+        else:
+            # Parágrafo vazio ainda ocupa uma linha, como no LibreOffice
+            flowables.append(Spacer(1, estilo.leading + estilo.spaceBefore + estilo.spaceAfter))
+        if propriedades.get("fo:break-after") == "page":
+            flowables.append(PageBreak())
+        return flowables
+
+    def renderizar(self, content_xml):
+        """PDF (bytes) do 'content.xml' já substituído"""
+        corpo = ET.fromstring(content_xml.encode("utf-8")).find(f"{_q('office:body')}/{_q('office:text')}")
+        flowables = []
+        for elemento in corpo:
+            if elemento.tag in (_q("text:p"), _q("text:h")):
+                flowables.extend(self._paragrafo(elemento))
+        largura, altura, margem_sup, margem_inf, margem_esq, margem_dir = self.pagina
+        saida = io.BytesIO()
+        documento = SimpleDocTemplate(
+            saida, pagesize=(largura, altura), topMargin=margem_sup, bottomMargin=margem_inf,
+            leftMargin=margem_esq, rightMargin=margem_dir, invariant=True, # Mesmo conteúdo, mesmos bytes
+        )
+        documento.build(flowables or [Spacer(1, 1)])
+        return saida.getvalue()
+
+
+MAX_MODELOS_EM_CACHE = 32
+
+_modelos = OrderedDict()
+_modelos_lock = threading.Lock()
+# O reportlab mantém estado global (fontes, cache de métricas): uma renderização por vez.
+# Ele é Python puro, então threads em paralelo também não ganhariam tempo com o GIL.
+_renderizacao_lock = threading.Lock()
+
+
+def preparar(modelo_bytes):
+    """Verifica a compatibilidade e prepara os estilos do modelo, apenas na primeira vez"""
+    chave = modelo_compilado.hash_modelo(modelo_bytes)
+    with _modelos_lock:
+        modelo = _modelos.get(chave)
+        if modelo is not None:
+            _modelos.move_to_end(chave)
+            return modelo
+
+    modelo = ModeloDireto(modelo_bytes)
+
+    with _modelos_lock:
+        _modelos[chave] = modelo
+        while len(_modelos) > MAX_MODELOS_EM_CACHE:
+            _modelos.popitem(last=False)
+    return modelo
+
+
+@metricas.cronometrado("renderizar_pdf_direto")
+def renderizar_pdf(modelo_bytes, content_xml_modificado):
+    """Renderiza o PDF sem LibreOffice; ValueError se o modelo não for compatível"""
+    modelo = preparar(modelo_bytes)
+    if not modelo.compativel:
+        raise ValueError(f"Modelo incompatível com a renderização direta: {' '.join(modelo.motivos)}")
+    with _renderizacao_lock:
+        return modelo.renderizar(content_xml_modificado)
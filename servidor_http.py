@@ -0,0 +1,408 @@
+"""Serviço HTTP de geração de propostas para sistemas externos (ex.: CRM).
+
+As requisições só enfileiram trabalhos; as conversões rodam em um conjunto
+limitado de threads, então uma conversão lenta não bloqueia os demais
+clientes. Quando a fila atinge o limite, novos trabalhos recebem 503.
+
+Endpoints:
+    POST /modelos[?nome=...] corpo: bytes do .odt        -> {"modelo_hash": ..., "campos": {...}, "avisos": [...],
+                                                             "renderizacao_direta": {"compativel": ..., "motivos": [...]}}
+    GET  /modelos            modelos cadastrados (versão atual de cada nome)
+    POST /trabalhos          JSON: {"modelo_hash" | "modelo_base64", "dados": {...}, "nome_arquivo"?, "backend"?}
+                                                         -> 202 {"id": ..., "status": "na_fila"}
+    GET  /trabalhos/<id>     situação do trabalho
+    GET  /trabalhos/<id>/pdf PDF gerado (quando concluído)
+    POST /lotes              JSON: {"modelo_hash" | "modelo_base64", "linhas": [{...}, ...], "backend"?}
+                                                         -> 202 {"id": ..., "status": "na_fila"}
+    GET  /trabalhos/<id>/zip ZIP do lote, enviado do disco em blocos (quando concluído)
+    GET  /metricas           profundidade da fila, contadores e latência por etapa (JSON)
+    GET  /metrics            fila e histogramas de latência no formato texto do Prometheus
+
+"backend" escolhe o motor de PDF do trabalho: "libreoffice", "direto" (sem
+LibreOffice nos modelos compatíveis), "esqueleto" (carimba os campos sobre o
+PDF do modelo, convertido uma única vez) ou "mala_direta" (nos lotes, uma
+conversão por grupo de linhas); os incompatíveis caem no LibreOffice.
+
+Os modelos ficam no registro_modelos, compartilhado com a interface e
+persistente entre reinícios: um "modelo_hash" já cadastrado continua
+válido, e o mesmo conteúdo enviado de novo não é gravado duas vezes.
+
+Uso: python servidor_http.py [--host 127.0.0.1] [--porta 8502] [--trabalhadores N] [--fila-max 100]
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import urllib.parse
+import base64
+import shutil
+import argparse
+import tempfile
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+import arquivo_lote
+import metricas
+import modelo_compilado
+import registro_modelos
+import renderizador_direto
+from nucleo import (
+    BACKENDS_PDF, calcular_trabalhadores_conversao, definir_nome_arquivo, gerar_lote_zip, gerar_proposta_pdf,
+)
+
+TAMANHO_MAX_CORPO = 50 * 1024 * 1024
+VALIDADE_RESULTADOS = 3600 # segundos que um trabalho concluído fica disponível
+
+
+class Trabalho:
+    __slots__ = ("id", "tipo", "modelo_hash", "backend", "dados", "nome_arquivo", "status", "erro", "progresso",
+                 "erros_linhas", "criado_em", "iniciado_em", "concluido_em", "caminho_resultado")
+
+    def __init__(self, modelo_hash, dados, nome_arquivo, tipo="proposta", backend=None):
+        self.id = uuid.uuid4().hex
+        self.tipo = tipo # "proposta" (um PDF) ou "lote" (ZIP com um PDF por linha)
+        self.modelo_hash = modelo_hash
+        self.backend = backend # Motor de PDF (None: o padrão do nucleo)
+        self.dados = dados
+        self.nome_arquivo = nome_arquivo
+        self.status = "na_fila"
+        self.erro = None
+        self.progresso = (0, len(dados) if tipo == "lote" else 1)
+        self.erros_linhas = []
+        self.criado_em = time.time()
+        self.iniciado_em = None
+        self.concluido_em = None
+        self.caminho_resultado = None
+
+    def como_dict(self):
+        situacao = {
+            "id": self.id,
+            "tipo": self.tipo,
+            "status": self.status,
+            "erro": self.erro,
+            "nome_arquivo": self.nome_arquivo,
+            "criado_em": self.criado_em,
+            "iniciado_em": self.iniciado_em,
+            "concluido_em": self.concluido_em,
+        }
+        if self.tipo == "lote":
+            situacao["progresso"] = {"concluidos": self.progresso[0], "total": self.progresso[1]}
+            situacao["erros_linhas"] = self.erros_linhas
+        return situacao
+
+
+class FilaTrabalhos:
+    """Fila limitada de geração de PDFs, executada por um conjunto fixo de threads"""
+
+    def __init__(self, trabalhadores, fila_max, registro=None):
+        self.trabalhadores = trabalhadores
+        self.fila_max = fila_max
+        self.registro = registro or registro_modelos.obter_registro()
+        self._executor = ThreadPoolExecutor(max_workers=trabalhadores, thread_name_prefix="render")
+        self._trabalhos = {}
+        self._lock = threading.Lock()
+        self._diretorio = tempfile.mkdtemp(prefix="propostas_http_")
+        self.na_fila = 0
+        self.processando = 0
+        self.concluidos = 0
+        self.falhas = 0
+        self.rejeitados = 0
+
+    def registrar_modelo(self, modelo_bytes, nome=None):
+        """Valida o modelo antes de aceitá-lo; um modelo inválido nunca chega ao LibreOffice"""
+        return self.registro.registrar(modelo_bytes, nome)
+
+    def enfileirar(self, modelo_hash, dados, nome_arquivo, tipo="proposta", backend=None):
+        """Enfileira o trabalho; retorna None se a fila estiver cheia"""
+        self.registro.obter(modelo_hash) # KeyError se o modelo não estiver cadastrado
+        with self._lock:
+            if self.na_fila + self.processando >= self.fila_max:
+                self.rejeitados += 1
+                return None
+            trabalho = Trabalho(modelo_hash, dados, nome_arquivo, tipo, backend)
+            self._trabalhos[trabalho.id] = trabalho
+            self.na_fila += 1
+        self._executor.submit(self._executar, trabalho)
+        return trabalho
+
+    def obter(self, id_trabalho):
+        with self._lock:
+            return self._trabalhos.get(id_trabalho)
+
+    def _executar(self, trabalho):
+        with self._lock:
+            self.na_fila -= 1
+            self.processando += 1
+            trabalho.status = "processando"
+            trabalho.iniciado_em = time.time()
+        try:
+            try:
+                modelo_bytes = self.registro.obter(trabalho.modelo_hash)
+            except KeyError:
+                raise ValueError("Modelo removido do registro antes do processamento; envie-o novamente.")
+            if trabalho.tipo == "lote":
+                caminho_resultado = self._gerar_zip(trabalho, modelo_bytes)
+            else:
+                pdf_bytes = gerar_proposta_pdf(modelo_bytes, trabalho.dados, trabalho.backend)
+                caminho_resultado = os.path.join(self._diretorio, f"{trabalho.id}.pdf")
+                with open(caminho_resultado, "wb") as f:
+                    f.write(pdf_bytes)
+            with self._lock:
+                trabalho.caminho_resultado = caminho_resultado
+                trabalho.status = "concluido"
+                self.concluidos += 1
+        except Exception as e:
+            with self._lock:
+                trabalho.status = "erro"
+                trabalho.erro = str(e)
+                self.falhas += 1
+        finally:
+            with self._lock:
+                self.processando -= 1
+                trabalho.concluido_em = time.time()
+                trabalho.dados = None # Os dados da linha não são mais necessários
+            self._remover_expirados()
+
+    def _gerar_zip(self, trabalho, modelo_bytes):
+        """Gera o lote direto para um ZIP em disco; cada PDF é liberado assim que gravado"""
+        def _progresso(concluidos, total, numero_linha):
+            trabalho.progresso = (concluidos, total)
+
+        df = pd.DataFrame(trabalho.dados)
+        caminho_zip = os.path.join(self._diretorio, f"{trabalho.id}.zip")
+        # Um conversor por lote: o lote já ocupa um dos trabalhadores da fila, e com mais
+        # conversores internos o limite de --trabalhadores viraria N² conversões simultâneas
+        _, erros = gerar_lote_zip(df, list(range(len(df))), modelo_bytes, caminho_zip,
+                                  _progresso, 1, trabalho.backend)
+        with self._lock:
+            trabalho.erros_linhas = erros
+        return caminho_zip
+
+    def _remover_expirados(self):
+        limite = time.time() - VALIDADE_RESULTADOS
+        with self._lock:
+            expirados = [t for t in self._trabalhos.values()
+                         if t.concluido_em is not None and t.concluido_em < limite]
+            for trabalho in expirados:
+                del self._trabalhos[trabalho.id]
+                if trabalho.caminho_resultado and os.path.exists(trabalho.caminho_resultado):
+                    os.unlink(trabalho.caminho_resultado)
+
+    def metricas(self):
+        modelos = len(self.registro.listar())
+        with self._lock:
+            return {
+                "trabalhadores": self.trabalhadores,
+                "fila_max": self.fila_max,
+                "na_fila": self.na_fila,
+                "processando": self.processando,
+                "concluidos": self.concluidos,
+                "falhas": self.falhas,
+                "rejeitados": self.rejeitados,
+                "modelos": modelos,
+            }
+
+    def encerrar(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        shutil.rmtree(self._diretorio, ignore_errors=True)
+
+
+class CorpoInvalido(ValueError):
+    """Corpo da requisição que não pode ser lido, com o código HTTP da resposta"""
+
+    def __init__(self, codigo, mensagem):
+        super().__init__(mensagem)
+        self.codigo = codigo
+        self.mensagem = mensagem
+
+
+class ManipuladorPropostas(BaseHTTPRequestHandler):
+    fila = None # Definida em criar_servidor
+
+    def _responder_json(self, status, corpo):
+        dados = json.dumps(corpo, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _responder_prometheus(self):
+        linhas = [metricas.exportar_prometheus()]
+        for nome, valor in self.fila.metricas().items():
+            tipo = "counter" if nome in ("concluidos", "falhas", "rejeitados") else "gauge"
+            linhas.append(f"# TYPE propostas_fila_{nome} {tipo}\npropostas_fila_{nome} {valor}\n")
+        dados = "".join(linhas).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _ler_corpo(self):
+        """Corpo da requisição; CorpoInvalido se o Content-Length for inválido ou grande demais"""
+        try:
+            tamanho = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            raise CorpoInvalido(400, "Content-Length inválido.")
+        if tamanho < 0:
+            raise CorpoInvalido(400, "Content-Length inválido.") # rfile.read(-1) leria até o fim da conexão
+        if tamanho > TAMANHO_MAX_CORPO:
+            raise CorpoInvalido(413, "Corpo da requisição muito grande.")
+        return self.rfile.read(tamanho)
+
+    def do_POST(self):
+        try:
+            corpo = self._ler_corpo()
+        except CorpoInvalido as e:
+            self._responder_json(e.codigo, {"erro": e.mensagem})
+            return
+
+        caminho, _, consulta = self.path.partition("?")
+        if caminho == "/modelos":
+            if not corpo:
+                self._responder_json(400, {"erro": "Envie os bytes do modelo .odt no corpo."})
+                return
+            nome = urllib.parse.parse_qs(consulta).get("nome", [None])[0]
+            try:
+                modelo_hash = self.fila.registrar_modelo(corpo, nome)
+            except ValueError as e:
+                self._responder_json(400, {"erro": str(e)})
+                return
+            analise = modelo_compilado.analisar_modelo(corpo)
+            modelo_direto = renderizador_direto.preparar(corpo)
+            self._responder_json(201, {"modelo_hash": modelo_hash, "campos": dict(analise.campos),
+                                       "avisos": analise.avisos(),
+                                       "renderizacao_direta": {"compativel": modelo_direto.compativel,
+                                                               "motivos": modelo_direto.motivos}})
+            return
+
+        if caminho not in ("/trabalhos", "/lotes"):
+            self._responder_json(404, {"erro": "Rota não encontrada."})
+            return
+
+        try:
+            pedido = json.loads(corpo or b"{}")
+            if "modelo_base64" in pedido:
+                modelo_hash = self.fila.registrar_modelo(base64.b64decode(pedido["modelo_base64"]))
+            else:
+                modelo_hash = pedido["modelo_hash"]
+            backend = pedido.get("backend")
+            if backend is not None and backend not in BACKENDS_PDF:
+                raise ValueError(f"'backend' deve ser um de: {', '.join(BACKENDS_PDF)}.")
+            if caminho == "/lotes":
+                linhas = pedido["linhas"]
+                if not isinstance(linhas, list) or not linhas or not all(isinstance(linha, dict) for linha in linhas):
+                    raise ValueError("'linhas' deve ser uma lista não vazia de objetos com as colunas.")
+                nome_arquivo = pedido.get("nome_arquivo") or f"Propostas_{time.strftime('%Y%m%d_%H%M')}"
+                trabalho = self.fila.enfileirar(modelo_hash, linhas, nome_arquivo, tipo="lote", backend=backend)
+            else:
+                dados = pedido["dados"]
+                if not isinstance(dados, dict):
+                    raise ValueError("'dados' deve ser um objeto com as colunas da linha.")
+                # Sem nome explícito, vale a mesma regra da interface (última coluna da linha)
+                nome_arquivo = pedido.get("nome_arquivo") or definir_nome_arquivo(dados, list(dados))
+                trabalho = self.fila.enfileirar(modelo_hash, dados, nome_arquivo, backend=backend)
+        except KeyError as e:
+            self._responder_json(400, {"erro": f"Campo ou modelo ausente: {e}"})
+            return
+        except ValueError as e:
+            self._responder_json(400, {"erro": str(e)})
+            return
+
+        if trabalho is None:
+            self._responder_json(503, {"erro": "Fila cheia, tente novamente mais tarde."})
+            return
+        self._responder_json(202, trabalho.como_dict())
+
+    def do_GET(self):
+        partes = [p for p in self.path.partition("?")[0].split("/") if p]
+        if partes == ["modelos"]:
+            self._responder_json(200, {"modelos": self.fila.registro.listar()})
+            return
+        if partes == ["metricas"]:
+            self._responder_json(200, dict(self.fila.metricas(), etapas=metricas.exportar_json()))
+            return
+        if partes == ["metrics"]:
+            self._responder_prometheus()
+            return
+        if len(partes) in (2, 3) and partes[0] == "trabalhos":
+            trabalho = self.fila.obter(partes[1])
+            if trabalho is None:
+                self._responder_json(404, {"erro": "Trabalho não encontrado."})
+                return
+            if len(partes) == 2:
+                self._responder_json(200, trabalho.como_dict())
+                return
+            if (partes[2], trabalho.tipo) in (("pdf", "proposta"), ("zip", "lote")):
+                self._enviar_arquivo(trabalho)
+                return
+        self._responder_json(404, {"erro": "Rota não encontrada."})
+
+    def _enviar_arquivo(self, trabalho):
+        if trabalho.status != "concluido":
+            self._responder_json(409, {"erro": f"Trabalho ainda não concluído ({trabalho.status})."})
+            return
+        extensao, tipo_conteudo = ("zip", "application/zip") if trabalho.tipo == "lote" else ("pdf", "application/pdf")
+        try:
+            tamanho = os.path.getsize(trabalho.caminho_resultado)
+            blocos = arquivo_lote.iterar_blocos_arquivo(trabalho.caminho_resultado)
+            primeiro_bloco = next(blocos, b"")
+        except FileNotFoundError:
+            self._responder_json(410, {"erro": "Arquivo expirado."})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", tipo_conteudo)
+        self.send_header("Content-Length", str(tamanho))
+        self.send_header("Content-Disposition", _disposicao_anexo(trabalho.nome_arquivo, extensao))
+        self.end_headers()
+        # Enviado do disco em blocos: o arquivo nunca fica inteiro em memória
+        self.wfile.write(primeiro_bloco)
+        for bloco in blocos:
+            self.wfile.write(bloco)
+
+    def log_message(self, formato, *args):
+        sys.stderr.write(f"[servidor_http] {self.address_string()} - {formato % args}\n")
+
+
+def _disposicao_anexo(nome_arquivo, extensao):
+    """Content-Disposition do download: nome ASCII para clientes antigos e o nome em UTF-8 (RFC 5987)"""
+    # O nome vem do cliente ou da planilha: sem caracteres de controle (CR/LF injetariam cabeçalhos)
+    nome = "".join(c for c in nome_arquivo if unicodedata.category(c)[0] != "C").replace("/", "-").replace("\\", "-")
+    nome_ascii = unicodedata.normalize("NFKD", nome).encode("ascii", "ignore").decode("ascii").replace('"', "")
+    nome_utf8 = urllib.parse.quote(f"{nome}.{extensao}", safe="")
+    return f'attachment; filename="{nome_ascii or "arquivo"}.{extensao}"; filename*=UTF-8\'\'{nome_utf8}'
+
+
+def criar_servidor(host, porta, trabalhadores=None, fila_max=100):
+    fila = FilaTrabalhos(trabalhadores or calcular_trabalhadores_conversao(), fila_max)
+    manipulador = type("Manipulador", (ManipuladorPropostas,), {"fila": fila})
+    return ThreadingHTTPServer((host, porta), manipulador), fila
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serviço HTTP de geração de propostas em PDF.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8502)
+    parser.add_argument("--trabalhadores", type=int, help="Conversões simultâneas (padrão: núcleos da CPU)")
+    parser.add_argument("--fila-max", type=int, default=100, help="Trabalhos pendentes antes de recusar (503)")
+    args = parser.parse_args(argv)
+
+    servidor, fila = criar_servidor(args.host, args.porta, args.trabalhadores, args.fila_max)
+    print(f"Servindo em http://{args.host}:{args.porta} ({fila.trabalhadores} trabalhadores)", file=sys.stderr)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        fila.encerrar()
+
+
+if __name__ == "__main__":
+    main()